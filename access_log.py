@@ -0,0 +1,295 @@
+"""
+Smart Lock Access Log
+Append-only, segmented event log per lock with per-segment time indexes
+"""
+
+import asyncio
+import bisect
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# One event = 64 bytes: timestamp, action, flags, who (20), tx hash (32)
+RECORD = struct.Struct("<dBB2x20s32s")
+# Sparse time index entry: timestamp of record N, N
+INDEX_ENTRY = struct.Struct("<dQ")
+
+SEGMENT_RECORDS = 1 << 16
+INDEX_EVERY = 128
+
+ACTIONS = ["unknown", "unlock", "lock", "auto_lock"]
+_ACTION_CODES = {name: code for code, name in enumerate(ACTIONS)}
+_WHO_IS_ADDRESS = 0x01
+
+
+def _encode_who(who: Optional[str]) -> Tuple[int, bytes]:
+    """Wallet addresses are stored as 20 raw bytes, anything else as a label."""
+    if who and who.startswith("0x") and len(who) == 42:
+        try:
+            return _WHO_IS_ADDRESS, bytes.fromhex(who[2:])
+        except ValueError:
+            pass
+    return 0, (who or "").encode("utf-8")[:20]
+
+
+def _decode_who(flags: int, raw: bytes) -> str:
+    if flags & _WHO_IS_ADDRESS:
+        return "0x" + raw.hex()
+    return raw.rstrip(b"\0").decode("utf-8", errors="replace")
+
+
+def _encode_tx(tx_hash: Optional[str]) -> bytes:
+    if tx_hash and tx_hash.startswith("0x") and len(tx_hash) == 66:
+        try:
+            return bytes.fromhex(tx_hash[2:])
+        except ValueError:
+            pass
+    return b"\0" * 32
+
+
+class _Segment:
+    def __init__(self, directory: str, seq: int):
+        self.seq = seq
+        self.path = os.path.join(directory, f"{seq:08d}.seg")
+        self.index_path = os.path.join(directory, f"{seq:08d}.idx")
+        self.index_ts: List[float] = []
+        self.index_rec: List[int] = []
+        self.records = 0
+        # Records already on disk; queries never read past this
+        self.flushed = 0
+        self.first_ts: Optional[float] = None
+        self.last_ts: Optional[float] = None
+
+    def load(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            for ts, rec in INDEX_ENTRY.iter_unpack(data[:usable]):
+                self.index_ts.append(ts)
+                self.index_rec.append(rec)
+        if os.path.exists(self.path):
+            self.records = os.path.getsize(self.path) // RECORD.size
+            self.flushed = self.records
+        if self.records:
+            with open(self.path, "rb") as f:
+                self.first_ts = RECORD.unpack(f.read(RECORD.size))[0]
+                f.seek((self.records - 1) * RECORD.size)
+                self.last_ts = RECORD.unpack(f.read(RECORD.size))[0]
+
+    def seek_record(self, since: float) -> int:
+        """Record number of the index block that may contain `since`."""
+        position = bisect.bisect_right(self.index_ts, since) - 1
+        return self.index_rec[position] if position >= 0 else 0
+
+
+class LockAccessLog:
+    """
+    Event log for one lock. Records are fixed-size and time-ordered, each
+    segment keeps a sparse (timestamp, record) index, and segment first
+    timestamps are bisected in memory, so a time-range query reads only the
+    blocks it returns.
+
+    Once buffered (AccessLogStore.run()), append() only packs the record and
+    flush() writes it, so the event loop never touches the segment files.
+    query() flushes first and does blocking reads: run it in a thread.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Held while segment files are written or read, so a query never
+        # sees records that are still being flushed
+        self._io_lock = threading.Lock()
+        self.buffered = False
+        # (segment, record, index entry or None) waiting for flush()
+        self._pending: List[Tuple[_Segment, bytes, Optional[bytes]]] = []
+        self.segments: List[_Segment] = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".seg"):
+                segment = _Segment(directory, int(name[:-4]))
+                segment.load()
+                self.segments.append(segment)
+        if not self.segments:
+            self.segments.append(_Segment(directory, 0))
+        self._first_ts = [s.first_ts if s.first_ts is not None else float("inf") for s in self.segments]
+        self._last_ts = max((s.last_ts for s in self.segments if s.last_ts is not None), default=0.0)
+
+    @property
+    def count(self) -> int:
+        return sum(s.records for s in self.segments)
+
+    def append(self, action: str, who: Optional[str], tx_hash: Optional[str] = None,
+               timestamp: Optional[float] = None) -> float:
+        with self._lock:
+            # Keep the log monotonic so binary search stays valid
+            ts = max(timestamp if timestamp is not None else time.time(), self._last_ts)
+            segment = self.segments[-1]
+            if segment.records >= SEGMENT_RECORDS:
+                segment = _Segment(self.directory, segment.seq + 1)
+                self.segments.append(segment)
+                self._first_ts.append(float("inf"))
+
+            flags, who_bytes = _encode_who(who)
+            record = RECORD.pack(ts, _ACTION_CODES.get(action, 0), flags, who_bytes, _encode_tx(tx_hash))
+            index_entry = None
+            if segment.records % INDEX_EVERY == 0:
+                index_entry = INDEX_ENTRY.pack(ts, segment.records)
+                segment.index_ts.append(ts)
+                segment.index_rec.append(segment.records)
+            if segment.first_ts is None:
+                segment.first_ts = ts
+                self._first_ts[-1] = ts
+            segment.last_ts = ts
+            segment.records += 1
+            self._last_ts = ts
+            self._pending.append((segment, record, index_entry))
+
+        if not self.buffered:
+            # Writer not running (e.g. scripts): write through
+            self.flush()
+        return ts
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self):
+        """Write buffered records to their segment files. Blocking."""
+        with self._io_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        written = 0
+        try:
+            while written < len(batch):
+                segment = batch[written][0]
+                end = written
+                while end < len(batch) and batch[end][0] is segment:
+                    end += 1
+                group = batch[written:end]
+                with open(segment.path, "ab") as f:
+                    f.write(b"".join(record for _, record, _ in group))
+                index = b"".join(entry for _, _, entry in group if entry is not None)
+                if index:
+                    with open(segment.index_path, "ab") as f:
+                        f.write(index)
+                segment.flushed += len(group)
+                written = end
+        except Exception:
+            # Retry the unwritten records on the next flush
+            with self._lock:
+                self._pending = batch[written:] + self._pending
+            raise
+
+    def query(self, since: Optional[float] = None, until: Optional[float] = None,
+              cursor: Optional[str] = None, limit: int = 100) -> Dict[str, Any]:
+        """
+        Events with since <= timestamp <= until in time order. `cursor` is the
+        opaque next_cursor of a previous page.
+        """
+        with self._io_lock:
+            if self._pending:
+                self._flush_locked()
+            return self._query(since, until, cursor, limit)
+
+    def _query(self, since: Optional[float], until: Optional[float],
+               cursor: Optional[str], limit: int) -> Dict[str, Any]:
+        since = since if since is not None else 0.0
+        until = until if until is not None else float("inf")
+
+        if cursor:
+            seg_pos, record_no = self._parse_cursor(cursor)
+        else:
+            seg_pos = max(0, bisect.bisect_right(self._first_ts, since) - 1)
+            record_no = self.segments[seg_pos].seek_record(since) if seg_pos < len(self.segments) else 0
+
+        events: List[Dict[str, Any]] = []
+        next_cursor = None
+        while seg_pos < len(self.segments) and next_cursor is None:
+            segment = self.segments[seg_pos]
+            records = segment.flushed
+            if record_no < records:
+                with open(segment.path, "rb") as f:
+                    f.seek(record_no * RECORD.size)
+                    while record_no < records:
+                        batch = min(records - record_no, max(limit, INDEX_EVERY))
+                        data = f.read(batch * RECORD.size)
+                        for ts, action, flags, who, tx in RECORD.iter_unpack(data):
+                            if ts > until:
+                                return {"events": events, "next_cursor": None}
+                            if ts >= since:
+                                if len(events) >= limit:
+                                    next_cursor = f"{segment.seq}:{record_no}"
+                                    break
+                                events.append({
+                                    "timestamp": ts,
+                                    "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ts)) + "Z",
+                                    "action": ACTIONS[action] if action < len(ACTIONS) else "unknown",
+                                    "who": _decode_who(flags, who),
+                                    "tx_hash": "0x" + tx.hex() if any(tx) else None
+                                })
+                            record_no += 1
+                        if next_cursor is not None:
+                            break
+            seg_pos += 1
+            record_no = 0
+        return {"events": events, "next_cursor": next_cursor}
+
+    def _parse_cursor(self, cursor: str) -> Tuple[int, int]:
+        try:
+            seq, record_no = (int(part) for part in cursor.split(":", 1))
+        except ValueError:
+            raise ValueError(f"Invalid cursor '{cursor}'")
+        for position, segment in enumerate(self.segments):
+            if segment.seq == seq:
+                return position, record_no
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+
+class AccessLogStore:
+    """
+    One LockAccessLog directory per lock under a common root. run() buffers
+    every log and flushes them together on a worker thread.
+    """
+
+    def __init__(self, root: str, flush_interval: float = 0.05):
+        self.root = root
+        self.flush_interval = flush_interval
+        self._logs: Dict[str, LockAccessLog] = {}
+        self._buffered = False
+
+    def log_for(self, device_id: str) -> LockAccessLog:
+        log = self._logs.get(device_id)
+        if log is None:
+            log = LockAccessLog(os.path.join(self.root, device_id))
+            log.buffered = self._buffered
+            self._logs[device_id] = log
+        return log
+
+    def flush(self):
+        """Write every buffered record (blocking; shutdown or a worker thread)."""
+        for log in list(self._logs.values()):
+            if log.pending:
+                log.flush()
+
+    async def run(self):
+        self._buffered = True
+        for log in self._logs.values():
+            log.buffered = True
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if not any(log.pending for log in self._logs.values()):
+                continue
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"[ACCESS] Flush failed: {str(e)}")
@@ -0,0 +1,153 @@
+"""
+Fleet Aggregates
+Running per-type telemetry rollups kept current from device change notifications
+"""
+
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from inventory import StockLedger
+from models import DeviceSimulator, SmartLock
+
+# Metrics each device contributes to its type's running sums
+Contribution = Dict[str, float]
+
+
+def _contribution(device: DeviceSimulator) -> Contribution:
+    if device.type == "ev_charger":
+        charging = device.status == "CHARGING"
+        return {
+            "charging": 1 if charging else 0,
+            "power_kw": device.current_power_kw if charging else 0.0,
+            "allocated_kw": device.allocated_power_kw if charging else 0.0
+        }
+    if device.type == "3d_printer":
+        if device.status != "PRINTING":
+            return {"printing": 0}
+        # Progress is linear in time until the completion event, so the sum
+        # over printers is (progress_base + rate * now) in closed form
+        rate = 100.0 / device.print_duration_sec
+        return {
+            "printing": 1,
+            "progress_base": device.progress_percent - rate * device._last_tick,
+            "progress_rate": rate
+        }
+    if device.type == "smart_lock":
+        return {
+            "locked": 1 if device.is_locked else 0,
+            "low_battery": 1 if device.battery_level < SmartLock.LOW_BATTERY_PERCENT else 0
+        }
+    if device.type == "security_camera":
+        return {
+            "viewers": device.active_viewers,
+            "bandwidth_mbps": device.bandwidth_usage_mbps
+        }
+    return {}
+
+
+class FleetAggregates:
+    """
+    Per-type sums and status counts for one site.
+
+    Every device change notification replaces that device's contribution
+    (subtract old, add new), so an update is O(1) and reading the rollup
+    costs O(types), independent of fleet size. Vending stock comes from the
+    site's StockLedger running totals.
+    """
+
+    def __init__(self, stock_ledger: Optional[StockLedger] = None):
+        self.stock_ledger = stock_ledger
+        self._devices: Dict[str, int] = {}
+        self._by_status: Dict[str, Dict[str, int]] = {}
+        self._sums: Dict[str, Dict[str, float]] = {}
+        # device id -> (type, status, contribution) last applied
+        self._applied: Dict[str, Tuple[str, str, Contribution]] = {}
+
+    def add(self, device: DeviceSimulator):
+        if device.id in self._applied:
+            return
+        self._devices[device.type] = self._devices.get(device.type, 0) + 1
+        entry = (device.type, device._get_status_string(), _contribution(device))
+        self._apply(*entry, 1)
+        self._applied[device.id] = entry
+        device.add_observer(self.refresh)
+
+    def remove(self, device: DeviceSimulator):
+        entry = self._applied.pop(device.id, None)
+        if entry is None:
+            return
+        device.remove_observer(self.refresh)
+        self._devices[device.type] -= 1
+        self._apply(*entry, -1)
+
+    def refresh(self, device: DeviceSimulator):
+        """Swap in the device's current contribution (observer callback)."""
+        entry = self._applied.get(device.id)
+        if entry is None:
+            return
+        status, contribution = device._get_status_string(), _contribution(device)
+        if entry[1] == status and entry[2] == contribution:
+            return
+        self._apply(*entry, -1)
+        self._apply(device.type, status, contribution, 1)
+        self._applied[device.id] = (device.type, status, contribution)
+
+    def _apply(self, device_type: str, status: str, contribution: Contribution, sign: int):
+        counts = self._by_status.setdefault(device_type, {})
+        counts[status] = counts.get(status, 0) + sign
+        if not counts[status]:
+            del counts[status]
+        sums = self._sums.setdefault(device_type, {})
+        for metric, value in contribution.items():
+            sums[metric] = sums.get(metric, 0.0) + sign * value
+
+    def summary(self, now: Optional[float] = None) -> Dict[str, Any]:
+        now = now if now is not None else time.monotonic()
+        types: Dict[str, Any] = {}
+        for device_type, count in self._devices.items():
+            if not count:
+                continue
+            sums = self._sums.get(device_type, {})
+            entry: Dict[str, Any] = {"devices": count, "by_status": dict(self._by_status.get(device_type, {}))}
+            if device_type == "ev_charger":
+                entry["charging"] = int(sums.get("charging", 0))
+                entry["power_kw"] = round(sums.get("power_kw", 0.0), 2)
+                entry["allocated_kw"] = round(sums.get("allocated_kw", 0.0), 2)
+            elif device_type == "3d_printer":
+                printing = int(sums.get("printing", 0))
+                progress = sums.get("progress_base", 0.0) + sums.get("progress_rate", 0.0) * now
+                entry["printing"] = printing
+                entry["avg_progress_percent"] = round(min(100.0, progress / printing), 1) if printing else 0.0
+            elif device_type == "smart_lock":
+                entry["locked"] = int(sums.get("locked", 0))
+                entry["low_battery"] = int(sums.get("low_battery", 0))
+            elif device_type == "security_camera":
+                entry["viewers"] = int(sums.get("viewers", 0))
+                entry["bandwidth_mbps"] = round(sums.get("bandwidth_mbps", 0.0), 1)
+            elif device_type == "vending_machine" and self.stock_ledger is not None:
+                entry["stock_on_hand"] = self.stock_ledger.total_on_hand
+                entry["stock_reserved"] = self.stock_ledger.total_reserved
+                entry["stock_available"] = self.stock_ledger.total_on_hand - self.stock_ledger.total_reserved
+            types[device_type] = entry
+        return types
+
+
+def merge_summaries(summaries) -> Dict[str, Any]:
+    """Combine summary() outputs (sites, cluster nodes): counts add, averages weight by printers."""
+    merged: Dict[str, Any] = {}
+    for summary in summaries:
+        for device_type, entry in summary.items():
+            target = merged.setdefault(device_type, {"by_status": {}})
+            for key, value in entry.items():
+                if key == "by_status":
+                    for status, count in value.items():
+                        target["by_status"][status] = target["by_status"].get(status, 0) + count
+                elif key == "avg_progress_percent":
+                    target["_progress_sum"] = target.get("_progress_sum", 0.0) + value * entry.get("printing", 0)
+                else:
+                    target[key] = round(target.get(key, 0) + value, 2)
+    for entry in merged.values():
+        if "_progress_sum" in entry:
+            progress = entry.pop("_progress_sum")
+            entry["avg_progress_percent"] = round(progress / entry["printing"], 1) if entry.get("printing") else 0.0
+    return merged
@@ -0,0 +1,282 @@
+"""
+Alert Rules
+Declarative threshold and state-change rules over device telemetry, with SSE and webhook delivery
+"""
+
+import array
+import asyncio
+import json
+import logging
+import operator
+import time
+import urllib.request
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from models import DeviceSimulator
+
+logger = logging.getLogger(__name__)
+
+# Derived fields rules can reference besides plain device attributes
+DERIVED_FIELDS: Dict[str, Callable[[DeviceSimulator], Any]] = {
+    "status": lambda d: d._get_status_string(),
+    "empty_slots": lambda d: sum(1 for i in range(len(d.inventory.slot_names)) if d.inventory.counts[i] <= 0),
+}
+
+DEFAULT_RULES: List[Dict[str, Any]] = [
+    {"id": "vending_jammed", "type": "vending_machine", "field": "is_jammed", "op": "==", "value": True,
+     "severity": "critical", "message": "Vending machine is jammed"},
+    {"id": "vending_slot_empty", "type": "vending_machine", "field": "empty_slots", "op": ">", "value": 0,
+     "severity": "warning", "message": "A stock slot is empty"},
+    {"id": "lock_low_battery", "type": "smart_lock", "field": "battery_level", "op": "<", "value": 20, "clear": 25,
+     "severity": "warning", "message": "Lock battery below 20%"},
+    {"id": "printer_nozzle_temp", "type": "3d_printer", "field": "nozzle_temp_c", "op": "outside",
+     "value": [190, 230], "clear": [195, 225], "when_status": ["PRINTING"],
+     "severity": "critical", "message": "Nozzle temperature out of range while printing"},
+    {"id": "charger_fault", "type": "ev_charger", "field": "status", "op": "==", "value": "FAULT",
+     "severity": "critical", "message": "Charger reported a fault"},
+]
+
+_COMPARISONS = {
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+    "==": operator.eq, "!=": operator.ne,
+}
+
+
+def _outside(bounds):
+    low, high = bounds
+    return lambda v: v is not None and (v < low or v > high)
+
+
+class Rule:
+    """
+    A compiled rule. State rules ("<", "outside", "=="...) fire when their
+    condition starts to hold and resolve only once the (optional) looser
+    "clear" bound no longer holds, which gives hysteresis. "changed" rules
+    emit an event on every change of the field and have no active state.
+    """
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.id = spec["id"]
+        self.device_type = spec["type"]
+        self.field = spec["field"]
+        self.op = spec["op"]
+        self.severity = spec.get("severity", "warning")
+        self.message = spec.get("message", self.id)
+        self.cooldown_sec = float(spec.get("cooldown_sec", 0))
+        self.when_status = set(spec.get("when_status", ()))
+        self.read = DERIVED_FIELDS.get(self.field) or operator.attrgetter(self.field)
+
+        if self.op == "changed":
+            self.fire = self.hold = None
+        elif self.op == "outside":
+            self.fire = _outside(spec["value"])
+            self.hold = _outside(spec.get("clear", spec["value"]))
+        elif self.op in _COMPARISONS:
+            compare, value = _COMPARISONS[self.op], spec["value"]
+            clear = spec.get("clear", value)
+            self.fire = lambda v: v is not None and compare(v, value)
+            self.hold = lambda v: v is not None and compare(v, clear)
+        else:
+            raise ValueError(f"Rule '{self.id}': unknown op '{self.op}'")
+
+    def value_of(self, device: DeviceSimulator) -> Any:
+        if self.when_status and device._get_status_string() not in self.when_status:
+            return None  # Out of scope: never fires, always clears
+        return self.read(device)
+
+    def evaluate(self, values: List[Any], active: bytearray, rows: Iterable[int]) -> List[int]:
+        """Step the rule over `rows` at once; returns the rows whose state flipped."""
+        fire, hold, flipped = self.fire, self.hold, []
+        for row in rows:
+            value = values[row]
+            now_active = hold(value) if active[row] else fire(value)
+            if now_active != active[row]:
+                active[row] = now_active
+                flipped.append(row)
+        return flipped
+
+
+def load_rules(path: Optional[str]) -> List[Rule]:
+    specs = DEFAULT_RULES
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            specs = json.load(f)
+    return [Rule(spec) for spec in specs]
+
+
+class WebhookSink:
+    """POSTs each alert as JSON to a URL from a background task (never blocks a tick)."""
+
+    def __init__(self, url: str, timeout_sec: float = 5.0, max_queue: int = 10000):
+        self.url = url
+        self.timeout_sec = timeout_sec
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.delivered = 0
+        self.dropped = 0
+
+    def offer(self, alert: Dict[str, Any]):
+        try:
+            self._queue.put_nowait(alert)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _post(self, alert: Dict[str, Any]):
+        body = json.dumps(alert).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout_sec):
+            pass
+
+    async def run(self):
+        while True:
+            alert = await self._queue.get()
+            try:
+                await asyncio.to_thread(self._post, alert)
+                self.delivered += 1
+            except Exception as e:
+                self.dropped += 1
+                logger.warning(f"[ALERTS] Webhook {self.url} failed: {str(e)}")
+
+
+class AlertHub:
+    """
+    Node-wide alert fan-out: every subscriber (SSE client, in-process
+    consumer) gets its own bounded queue, plus recent history and the
+    currently active alerts.
+    """
+
+    def __init__(self, history: int = 500, webhook: Optional[WebhookSink] = None):
+        self.recent: deque = deque(maxlen=history)
+        self.active: Dict[str, Dict[str, Any]] = {}
+        self.webhook = webhook
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def subscribe(self, max_queue: int = 1000) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, alert: Dict[str, Any]):
+        key = f"{alert['rule']}:{alert['device_id']}"
+        if alert["state"] == "firing":
+            self.active[key] = alert
+        elif alert["state"] == "resolved":
+            self.active.pop(key, None)
+        self.recent.append(alert)
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(alert)
+            except asyncio.QueueFull:
+                pass  # Slow consumer: it can resync from /alerts
+        if self.webhook is not None:
+            self.webhook.offer(alert)
+        logger.info(f"[ALERTS] {alert['state'].upper()} {alert['rule']} on {alert['device_id']}")
+
+
+class AlertEngine:
+    """
+    Rules for one site, run as a scheduler tick hook.
+
+    Values live in per-rule columns indexed by device row. Device change
+    notifications only mark the row dirty; each tick re-reads the dirty rows
+    and steps every rule over them in one batch. Rows that did not change
+    cannot flip, so a tick costs O(changes x rules), not O(fleet); the first
+    tick evaluates every row once.
+    """
+
+    def __init__(self, site_id: str, rules: List[Rule], hub: AlertHub):
+        self.site_id = site_id
+        self.hub = hub
+        self.rules_by_type: Dict[str, List[Rule]] = {}
+        for rule in rules:
+            self.rules_by_type.setdefault(rule.device_type, []).append(rule)
+        self._rows: Dict[str, Dict[str, int]] = {}
+        self._devices: Dict[str, List[DeviceSimulator]] = {}
+        self._values: Dict[str, List[Any]] = {}
+        self._active: Dict[str, bytearray] = {}
+        self._last_fired: Dict[str, array.array] = {}
+        self._dirty: Dict[str, Set[int]] = {}
+        self.evaluations = 0
+
+    def add(self, device: DeviceSimulator):
+        rules = self.rules_by_type.get(device.type)
+        if not rules or device.id in self._rows.setdefault(device.type, {}):
+            return
+        devices = self._devices.setdefault(device.type, [])
+        row = len(devices)
+        self._rows[device.type][device.id] = row
+        devices.append(device)
+        for rule in rules:
+            try:
+                rule.read(device)
+            except AttributeError:
+                raise ValueError(f"Rule '{rule.id}': {device.type} has no field '{rule.field}'")
+            self._values.setdefault(rule.id, []).append(None)
+            self._active.setdefault(rule.id, bytearray()).append(0)
+            self._last_fired.setdefault(rule.id, array.array("d")).append(0.0)
+        self._dirty.setdefault(device.type, set()).add(row)
+        device.add_observer(self._mark_dirty)
+
+    def _mark_dirty(self, device: DeviceSimulator):
+        self._dirty[device.type].add(self._rows[device.type][device.id])
+
+    def _alert(self, rule: Rule, device: DeviceSimulator, state: str, value: Any) -> Dict[str, Any]:
+        return {
+            "id": str(uuid.uuid4()),
+            "rule": rule.id,
+            "state": state,
+            "severity": rule.severity,
+            "message": rule.message,
+            "site_id": self.site_id,
+            "device_id": device.id,
+            "device_type": device.type,
+            "field": rule.field,
+            "value": value,
+            "at": time.time()
+        }
+
+    def evaluate(self) -> int:
+        """One tick: refresh dirty rows, step the rules, publish transitions."""
+        published = 0
+        now = time.time()
+        for device_type, dirty in self._dirty.items():
+            if not dirty:
+                continue
+            rows = sorted(dirty)
+            dirty.clear()
+            devices = self._devices[device_type]
+            for rule in self.rules_by_type[device_type]:
+                values = self._values[rule.id]
+                if rule.op == "changed":
+                    flipped = []
+                    for row in rows:
+                        value = rule.value_of(devices[row])
+                        if value != values[row]:
+                            if value is not None and values[row] is not None:
+                                flipped.append(row)
+                            values[row] = value
+                else:
+                    for row in rows:
+                        values[row] = rule.value_of(devices[row])
+                    flipped = rule.evaluate(values, self._active[rule.id], rows)
+                self.evaluations += len(rows)
+
+                last_fired = self._last_fired[rule.id]
+                active = self._active[rule.id]
+                for row in flipped:
+                    firing = rule.op == "changed" or active[row]
+                    state = "event" if rule.op == "changed" else "firing" if firing else "resolved"
+                    if firing:
+                        # Dedup: a flapping condition re-fires at most once per cooldown
+                        if now - last_fired[row] < rule.cooldown_sec:
+                            continue
+                        last_fired[row] = now
+                    elif f"{rule.id}:{devices[row].id}" not in self.hub.active:
+                        continue  # Its firing was suppressed, so nothing to resolve
+                    self.hub.publish(self._alert(rule, devices[row], state, values[row]))
+                    published += 1
+        return published
@@ -0,0 +1,79 @@
+"""
+Device Mutation Contention Benchmark
+Job throughput with per-device locks vs one global lock as the fleet grows
+
+Each job holds its device's lock across a simulated payment check (an
+await of --verify-ms) and then applies an unlock/lock transition, like the
+job endpoint does. With per-device locks throughput grows with the number
+of devices (until --clients is the bound); a global lock stays flat at
+about 1000 / verify_ms jobs/s whatever the fleet size.
+
+    python benchmarks/contention.py --devices 1 4 16 64 --clients 64 --jobs 2000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from device_mutations import DeviceMutator  # noqa: E402
+from models import SmartLock  # noqa: E402
+
+
+class GlobalLockMutator(DeviceMutator):
+    """Baseline: every job in the fleet serialized on one lock."""
+
+    def __init__(self):
+        super().__init__()
+        self._global = asyncio.Lock()
+
+    def lock(self, device):
+        return self._global
+
+
+def _toggle(device):
+    def transition():
+        device.is_locked = not device.is_locked
+        device.auto_lock_timer_sec = 0 if device.is_locked else 300
+        device.record_access("unlock" if not device.is_locked else "lock", "bench")
+    return transition
+
+
+async def _run(mutator: DeviceMutator, devices, clients: int, jobs: int, verify_sec: float) -> float:
+    counter = iter(range(jobs))
+
+    async def client():
+        for n in counter:
+            device = devices[n % len(devices)]
+            async with mutator.transaction(device):
+                await asyncio.sleep(verify_sec)  # payment check inside the critical section
+                _toggle(device)()
+                device.update()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return jobs / (time.perf_counter() - start)
+
+
+async def main(args):
+    verify_sec = args.verify_ms / 1000.0
+    print(f"{'devices':>8} {'per-device jobs/s':>18} {'global jobs/s':>14} {'speedup':>8}")
+    for count in args.devices:
+        devices = [SmartLock(id=f"lock-{i:04d}") for i in range(count)]
+        per_device = await _run(DeviceMutator(), devices, args.clients, args.jobs, verify_sec)
+        global_lock = await _run(GlobalLockMutator(), devices, args.clients, args.jobs, verify_sec)
+        versions = sum(d.version for d in devices)
+        assert versions == 2 * args.jobs, f"lost updates: {versions} versions for {args.jobs} jobs"
+        print(f"{count:>8} {per_device:>18.0f} {global_lock:>14.0f} {per_device / global_lock:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--clients", type=int, default=64, help="concurrent job submitters")
+    parser.add_argument("--jobs", type=int, default=2000, help="jobs per run")
+    parser.add_argument("--verify-ms", type=float, default=5.0, help="simulated payment check inside the lock")
+    asyncio.run(main(parser.parse_args()))
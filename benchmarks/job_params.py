@@ -0,0 +1,114 @@
+"""
+Job Params Benchmark
+Per-request cost of checking job params: compiled validators vs walking the schema
+
+For each (device type, action) with params, times the compiled validator
+from job_schemas against a validator that interprets the same schema dict
+on every call, on a valid request and on an invalid one. jsonschema is
+timed too when installed (pip install jsonschema):
+
+    python benchmarks/job_params.py --repeats 20000
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from job_schemas import JOB_SCHEMAS, VALIDATORS  # noqa: E402
+
+try:
+    import jsonschema
+    JSONSCHEMA_AVAILABLE = True
+except ImportError:
+    JSONSCHEMA_AVAILABLE = False
+
+SAMPLES = {
+    ("3d_printer", "print"): ({"file_url": "benchy.gcode"}, {"file_url": 42}),
+    ("3d_printer", "buy_filament"): ({"material_type": "PETG", "color": "red", "weight_grams": 500},
+                                     {"material_type": "WOOD", "weight_grams": "heavy"}),
+    ("ev_charger", "charge"): ({"target_percent": 80}, {"target_percent": 150}),
+    ("vending_machine", "dispense"): ({"items": [{"slot": "A1", "quantity": 2}, {"product_id": "water"}]},
+                                      {"items": [{"slot": 1, "quantity": 0}]}),
+    ("vending_machine", "restock"): ({"slot": 2, "quantity": 10}, {"quantity": "many"}),
+    ("security_camera", "view"): ({"duration_sec": 120}, {"duration_sec": 7200})
+}
+
+
+def interpret(schema, value):
+    """Walk the schema dict for one value, as a non-compiled validator does per request."""
+    kinds = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+    for kind in kinds:
+        if kind == "number" and isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            break
+        if kind == "integer" and isinstance(value, int) and not isinstance(value, bool):
+            break
+        if kind == "string" and isinstance(value, str):
+            break
+        if kind == "array" and isinstance(value, list):
+            value = [interpret(schema["items"], item) for item in value] if "items" in schema else value
+            break
+        if kind == "object" and isinstance(value, dict):
+            value = interpret_params(schema.get("properties", {}), value)
+            break
+    else:
+        raise ValueError(f"must be {' or '.join(kinds)}")
+    if "enum" in schema and value not in schema["enum"]:
+        raise ValueError("not in enum")
+    if "minimum" in schema and value < schema["minimum"]:
+        raise ValueError("below minimum")
+    if "exclusiveMinimum" in schema and value <= schema["exclusiveMinimum"]:
+        raise ValueError("below minimum")
+    if "maximum" in schema and value > schema["maximum"]:
+        raise ValueError("above maximum")
+    return value
+
+
+def interpret_params(properties, params):
+    result = dict(params)
+    for name, schema in properties.items():
+        if result.get(name) is None:
+            if "default" in schema:
+                result[name] = schema["default"]
+            continue
+        result[name] = interpret(schema, result[name])
+    return result
+
+
+def timed(fn, params, repeats: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeats):
+        try:
+            fn(params)
+        except Exception:
+            # JobParamsError, ValueError or jsonschema.ValidationError: rejecting is the work
+            pass
+    return (time.perf_counter() - started) / repeats * 1e6
+
+
+def main(repeats: int):
+    header = f"{'action':<30} {'case':<8} {'compiled us':>12} {'walk us':>10}"
+    print(header + (f" {'jsonschema us':>14}" if JSONSCHEMA_AVAILABLE else ""))
+    for key, (valid, invalid) in SAMPLES.items():
+        properties = JOB_SCHEMAS[key]
+        compiled = VALIDATORS[key]
+        if JSONSCHEMA_AVAILABLE:
+            checker = jsonschema.Draft7Validator({"type": "object", "properties": properties})
+        for case, params in (("valid", valid), ("invalid", invalid)):
+            compiled_us = timed(compiled, params, repeats)
+            walk_us = timed(lambda p: interpret_params(properties, p), params, repeats)
+            line = f"{'/'.join(key):<30} {case:<8} {compiled_us:>12.2f} {walk_us:>10.2f}"
+            if JSONSCHEMA_AVAILABLE:
+                line += f" {timed(checker.validate, params, repeats):>14.2f}"
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=20000)
+    args = parser.parse_args()
+    main(args.repeats)
@@ -0,0 +1,65 @@
+"""
+Metering Tick Benchmark
+Cost of one metering accrual tick by fleet size and open sessions
+
+Builds a site-sized fleet of printers in memory, opens metering sessions on
+some of them and times Meter.accrue() (the per-tick pass over the session
+columns) against a scan that visits every device to find its sessions:
+
+    python benchmarks/metering_tick.py --fleet 1000 10000 100000 --sessions 0 100 10000
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from metering import Meter  # noqa: E402
+from models import Printer3D  # noqa: E402
+from scheduler import EventScheduler  # noqa: E402
+
+
+def fleet_scan(meter: Meter, devices, now: float):
+    """Accrual by visiting every device, as a per-device tick would."""
+    for device in devices:
+        for session in device.meter_sessions:
+            meter._accrue_row(session.row, now)
+
+
+def timed(fn, repeats: int) -> float:
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples)
+
+
+def run(fleet: int, sessions: int, repeats: int):
+    devices = [Printer3D(id=f"printer-{i}", ens_domain=f"printer-{i}.eth") for i in range(fleet)]
+    meter = Meter(EventScheduler())
+    # Huge balances so nothing is exhausted mid-benchmark
+    for device in devices[:sessions]:
+        meter.open(device, device.current_file, None, prepaid=1e9)
+    columns_us = timed(lambda: meter.accrue(time.monotonic()), repeats)
+    scan_us = timed(lambda: fleet_scan(meter, devices, time.monotonic()), repeats)
+    print(f"{fleet:>8} {sessions:>9} {columns_us:>12.1f} {scan_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fleet", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[0, 100, 10000])
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    print(f"{'fleet':>8} {'sessions':>9} {'columns us':>12} {'scan us':>12}")
+    for fleet in args.fleet:
+        for sessions in args.sessions:
+            if sessions <= fleet:
+                run(fleet, sessions, args.repeats)
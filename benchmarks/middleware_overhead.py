@@ -0,0 +1,136 @@
+"""
+Middleware Overhead Benchmark
+Per-request latency of read endpoints under the pure ASGI middleware stack vs
+the previous CORSMiddleware + call_next logging middleware
+
+Both stacks wrap the same app and routes; the legacy one is rebuilt here by
+swapping the two middleware entries. Requests are driven straight through the
+ASGI interface (no sockets or client library), with an Origin header so the
+CORS path runs, and the CORS headers of both stacks are compared first:
+
+    python benchmarks/middleware_overhead.py --requests 3000
+
+Request logging goes to the configured handlers at --log-level (default
+WARNING so the log I/O does not drown the middleware cost).
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SNAPSHOT_PATH", "")
+os.environ.setdefault("JOB_STORE_PATH", "")
+os.environ.setdefault("CHANNEL_STORE_PATH", "")
+
+from fastapi import Request  # noqa: E402
+from starlette.middleware import Middleware  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+from starlette.middleware.cors import CORSMiddleware  # noqa: E402
+
+import main  # noqa: E402
+from http_middleware import CORSHeadersMiddleware, RequestLogMiddleware  # noqa: E402
+
+legacy_logger = logging.getLogger("main")
+
+
+async def legacy_log_requests(request: Request, call_next):
+    """The request logging middleware as it was (minus slow-request phases)."""
+    start_time = datetime.now()
+    legacy_logger.info(f"[REQUEST] {request.method} {request.url.path} - Client: {request.client.host if request.client else 'unknown'}")
+    try:
+        response = await call_next(request)
+        process_time = (datetime.now() - start_time).total_seconds()
+        legacy_logger.info(f"[RESPONSE] {request.method} {request.url.path} - Status: {response.status_code} - Time: {process_time:.3f}s")
+        return response
+    except Exception as e:
+        process_time = (datetime.now() - start_time).total_seconds()
+        legacy_logger.error(f"[ERROR] {request.method} {request.url.path} - Exception: {str(e)} - Time: {process_time:.3f}s")
+        raise
+
+
+def build_stack(legacy: bool):
+    app = main.app
+    middleware = []
+    for entry in app.user_middleware:
+        if legacy and entry.cls is CORSHeadersMiddleware:
+            entry = Middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True,
+                               allow_methods=["*"], allow_headers=["*"])
+        elif legacy and entry.cls is RequestLogMiddleware:
+            entry = Middleware(BaseHTTPMiddleware, dispatch=legacy_log_requests)
+        middleware.append(entry)
+    saved = app.user_middleware
+    app.user_middleware = middleware
+    try:
+        return app.build_middleware_stack()
+    finally:
+        app.user_middleware = saved
+
+
+async def call(stack, method: str, path: str, headers=()):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+        "headers": [(b"host", b"testserver"), (b"origin", b"https://agent.example")] + list(headers),
+        "app": main.app, "state": {}
+    }
+    response = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode().lower(): v.decode() for k, v in message["headers"]}
+
+    await stack(scope, receive, send)
+    return response
+
+
+def cors_view(response):
+    return {k: v for k, v in response["headers"].items() if k.startswith("access-control") or k == "vary"}, response["status"]
+
+
+async def run(args):
+    await main.startup_event()
+    stacks = {"legacy": build_stack(True), "pure ASGI": build_stack(False)}
+    device = main.site_registry.default.devices[0]
+    paths = ["/status", f"/status/{device.id}", "/ai-manifest", f"/devices/{device.id.replace('-', '_')}/ai-manifest"]
+
+    preflight = [(b"access-control-request-method", b"POST"), (b"access-control-request-headers", b"x-payment-tx")]
+    for label, method, path, headers in [("GET", "GET", "/status", ()), ("preflight", "OPTIONS", "/status", preflight)]:
+        views = {name: cors_view(await call(stack, method, path, headers)) for name, stack in stacks.items()}
+        print(f"CORS headers {label}: {'identical' if views['legacy'] == views['pure ASGI'] else 'DIFFER ' + repr(views)}")
+
+    print(f"\n{'endpoint':<40} {'stack':<10} {'p50 us':>8} {'mean us':>8}")
+    for path in paths + ["OPTIONS /status"]:
+        method, _, target = path.rpartition(" ")
+        method = method or "GET"
+        headers = preflight if method == "OPTIONS" else ()
+        for name, stack in stacks.items():
+            for _ in range(100):
+                await call(stack, method, target, headers)
+            samples = []
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                await call(stack, method, target, headers)
+                samples.append((time.perf_counter() - started) * 1e6)
+            print(f"{path:<40} {name:<10} {statistics.median(samples):>8.0f} {statistics.fmean(samples):>8.0f}")
+    await main.shutdown_event()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    asyncio.run(run(args))
@@ -0,0 +1,136 @@
+"""
+Server Profile Benchmark
+Default `uvicorn main:app` vs the tuned `python server.py` under keep-alive status load
+
+Each profile is started as a subprocess on its own port with fresh state,
+waited on until / answers, then driven by --concurrency clients that
+each reuse one keep-alive connection and alternate GET /status and
+GET /status/{device_id} for --duration seconds. Reports req/s and p50/p99
+latency per profile:
+
+    python benchmarks/server_profile.py --concurrency 64 --duration 10
+
+Requires httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+PROFILES = {
+    "uvicorn main:app": lambda port: [sys.executable, "-m", "uvicorn", "main:app",
+                                      "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+    "python server.py": lambda port: [sys.executable, "server.py"],
+}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def start(name: str, port: int, state_dir: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        SERVER_HOST="127.0.0.1",
+        SERVER_WORKERS="1",
+        SNAPSHOT_PATH="",
+        JOB_STORE_PATH="",
+        CHANNEL_STORE_PATH="",
+        ACCESS_LOG_DIR=os.path.join(state_dir, "access-log"),
+        SLOW_REQUEST_MS="0"
+    )
+    return subprocess.Popen(PROFILES[name](port), cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(base_url: str, timeout_sec: float = 30.0):
+    deadline = time.monotonic() + timeout_sec
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not become ready")
+
+
+async def drive(base_url: str, concurrency: int, duration_sec: float) -> Dict[str, float]:
+    async with httpx.AsyncClient(base_url=base_url) as probe:
+        device_ids = [d["id"] for d in (await probe.get("/status")).json()]
+    latencies: List[float] = []
+    errors = 0
+
+    async def client_loop(offset: int):
+        nonlocal errors
+        limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+            i = offset
+            while time.monotonic() < stop_at:
+                path = "/status" if i % 2 else f"/status/{device_ids[i % len(device_ids)]}"
+                i += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.TransportError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+    stop_at = time.monotonic() + duration_sec
+    started = time.monotonic()
+    await asyncio.gather(*(client_loop(i) for i in range(concurrency)))
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000
+    }
+
+
+async def profile(name: str, port: int, args) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as state_dir:
+        process = start(name, port, state_dir)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            await wait_ready(base_url)
+            await drive(base_url, args.concurrency, 1.0)  # warm-up
+            return await drive(base_url, args.concurrency, args.duration)
+        finally:
+            process.terminate()
+            process.wait()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--base-port", type=int, default=8101)
+    args = parser.parse_args()
+
+    print(f"{'profile':<20} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for i, name in enumerate(PROFILES):
+        result = await profile(name, args.base_port + i, args)
+        print(f"{name:<20} {result['requests']:>9} {result['errors']:>7} {result['rps']:>9.0f} "
+              f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
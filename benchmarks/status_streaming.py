@@ -0,0 +1,117 @@
+"""
+Status Streaming Benchmark
+Peak memory and time to first byte of /status for a very large site: one
+JSON list vs cursor pages vs an NDJSON stream
+
+A site of --devices simulated devices is added next to the default one and
+requested through the ASGI interface (no sockets). Each mode runs twice:
+once timed, once under tracemalloc for the peak memory of the request's own
+allocations (tracing slows it down too much to time):
+
+    python benchmarks/status_streaming.py --devices 100000 --page 5000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SNAPSHOT_PATH", "")
+os.environ.setdefault("JOB_STORE_PATH", "")
+os.environ.setdefault("CHANNEL_STORE_PATH", "")
+os.environ.setdefault("ACCESS_LOG_DIR", "")
+
+import main  # noqa: E402
+from sites import Site, build_devices  # noqa: E402
+
+TYPES = ["ev_charger", "3d_printer", "smart_lock", "vending_machine", "security_camera"]
+
+
+async def call(path: str, query: str = "", accept: str = "application/json"):
+    """Returns ({status, size, first: seconds to first body byte, body: first chunk}, total seconds)."""
+    # ASGI spec 2.4: the app does not need to watch receive() for a disconnect while streaming
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query.encode(), "root_path": "", "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80), "headers": [(b"host", b"testserver"), (b"accept", accept.encode())],
+        "app": main.app, "state": {}
+    }
+    result = {"status": None, "size": 0, "first": None, "body": []}
+    started = time.perf_counter()
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            if result["first"] is None:
+                result["first"] = time.perf_counter() - started
+            result["size"] += len(message["body"])
+            # Keep only the first chunk: a streaming client would render and drop the rest
+            if not result["body"]:
+                result["body"].append(message["body"])
+
+    await main.app(scope, receive, send)
+    return result, time.perf_counter() - started
+
+
+async def measured(label: str, run):
+    first, total, size, requests = await run()
+    tracemalloc.start()
+    await run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<26} {requests:>8} {first * 1000:>10.1f} {total * 1000:>10.1f} {size / 1e6:>9.1f} {peak / 1e6:>9.1f}")
+
+
+async def run(args):
+    specs = [{"type": TYPES[i % len(TYPES)], "id": f"bench-{i}"} for i in range(args.devices)]
+    site = Site("bench", "Benchmark", build_devices(specs, "bench.eth"), vendor_address="0x" + "42" * 20)
+    main.site_registry.add(site)
+    path = "/sites/bench/status"
+    print(f"{args.devices} devices\n")
+    print(f"{'mode':<26} {'requests':>8} {'ttfb ms':>10} {'total ms':>10} {'MB sent':>9} {'peak MB':>9}")
+
+    async def full():
+        # Fresh site version so the encoded-payload cache cannot answer
+        site.version += 1
+        result, total = await call(path)
+        return result["first"], total, result["size"], 1
+
+    async def pages():
+        cursor, requests, size, first, started = None, 0, 0, None, time.perf_counter()
+        while True:
+            query = f"limit={args.page}" + (f"&cursor={cursor}" if cursor else "")
+            result, _ = await call(path, query)
+            first = first if first is not None else result["first"]
+            requests += 1
+            size += result["size"]
+            cursor = json.loads(result["body"][0])["next_cursor"]
+            if not cursor:
+                return first, time.perf_counter() - started, size, requests
+
+    async def stream():
+        result, total = await call(path, accept="application/x-ndjson")
+        return result["first"], total, result["size"], 1
+
+    await measured("one JSON list", full)
+    await measured(f"pages of {args.page}", pages)
+    await measured(f"NDJSON (chunks of {main.STATUS_STREAM_CHUNK})", stream)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=100000)
+    parser.add_argument("--page", type=int, default=5000)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
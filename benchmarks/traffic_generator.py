@@ -0,0 +1,315 @@
+"""
+Synthetic Agent Traffic
+Open-loop replay of agent sessions (resolve -> manifest -> job -> 402 -> pay -> job)
+
+Sessions arrive as a Poisson process at each --rate, whether or not earlier
+sessions have finished, and every latency is measured from the moment the
+session was *due*, not from when the generator got around to sending it.
+A saturated server therefore shows up as growing latency instead of a
+quietly lower request rate (no coordinated omission).
+
+By default the app runs in-process (main.app over httpx.ASGITransport) with
+the mock chain, so paid jobs go through the real 402 -> pay -> confirm path:
+
+    python benchmarks/traffic_generator.py --rate 5 10 20 40 --duration 20
+    python benchmarks/traffic_generator.py --mix unlock=3,vend=2,browse=5 --rate 50
+
+Against a running server, payments come from POST /admin/chain/transactions
+when --admin-token is given (server in CHAIN_VERIFICATION=mock), otherwise
+random well-formed hashes are sent (server without verification):
+
+    python benchmarks/traffic_generator.py --url http://localhost:8000 --rate 20
+
+Requires httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Workflows mirror webapp/lib/agent.ts + seller-agent.ts: (ENS name, action, params)
+PAID_WORKFLOWS: Dict[str, Tuple[str, str, Dict[str, Any]]] = {
+    "unlock": ("smartlock.eth", "unlock", {}),
+    "print": ("3dprinter.eth", "print", {"file_url": "benchmark.gcode"}),
+    "filament": ("3dprinter.eth", "buy_filament", {"material_type": "PLA", "color": "black"}),
+    "charge": ("evcharger.eth", "charge", {"target_percent": 80}),
+    "vend": ("vendingmachine.eth", "dispense", {"quantity": 1}),
+    "restock": ("vendingmachine.eth", "restock", {"product_id": "Water", "quantity": 5}),
+    "view": ("camera.eth", "view", {"duration_sec": 30}),
+}
+FREE_WORKFLOWS: Dict[str, Tuple[str, str, Dict[str, Any]]] = {
+    "lock": ("smartlock.eth", "lock", {}),
+    "stop": ("evcharger.eth", "stop", {}),
+}
+BROWSE_QUERIES = ["buy PLA filament", "unlock door", "charge car", "snack", "camera stream"]
+
+DEFAULT_MIX = "unlock=3,lock=1,print=1,filament=1,charge=1,stop=1,vend=3,restock=1,view=1,browse=4"
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in PAID_WORKFLOWS and name not in FREE_WORKFLOWS and name != "browse":
+            raise ValueError(f"Unknown workflow '{name}'")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Latencies (seconds, from the due time) per workflow and per step."""
+
+    def __init__(self):
+        self.sessions: Dict[str, List[float]] = defaultdict(list)
+        self.steps: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.failed_sessions: Dict[str, int] = defaultdict(int)
+
+    def step(self, name: str, status: int, latency: float):
+        self.steps[name].append(latency)
+        self.statuses[name][status] += 1
+
+    def all_sessions(self) -> List[float]:
+        return sorted(v for values in self.sessions.values() for v in values)
+
+
+class SessionFailed(Exception):
+    pass
+
+
+class Payer:
+    """Issues transaction hashes the server will accept for a quoted payment."""
+
+    def __init__(self, chain=None, client: Optional[httpx.AsyncClient] = None, admin_token: Optional[str] = None):
+        self.chain = chain
+        self.client = client
+        self.admin_token = admin_token
+
+    async def pay(self, recipient: str, amount: str) -> str:
+        if self.chain is not None:
+            from payment_pipeline import eth_to_wei
+            return self.chain.send(recipient, eth_to_wei(amount))
+        if self.admin_token:
+            response = await self.client.post(
+                "/admin/chain/transactions", json={"amount": amount, "to": recipient},
+                headers={"X-Admin-Token": self.admin_token}
+            )
+            response.raise_for_status()
+            return response.json()["transaction_hash"]
+        return "0x" + uuid.uuid4().hex + uuid.uuid4().hex
+
+
+class Session:
+    """One agent session; each step is timed from when it became due."""
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, payer: Payer, due: float,
+                 job_poll_sec: float, job_timeout_sec: float):
+        self.client = client
+        self.recorder = recorder
+        self.payer = payer
+        self.due = due
+        self.job_poll_sec = job_poll_sec
+        self.job_timeout_sec = job_timeout_sec
+
+    async def request(self, step: str, method: str, path: str, expect=(200,), **kwargs) -> httpx.Response:
+        try:
+            response = await self.client.request(method, path, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError:
+            response, status = None, 0
+        now = time.monotonic()
+        self.recorder.step(step, status, now - self.due)
+        self.due = now
+        if status not in expect:
+            raise SessionFailed(f"{step}: HTTP {status}")
+        return response
+
+    async def discover(self, ens_name: str) -> str:
+        resolved = (await self.request("resolve", "GET", f"/resolve/{ens_name}")).json()
+        device_path = urlsplit(resolved["url"]).path
+        await self.request("manifest", "GET", f"{device_path}/ai-manifest")
+        return device_path
+
+    async def paid_job(self, ens_name: str, action: str, params: Dict[str, Any]):
+        device_path = await self.discover(ens_name)
+        body = {"action": action, "params": dict(params)}
+        quote = await self.request("job_402", "POST", f"{device_path}/job", expect=(402, 409), json=body)
+        if quote.status_code == 409:
+            raise SessionFailed("job_402: sold out")
+        details = quote.json()["detail"]["paymentDetails"]
+        if details.get("reservation_id"):
+            body["params"]["reservation_id"] = details["reservation_id"]
+
+        tx_hash = await self.payer.pay(details["recipient"], details["amount"])
+        self.due = time.monotonic()
+        response = await self.request(
+            "job_paid", "POST", f"{device_path}/job", expect=(200, 202), json=body,
+            headers={"Authorization": f"Bearer {tx_hash}", "X-Payer-Address": "0xbench"}
+        )
+        if response.status_code == 202:
+            await self.wait_confirmed(response.json()["status_url"])
+
+    async def wait_confirmed(self, status_url: str):
+        deadline = time.monotonic() + self.job_timeout_sec
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.job_poll_sec)
+            job = (await self.client.get(status_url)).json()
+            if job.get("status") == "completed":
+                self.recorder.step("confirmed", 200, time.monotonic() - self.due)
+                return
+            if job.get("status") == "failed":
+                self.recorder.step("confirmed", 500, time.monotonic() - self.due)
+                raise SessionFailed(f"payment failed: {job.get('error')}")
+        self.recorder.step("confirmed", 504, time.monotonic() - self.due)
+        raise SessionFailed("payment not confirmed before timeout")
+
+    async def free_job(self, ens_name: str, action: str, params: Dict[str, Any]):
+        device_path = await self.discover(ens_name)
+        await self.request("job_free", "POST", f"{device_path}/job", json={"action": action, "params": params})
+
+    async def browse(self):
+        await self.request("status", "GET", "/status")
+        await self.request("ai_manifest", "GET", "/ai-manifest")
+        await self.request("search", "GET", "/capabilities/search", params={"q": random.choice(BROWSE_QUERIES)})
+
+
+def _workflow(name: str) -> Callable[[Session], Awaitable[None]]:
+    if name == "browse":
+        return lambda session: session.browse()
+    if name in FREE_WORKFLOWS:
+        return lambda session: session.free_job(*FREE_WORKFLOWS[name])
+    return lambda session: session.paid_job(*PAID_WORKFLOWS[name])
+
+
+async def run_level(client: httpx.AsyncClient, payer: Payer, mix: Dict[str, float], rate: float,
+                    duration: float, args) -> Tuple[Recorder, float]:
+    """Offer `rate` sessions/s for `duration` seconds, then wait for stragglers."""
+    recorder = Recorder()
+    names, weights = list(mix), list(mix.values())
+    tasks = []
+
+    async def one(name: str, due: float):
+        session = Session(client, recorder, payer, due, args.job_poll_sec, args.job_timeout_sec)
+        try:
+            await _workflow(name)(session)
+            recorder.sessions[name].append(time.monotonic() - due)
+        except SessionFailed:
+            recorder.failed_sessions[name] += 1
+
+    start = time.monotonic()
+    due = start
+    while True:
+        due += random.expovariate(rate)
+        if due >= start + duration:
+            break
+        delay = due - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # Started late if the loop is saturated; latency still counts from `due`
+        tasks.append(asyncio.create_task(one(random.choices(names, weights)[0], due)))
+    await asyncio.gather(*tasks)
+    return recorder, time.monotonic() - start
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}"
+
+
+def report_level(rate: float, recorder: Recorder, elapsed: float, steps: bool):
+    sessions = recorder.all_sessions()
+    failed = sum(recorder.failed_sessions.values())
+    total = len(sessions) + failed
+    print(
+        f"{rate:>8g} {total / elapsed:>9.1f} {100.0 * len(sessions) / max(1, total):>6.1f}"
+        f" {_ms(percentile(sessions, 0.5)):>7} {_ms(percentile(sessions, 0.9)):>7}"
+        f" {_ms(percentile(sessions, 0.99)):>7} {_ms(percentile(sessions, 0.999)):>7}"
+        f" {_ms(sessions[-1] if sessions else 0):>7}"
+    )
+    if steps:
+        for name in sorted(recorder.steps):
+            values = sorted(recorder.steps[name])
+            codes = ",".join(f"{code}x{count}" for code, count in sorted(recorder.statuses[name].items()))
+            print(f"{'':>8}   {name:<12} n={len(values):<6} p50={_ms(percentile(values, 0.5)):>5}ms"
+                  f" p99={_ms(percentile(values, 0.99)):>5}ms  [{codes}]")
+        if failed:
+            print(f"{'':>8}   failed sessions: {dict(recorder.failed_sessions)}")
+
+
+def _in_process_app(args):
+    """Import main with throwaway state and the mock chain enabled."""
+    state = tempfile.mkdtemp(prefix="traffic-")
+    os.environ.setdefault("SNAPSHOT_PATH", "")
+    os.environ.setdefault("ACCESS_LOG_DIR", os.path.join(state, "access-log"))
+    os.environ.setdefault("JOB_STORE_PATH", os.path.join(state, "jobs.sqlite3"))
+    os.environ.setdefault("CHANNEL_STORE_PATH", os.path.join(state, "channels.sqlite3"))
+    os.environ.setdefault("CHAIN_VERIFICATION", "mock")
+    os.environ.setdefault("MOCK_BLOCK_TIME_SEC", str(args.block_time))
+    os.environ.setdefault("PAYMENT_POLL_INTERVAL_SEC", str(min(args.block_time, 0.5)))
+    sys.path.insert(0, ROOT)
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+    return main
+
+
+async def main_async(args):
+    mix = parse_mix(args.mix)
+    if args.url:
+        app_module = None
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        payer = Payer(client=client, admin_token=args.admin_token)
+    else:
+        app_module = _in_process_app(args)
+        await app_module.startup_event()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app),
+                                   base_url="http://traffic", timeout=args.timeout)
+        payer = Payer(chain=app_module.mock_chain)
+
+    print(f"{'rate/s':>8} {'achieved':>9} {'ok%':>6} {'p50ms':>7} {'p90ms':>7} {'p99ms':>7} {'p999ms':>7} {'maxms':>7}")
+    try:
+        for rate in args.rate:
+            recorder, elapsed = await run_level(client, payer, mix, rate, args.duration, args)
+            report_level(rate, recorder, elapsed, args.steps)
+    finally:
+        await client.aclose()
+        if app_module is not None:
+            await app_module.shutdown_event()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, nargs="+", default=[5, 10, 20], help="sessions per second (one run per value)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per rate")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="workflow=weight list")
+    parser.add_argument("--url", help="target server (default: main.app in-process)")
+    parser.add_argument("--admin-token", help="ADMIN_TOKEN of the target, to pay via its mock chain")
+    parser.add_argument("--block-time", type=float, default=0.5, help="in-process mock chain block time")
+    parser.add_argument("--job-poll-sec", type=float, default=0.25)
+    parser.add_argument("--job-timeout-sec", type=float, default=60.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout")
+    parser.add_argument("--steps", action="store_true", help="per-step latency and status codes")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    asyncio.run(main_async(args))
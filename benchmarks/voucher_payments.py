@@ -0,0 +1,152 @@
+"""
+Voucher Payments Benchmark
+Per-action on-chain payments vs payment channel vouchers, offline with local keys
+
+1. Signature checks: full public-key recovery per voucher vs the verifier's
+   cached signer keys, over --channels channels.
+2. End to end, in-process with the mock chain: --agents agents each run
+   --jobs paid unlock/lock cycles, paying either with one transaction per
+   unlock (202, then wait for --confirmations blocks) or with vouchers
+   against a channel opened once. Reports per-unlock latency.
+
+    python benchmarks/voucher_payments.py --agents 4 --jobs 10 --block-time 0.5
+
+Requires httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import List
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from vouchers import COINCURVE_AVAILABLE, VoucherVerifier, address_of, recover_public_key, sign_voucher  # noqa: E402
+
+ADMIN_TOKEN = "benchmark"
+VENDOR = "0x" + "42" * 20
+
+
+def bench_signatures(channels: int, vouchers_per_channel: int):
+    keys = [os.urandom(32) for _ in range(channels)]
+    signed = []
+    for key in keys:
+        channel_id = "0x" + os.urandom(32).hex()
+        signed += [(sign_voucher(key, channel_id, VENDOR, n + 1), address_of(key)) for n in range(vouchers_per_channel)]
+
+    started = time.perf_counter()
+    for voucher, _ in signed:
+        recover_public_key(voucher.digest(VENDOR), voucher.signature)
+    recover_us = (time.perf_counter() - started) / len(signed) * 1e6
+
+    verifier = VoucherVerifier()
+    started = time.perf_counter()
+    assert all(verifier.check(voucher.digest(VENDOR), voucher.signature, signer) for voucher, signer in signed)
+    cached_us = (time.perf_counter() - started) / len(signed) * 1e6
+
+    backend = "coincurve" if COINCURVE_AVAILABLE else "pure Python"
+    print(f"signature checks ({backend}, {len(signed)} vouchers over {channels} channels)")
+    print(f"  recovery per voucher  {recover_us:>8.0f} us")
+    print(f"  cached signer keys    {cached_us:>8.0f} us  ({verifier.key_hits} key cache hits)")
+
+
+async def unlock_cycle_tx(client: httpx.AsyncClient, main, payer: str) -> float:
+    amount = main._site().price("smart_lock", "unlock")
+    started = time.perf_counter()
+    tx = (await client.post("/admin/chain/transactions", json={"amount": amount, "sender": payer},
+                            headers={"X-Admin-Token": ADMIN_TOKEN})).json()["transaction_hash"]
+    job = (await client.post("/devices/smart_lock_01/job", json={"action": "unlock"},
+                             headers={"Authorization": f"Bearer {tx}", "X-Payer-Address": payer})).json()
+    while main.payment_pipeline.get(job["job_id"]).status not in ("completed", "failed"):
+        await asyncio.sleep(0.01)
+    latency = time.perf_counter() - started
+    await client.post("/devices/smart_lock_01/job", json={"action": "lock"})
+    return latency
+
+
+async def open_channel(client: httpx.AsyncClient, main, key: bytes, deposit_eth: str) -> str:
+    payer = address_of(key)
+    tx = (await client.post("/admin/chain/transactions", json={"amount": deposit_eth, "sender": payer},
+                            headers={"X-Admin-Token": ADMIN_TOKEN})).json()["transaction_hash"]
+    channel = (await client.post("/channels", json={"payer": payer, "deposit_eth": deposit_eth,
+                                                    "deposit_tx": tx})).json()
+    while main.channel_ledger.get(channel["channel_id"]).status == "pending_deposit":
+        await asyncio.sleep(0.01)
+    return channel["channel_id"]
+
+
+async def bench_end_to_end(args):
+    state = tempfile.mkdtemp(prefix="vouchers-")
+    os.environ.update(
+        SNAPSHOT_PATH="", JOB_STORE_PATH="", ACCESS_LOG_DIR=os.path.join(state, "access-log"),
+        CHANNEL_STORE_PATH=os.path.join(state, "channels.sqlite3"), CHAIN_VERIFICATION="mock",
+        MOCK_BLOCK_TIME_SEC=str(args.block_time), PAYMENT_POLL_INTERVAL_SEC=str(min(args.block_time, 0.1)),
+        PAYMENT_CONFIRMATIONS=str(args.confirmations), ADMIN_TOKEN=ADMIN_TOKEN
+    )
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+    await main.startup_event()
+    vendor = main._site().vendor_address
+    price_wei = main.eth_to_wei(main._site().price("smart_lock", "unlock"))
+    # One lock is shared, so agents take turns on it like real customers would
+    lock = asyncio.Lock()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+        async def tx_agent() -> List[float]:
+            payer = address_of(os.urandom(32))
+            latencies = []
+            for _ in range(args.jobs):
+                async with lock:
+                    latencies.append(await unlock_cycle_tx(client, main, payer))
+            return latencies
+
+        async def voucher_agent() -> List[float]:
+            key = os.urandom(32)
+            channel_id = await open_channel(client, main, key, "1")
+            latencies, cumulative = [], 0
+            for _ in range(args.jobs):
+                cumulative += price_wei
+                header = sign_voucher(key, channel_id, vendor, cumulative).header()
+                async with lock:
+                    started = time.perf_counter()
+                    response = await client.post("/devices/smart_lock_01/job", json={"action": "unlock"},
+                                                 headers={"Authorization": header})
+                    assert response.status_code == 200, response.text
+                    latencies.append(time.perf_counter() - started)
+                    await client.post("/devices/smart_lock_01/job", json={"action": "lock"})
+            return latencies
+
+        print(f"\nend to end ({args.agents} agents x {args.jobs} unlocks, block time {args.block_time}s, "
+              f"{args.confirmations} confirmations)")
+        for label, agent in [("tx per unlock", tx_agent), ("vouchers", voucher_agent)]:
+            started = time.perf_counter()
+            results = await asyncio.gather(*(agent() for _ in range(args.agents)))
+            elapsed = time.perf_counter() - started
+            latencies = sorted(l for agent_latencies in results for l in agent_latencies)
+            print(f"  {label:<14} p50 {statistics.median(latencies) * 1000:>8.1f} ms   "
+                  f"max {latencies[-1] * 1000:>8.1f} ms   {len(latencies) / elapsed:>7.1f} unlocks/s")
+        verifier = main.channel_ledger.verifier
+        print(f"  verifier: {verifier.verified} verified in {verifier.batches} batches, "
+              f"{verifier.key_hits} key cache hits")
+    await main.shutdown_event()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels", type=int, default=8)
+    parser.add_argument("--vouchers", type=int, default=25, help="vouchers per channel (signature checks)")
+    parser.add_argument("--agents", type=int, default=4)
+    parser.add_argument("--jobs", type=int, default=10)
+    parser.add_argument("--block-time", type=float, default=0.5)
+    parser.add_argument("--confirmations", type=int, default=2)
+    args = parser.parse_args()
+    bench_signatures(args.channels, args.vouchers)
+    asyncio.run(bench_end_to_end(args))
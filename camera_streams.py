@@ -0,0 +1,182 @@
+"""
+Camera Stream Sessions
+Paid viewing sessions, per-camera viewer registries and a shared frame buffer
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+# Bandwidth model (matches the simulator's telemetry): a streaming camera
+# costs a fixed ingest rate plus a fixed rate per connected viewer
+CAMERA_BASE_MBPS = 4.0
+VIEWER_MBPS = 0.5
+DEFAULT_FPS = 5
+MULTIPART_BOUNDARY = "frame"
+
+
+class StreamCapacityError(Exception):
+    """Admitting another viewer would exceed the node's bandwidth budget."""
+
+
+class StreamSession:
+    def __init__(self, camera_id: str, viewer: Optional[str], duration_sec: float,
+                 tx_hash: Optional[str] = None):
+        self.id = str(uuid.uuid4())
+        self.camera_id = camera_id
+        self.viewer = viewer
+        self.tx_hash = tx_hash
+        self.started_at = time.time()
+        self.expires_at = self.started_at + duration_sec
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.time()) >= self.expires_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.id,
+            "camera_id": self.camera_id,
+            "viewer": self.viewer,
+            "started_at": datetime.utcfromtimestamp(self.started_at).isoformat() + "Z",
+            "expires_at": datetime.utcfromtimestamp(self.expires_at).isoformat() + "Z"
+        }
+
+
+class ViewerRegistry:
+    """Live sessions for one camera; keeps the broker's node-wide count in sync."""
+
+    def __init__(self, camera_id: str, broker: "StreamBroker"):
+        self.camera_id = camera_id
+        self.broker = broker
+        self.sessions: Dict[str, StreamSession] = {}
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def get(self, session_id: str) -> Optional[StreamSession]:
+        session = self.sessions.get(session_id)
+        if session is not None and session.expired():
+            self.remove(session_id)
+            return None
+        return session
+
+    def add(self, session: StreamSession):
+        self.sessions[session.id] = session
+        self.broker.total_viewers += 1
+
+    def remove(self, session_id: str) -> bool:
+        if self.sessions.pop(session_id, None) is None:
+            return False
+        self.broker.total_viewers -= 1
+        return True
+
+    def next_expiry(self) -> Optional[float]:
+        """Earliest session expiry (time.time() seconds), if any."""
+        return min((s.expires_at for s in self.sessions.values()), default=None)
+
+    def expire(self, now: Optional[float] = None) -> int:
+        now = now if now is not None else time.time()
+        expired = [sid for sid, s in self.sessions.items() if s.expired(now)]
+        for session_id in expired:
+            self.remove(session_id)
+        return len(expired)
+
+
+class FrameBuffer:
+    """
+    Latest synthetic frame for one camera, shared by every viewer.
+
+    The first reader after a frame interval builds the next multipart part;
+    everyone else yields that same bytes object, so the cost per frame is one
+    allocation no matter how many viewers are attached.
+    """
+
+    def __init__(self, camera_id: str, fps: int = DEFAULT_FPS, viewer_mbps: float = VIEWER_MBPS):
+        self.camera_id = camera_id
+        self.interval = 1.0 / fps
+        frame_size = int(viewer_mbps * 1_000_000 / 8 / fps)
+        # Static body; only the small per-frame header changes
+        self._body = os.urandom(frame_size)
+        self.seq = 0
+        self.part = b""
+        self._built_at = 0.0
+
+    def current(self, now: Optional[float] = None) -> bytes:
+        now = now if now is not None else time.monotonic()
+        if now - self._built_at >= self.interval:
+            self.seq += 1
+            self._built_at = now
+            header = f"X-Camera: {self.camera_id}\r\nX-Frame: {self.seq}\r\n".encode("ascii")
+            self.part = b"".join([
+                f"--{MULTIPART_BOUNDARY}\r\nContent-Type: image/jpeg\r\n".encode("ascii"),
+                header,
+                f"Content-Length: {len(self._body)}\r\n\r\n".encode("ascii"),
+                self._body,
+                b"\r\n"
+            ])
+        return self.part
+
+
+class StreamBroker:
+    """
+    Node-wide view of camera streams: admission against a bandwidth budget,
+    per-camera registries and shared frame buffers.
+    """
+
+    def __init__(self, budget_mbps: float, fps: int = DEFAULT_FPS):
+        self.budget_mbps = budget_mbps
+        self.fps = fps
+        self.total_viewers = 0
+        self.registries: Dict[str, ViewerRegistry] = {}
+        self.buffers: Dict[str, FrameBuffer] = {}
+        self.cameras: List[Any] = []
+
+    def register_camera(self, camera) -> ViewerRegistry:
+        registry = ViewerRegistry(camera.id, self)
+        self.registries[camera.id] = registry
+        self.buffers[camera.id] = FrameBuffer(camera.id, self.fps)
+        self.cameras.append(camera)
+        return registry
+
+    def used_mbps(self) -> float:
+        streaming = sum(1 for c in self.cameras if c.is_streaming and not c.privacy_mode)
+        return streaming * CAMERA_BASE_MBPS + self.total_viewers * VIEWER_MBPS
+
+    def max_additional_viewers(self) -> int:
+        return max(0, int((self.budget_mbps - self.used_mbps()) // VIEWER_MBPS))
+
+    def open_session(self, camera, viewer: Optional[str], duration_sec: float,
+                     tx_hash: Optional[str] = None) -> StreamSession:
+        if self.max_additional_viewers() < 1:
+            raise StreamCapacityError(
+                f"Node stream budget exhausted ({self.used_mbps():.1f}/{self.budget_mbps:.1f} Mbps)"
+            )
+        session = StreamSession(camera.id, viewer, duration_sec, tx_hash)
+        self.registries[camera.id].add(session)
+        return session
+
+    def capacity(self) -> Dict[str, Any]:
+        return {
+            "budget_mbps": self.budget_mbps,
+            "used_mbps": round(self.used_mbps(), 1),
+            "active_viewers": self.total_viewers,
+            "max_additional_viewers": self.max_additional_viewers(),
+            "per_viewer_mbps": VIEWER_MBPS,
+            "cameras": {
+                camera_id: len(registry) for camera_id, registry in self.registries.items()
+            }
+        }
+
+    async def frames(self, camera, session: StreamSession) -> AsyncIterator[bytes]:
+        """Multipart frame stream for one viewer until the session ends."""
+        registry = self.registries[camera.id]
+        buffer = self.buffers[camera.id]
+        while registry.get(session.id) is not None:
+            if camera.privacy_mode or not camera.is_streaming:
+                await asyncio.sleep(buffer.interval)
+                continue
+            yield buffer.current()
+            await asyncio.sleep(buffer.interval)
@@ -0,0 +1,138 @@
+"""
+Capability Index
+Inverted index over device manifests for agent-facing capability search
+"""
+
+import math
+import re
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from models import DeviceSimulator
+
+# Field weights: an exact capability id or enum value beats a description word
+FIELD_WEIGHTS = {
+    "id": 3.0,
+    "enum": 3.0,
+    "type": 2.0,
+    "description": 1.0
+}
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Capability class = (device type, capability id)
+ClassKey = Tuple[str, str]
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric words with a trailing plural "s" dropped."""
+    tokens = []
+    for word in _TOKEN.findall(text.lower()):
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def _enum_values(schema: Dict[str, Any]) -> Iterator[str]:
+    for prop in (schema or {}).get("properties", {}).values():
+        for value in prop.get("enum", ()):
+            yield str(value)
+
+
+class CapabilityIndex:
+    """
+    token -> capability class -> weight, where a class is one capability of
+    one device type ("3d_printer", "buy_filament").
+
+    Capabilities are indexed once per class, not per device: descriptions
+    are indexed with the device name removed, so every printer contributes
+    the same tokens. Scoring walks the postings of the query tokens, whose
+    size is bounded by the number of classes; only the top `limit` device
+    hits are then read from the matching classes, so query time does not
+    grow with the fleet.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[ClassKey, float]] = {}
+        self._class_tokens: Dict[ClassKey, Dict[str, float]] = {}
+        # class -> device id -> hit (insertion ordered)
+        self._members: Dict[ClassKey, Dict[str, Dict[str, Any]]] = {}
+        self._device_classes: Dict[str, List[ClassKey]] = {}
+
+    def __len__(self) -> int:
+        return len(self._device_classes)
+
+    @staticmethod
+    def _weights(device: DeviceSimulator, capability: Dict[str, Any]) -> Dict[str, float]:
+        fields = [
+            ("id", capability["id"]),
+            ("type", device.type),
+            ("description", capability.get("description", "").replace(device.name, " ")),
+        ]
+        fields += [("enum", value) for value in _enum_values(capability.get("schema"))]
+        weights: Dict[str, float] = {}
+        for field, text in fields:
+            for token in tokenize(text):
+                weights[token] = max(weights.get(token, 0.0), FIELD_WEIGHTS[field])
+        return weights
+
+    def register(self, device: DeviceSimulator, capabilities: List[Dict[str, Any]]):
+        """Index a device's manifest capabilities (replaces a previous registration)."""
+        self.deregister(device.id)
+        classes = []
+        for capability in capabilities:
+            key = (device.type, capability["id"])
+            if key not in self._class_tokens:
+                weights = self._weights(device, capability)
+                self._class_tokens[key] = weights
+                for token, weight in weights.items():
+                    self._postings.setdefault(token, {})[key] = weight
+            self._members.setdefault(key, {})[device.id] = {
+                "device_id": device.id,
+                "device_name": device.name,
+                "device_type": device.type,
+                "capability": capability["id"],
+                "endpoint": capability["endpoint"],
+                "method": capability["method"],
+                "payment_required": capability.get("payment_required", False),
+                "price_eth": capability.get("default_amount_eth", "0")
+            }
+            classes.append(key)
+        self._device_classes[device.id] = classes
+
+    def deregister(self, device_id: str):
+        for key in self._device_classes.pop(device_id, ()):
+            members = self._members[key]
+            members.pop(device_id, None)
+            if members:
+                continue
+            # Last device of the class: drop its postings
+            del self._members[key]
+            for token in self._class_tokens.pop(key):
+                postings = self._postings[token]
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[token]
+
+    def search(self, query: str, limit: int = 20, device_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Hits ranked by the sum of field weight x idf of the matched query tokens."""
+        tokens: Set[str] = set(tokenize(query))
+        total = len(self._class_tokens)
+        scores: Dict[ClassKey, float] = {}
+        for token in tokens:
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1.0 + total / len(postings))
+            for key, weight in postings.items():
+                if device_type and key[0] != device_type:
+                    continue
+                scores[key] = scores.get(key, 0.0) + weight * idf
+
+        hits = []
+        for key, score in sorted(scores.items(), key=lambda item: (-item[1], item[0])):
+            for member in self._members[key].values():
+                hits.append(dict(member, score=round(score, 3)))
+                if len(hits) >= limit:
+                    return hits
+        return hits
@@ -0,0 +1,158 @@
+"""
+EV Charging Sessions
+Per-session energy accounting and site-level power sharing across chargers
+"""
+
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+# Above this state of charge the vehicle accepts less power (CC/CV taper)
+TAPER_START_PERCENT = 80.0
+# Fraction of the charger's max power still accepted at 100%
+TAPER_FLOOR = 0.1
+# Power is re-evaluated every this many percent while tapering
+TAPER_STEP_PERCENT = 1.0
+
+
+class ChargingSession:
+    def __init__(self, station_id: str, target_percent: float, tx_hash: Optional[str] = None):
+        self.id = str(uuid.uuid4())
+        self.station_id = station_id
+        self.target_percent = target_percent
+        self.tx_hash = tx_hash
+        self.started_at = datetime.utcnow().isoformat() + "Z"
+        self.ended_at: Optional[str] = None
+        self.energy_kwh = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self.ended_at is None
+
+    def end(self):
+        if self.ended_at is None:
+            self.ended_at = datetime.utcnow().isoformat() + "Z"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "station_id": self.station_id,
+            "target_percent": self.target_percent,
+            "tx_hash": self.tx_hash,
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+            "energy_kwh": self.energy_kwh
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ChargingSession":
+        session = cls(data["station_id"], data["target_percent"], data.get("tx_hash"))
+        session.id = data["id"]
+        session.started_at = data["started_at"]
+        session.ended_at = data.get("ended_at")
+        session.energy_kwh = data.get("energy_kwh", 0.0)
+        return session
+
+
+def power_demand_kw(max_power_kw: float, battery_percent: float) -> float:
+    """Power the vehicle will accept at this state of charge."""
+    if battery_percent <= TAPER_START_PERCENT:
+        return max_power_kw
+    span = 100.0 - TAPER_START_PERCENT
+    remaining = max(0.0, 100.0 - battery_percent) / span
+    return max_power_kw * (TAPER_FLOOR + (1.0 - TAPER_FLOOR) * remaining)
+
+
+def next_power_step_percent(battery_percent: float, target_percent: float) -> float:
+    """
+    Next state of charge at which the accepted power changes (start of the
+    taper, then every TAPER_STEP_PERCENT), capped at the session target.
+    """
+    if battery_percent < TAPER_START_PERCENT:
+        step = TAPER_START_PERCENT
+    else:
+        step = (int((battery_percent - TAPER_START_PERCENT) / TAPER_STEP_PERCENT) + 1) * TAPER_STEP_PERCENT + TAPER_START_PERCENT
+    return min(step, target_percent)
+
+
+def charge_duration_sec(battery_percent: float, target_percent: float, capacity_kwh: float,
+                        max_power_kw: float, cap_kw: Optional[float] = None) -> float:
+    """
+    Time to charge from battery_percent to target_percent following the
+    taper, with the accepted power further capped at cap_kw (a site grant).
+    """
+    seconds = 0.0
+    percent = battery_percent
+    while percent < target_percent - 1e-9:
+        step = next_power_step_percent(percent, target_percent)
+        power_kw = power_demand_kw(max_power_kw, percent)
+        if cap_kw is not None and cap_kw > 0:
+            power_kw = min(power_kw, cap_kw)
+        seconds += (step - percent) / 100.0 * capacity_kwh / power_kw * 3600.0
+        percent = step
+    return seconds
+
+
+def allocate_power(demands: Sequence[float], cap_kw: float) -> List[float]:
+    """
+    Max-min fair split of a site power cap (water-filling).
+
+    Stations asking for less than an equal share get their full demand and the
+    leftover is spread over the rest. One sort plus one pass: O(n log n).
+    """
+    allocation = [0.0] * len(demands)
+    order = sorted((i for i, d in enumerate(demands) if d > 0), key=lambda i: demands[i])
+    remaining = max(0.0, cap_kw)
+    left = len(order)
+    for i in order:
+        share = remaining / left
+        granted = min(demands[i], share)
+        allocation[i] = granted
+        remaining -= granted
+        left -= 1
+    return allocation
+
+
+class SiteLoadBalancer:
+    """
+    Shares one grid connection between every charger registered on the site.
+
+    rebalance() runs when a job starts or stops a session, and once per
+    scheduler tick after any charger crossed a taper step or finished. It
+    first brings every station up to date (so energy drawn at the old
+    allocation is accounted for), then applies the new split.
+    """
+
+    def __init__(self, power_cap_kw: float):
+        self.power_cap_kw = power_cap_kw
+        self.stations: List[Any] = []
+        self.last_allocated_kw = 0.0
+
+    def add(self, station):
+        self.stations.append(station)
+
+    def remove(self, station):
+        if station in self.stations:
+            self.stations.remove(station)
+
+    def rebalance(self) -> List[Any]:
+        """Apply a new split; returns the stations whose allocation changed."""
+        for station in self.stations:
+            station.sync()
+        demands = [station.power_demand_kw() for station in self.stations]
+        allocation = allocate_power(demands, self.power_cap_kw)
+        changed = []
+        for station, granted in zip(self.stations, allocation):
+            if granted != station.allocated_power_kw:
+                station.set_allocation(granted)
+                changed.append(station)
+        self.last_allocated_kw = sum(allocation)
+        return changed
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "power_cap_kw": self.power_cap_kw,
+            "allocated_kw": round(self.last_allocated_kw, 2),
+            "stations": len(self.stations),
+            "charging": sum(1 for s in self.stations if s.status == "CHARGING")
+        }
@@ -0,0 +1,219 @@
+"""
+Cluster Mode
+Consistent-hash sharding of devices across API nodes, with scatter-gather reads
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import re
+import signal
+import subprocess
+import sys
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Header marking a peer's sub-request: answer from the local shard only
+LOCAL_HEADER = "X-Cluster-Local"
+
+DEFAULT_VNODES = 128
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+def parse_nodes(spec: str) -> Dict[str, str]:
+    """"node1=http://10.0.0.1:8000,node2=http://10.0.0.2:8000" -> {name: url}."""
+    nodes = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, url = part.partition("=")
+        if not sep:
+            raise ValueError(f"CLUSTER_NODES entry '{part}' must be name=url")
+        nodes[name.strip()] = url.strip().rstrip("/")
+    return nodes
+
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes. Adding or removing one of N
+    nodes moves ~1/N of the devices; lookups are a bisect over the ring.
+    """
+
+    def __init__(self, nodes: Dict[str, str], vnodes: int = DEFAULT_VNODES):
+        self.nodes = dict(nodes)
+        self.vnodes = vnodes
+        ring: List[Tuple[int, str]] = []
+        for name in nodes:
+            for replica in range(vnodes):
+                ring.append((_hash(f"{name}#{replica}"), name))
+        ring.sort()
+        self._points = [point for point, _ in ring]
+        self._owners = [name for _, name in ring]
+
+    def owner(self, key: str) -> str:
+        position = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[position]
+
+    def url(self, node: str) -> str:
+        return self.nodes[node]
+
+
+class Cluster:
+    """This node's view of the cluster: the ring, itself and the directory
+    of every device in the fleet (so any node can route to any device)."""
+
+    def __init__(self, nodes: Dict[str, str], self_name: str, timeout_sec: float = 2.0,
+                 vnodes: int = DEFAULT_VNODES):
+        if self_name not in nodes:
+            raise ValueError(f"CLUSTER_SELF '{self_name}' is not in CLUSTER_NODES")
+        self.ring = HashRing(nodes, vnodes)
+        self.self_name = self_name
+        self.timeout_sec = timeout_sec
+        # device id -> (site id, owning node, display name, type); ENS name -> device id
+        self.directory: Dict[str, Tuple[str, str, str, str]] = {}
+        self.ens_directory: Dict[str, str] = {}
+
+    @property
+    def peers(self) -> Dict[str, str]:
+        return {name: url for name, url in self.ring.nodes.items() if name != self.self_name}
+
+    def owns(self, device_id: str) -> bool:
+        return self.ring.owner(device_id) == self.self_name
+
+    def register(self, site_id: str, device_id: str, ens_domain: str, name: str, device_type: str):
+        self.directory[device_id] = (site_id, self.ring.owner(device_id), name, device_type)
+        self.ens_directory[ens_domain] = device_id
+
+    def owner_url(self, device_id: str) -> Optional[str]:
+        entry = self.directory.get(device_id)
+        return self.ring.url(entry[1]) if entry else None
+
+    def _fetch(self, url: str) -> Any:
+        request = urllib.request.Request(url, headers={LOCAL_HEADER: "1", "Accept": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout_sec) as response:
+            return json.loads(response.read())
+
+    async def fetch(self, node: str, path: str) -> Any:
+        """GET `path` from one peer (worker thread, per-request timeout)."""
+        return await asyncio.to_thread(self._fetch, self.peers[node] + path)
+
+    async def gather(self, path: str) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        GET `path` from every peer in parallel (worker threads, per-request
+        timeout). Returns ({node: body}, [nodes that failed or timed out]).
+        """
+        peers = self.peers
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self._fetch, url + path) for url in peers.values()),
+            return_exceptions=True
+        )
+        bodies, missing = {}, []
+        for name, result in zip(peers, results):
+            if isinstance(result, Exception):
+                logger.warning(f"[CLUSTER] {name} {path} failed: {str(result)}")
+                missing.append(name)
+            else:
+                bodies[name] = result
+        return bodies, missing
+
+
+# Device-scoped routes: the device id is taken from the first group
+_DEVICE_ROUTES = [
+    re.compile(r"^/devices/([^/]+)/"),
+    re.compile(r"^/status/([^/]+)$"),
+    re.compile(r"^/v1/devices/([^/]+)/unlock$"),
+]
+
+
+class ShardRedirectMiddleware:
+    """
+    Device-scoped requests that reach a node not owning the device get a 307
+    to the owner (method and body are preserved by clients). Runs inside
+    site routing, so it sees the path with any /sites/<id> prefix removed.
+    """
+
+    def __init__(self, app, cluster: Cluster, site_prefix=lambda: ""):
+        self.app = app
+        self.cluster = cluster
+        self.site_prefix = site_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            path = scope["path"]
+            for pattern in _DEVICE_ROUTES:
+                match = pattern.match(path)
+                if not match:
+                    continue
+                device_id = match.group(1).replace("_", "-")
+                entry = self.cluster.directory.get(device_id)
+                if entry and entry[1] != self.cluster.self_name:
+                    query = scope.get("query_string", b"").decode("latin-1")
+                    location = self.cluster.ring.url(entry[1]) + self.site_prefix() + path + (f"?{query}" if query else "")
+                    await send({
+                        "type": "http.response.start",
+                        "status": 307,
+                        "headers": [(b"location", location.encode("latin-1")), (b"content-length", b"0")]
+                    })
+                    await send({"type": "http.response.body", "body": b""})
+                    return
+                break
+        await self.app(scope, receive, send)
+
+
+def run_local_cluster(count: int, base_port: int = 8001, host: str = "127.0.0.1",
+                      public_host: Optional[str] = None, command: Optional[List[str]] = None):
+    """
+    Start `count` nodes on consecutive ports, each with its own state
+    directory, and wait for them (Ctrl+C or SIGTERM stops all):
+
+        python cluster.py 3
+
+    Nodes run `uvicorn main:app` unless `command` is given; the node's port
+    is always passed in the PORT environment variable.
+    """
+    public_host = public_host or host
+    nodes = {f"node{i + 1}": f"http://{public_host}:{base_port + i}" for i in range(count)}
+    spec = ",".join(f"{name}={url}" for name, url in nodes.items())
+    processes = []
+    for i, name in enumerate(nodes):
+        port = str(base_port + i)
+        state = os.path.join("state", name)
+        env = dict(
+            os.environ,
+            PORT=port,
+            CLUSTER_NODES=spec,
+            CLUSTER_SELF=name,
+            SNAPSHOT_PATH=os.path.join(state, "fleet.snapshot"),
+            JOB_STORE_PATH=os.path.join(state, "jobs.sqlite3"),
+            CHANNEL_STORE_PATH=os.path.join(state, "channels.sqlite3"),
+            ACCESS_LOG_DIR=os.path.join(state, "access-log")
+        )
+        argv = command or [sys.executable, "-m", "uvicorn", "main:app", "--host", host, "--port", port]
+        processes.append(subprocess.Popen(argv, env=env))
+        print(f"[CLUSTER] {name} -> {nodes[name]}")
+
+    # Forward SIGTERM (docker stop) so every node shuts down gracefully
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    run_local_cluster(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -0,0 +1,71 @@
+"""
+Device Mutations
+Per-device locks and optimistic versions so jobs apply as atomic state transitions
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Optional, TypeVar
+
+from models import DeviceSimulator
+
+T = TypeVar("T")
+
+
+class VersionConflictError(Exception):
+    """The device changed since the version the client read."""
+
+    def __init__(self, device: DeviceSimulator, expected: int):
+        super().__init__(f"{device.id} is at version {device.version}, expected {expected}")
+        self.device = device
+        self.expected = expected
+
+
+class DeviceMutator:
+    """
+    Every job on a device goes through transaction(): jobs on the same device
+    run one at a time (an asyncio.Lock per device, so different devices never
+    wait on each other), and the device is synced to now before the job reads
+    it. Work that awaits (payment checks, RPC calls) can be done inside the
+    transaction and still cannot interleave with another job on that device.
+
+    apply() runs a synchronous transition: validate, then mutate, with no
+    await in between, and one version bump at the end. Raising before
+    mutating leaves the device untouched.
+    """
+
+    def __init__(self, scheduler=None):
+        self.scheduler = scheduler
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def lock(self, device: DeviceSimulator) -> asyncio.Lock:
+        lock = self._locks.get(device.id)
+        if lock is None:
+            lock = self._locks[device.id] = asyncio.Lock()
+        return lock
+
+    def busy(self, device: DeviceSimulator) -> bool:
+        lock = self._locks.get(device.id)
+        return lock is not None and lock.locked()
+
+    @asynccontextmanager
+    async def transaction(self, device: DeviceSimulator,
+                          expected_version: Optional[int] = None) -> AsyncIterator[DeviceSimulator]:
+        async with self.lock(device):
+            device.sync()
+            if expected_version is not None and device.version != expected_version:
+                raise VersionConflictError(device, expected_version)
+            try:
+                yield device
+            finally:
+                # The job may have started or cancelled a timed event
+                if self.scheduler is not None:
+                    self.scheduler.schedule(device)
+
+    async def apply(self, device: DeviceSimulator, transition: Callable[[], T],
+                    expected_version: Optional[int] = None) -> T:
+        """Run transition() atomically under the device's lock and publish the change."""
+        async with self.transaction(device, expected_version):
+            result = transition()
+            device.update()
+            return result
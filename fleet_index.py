@@ -0,0 +1,123 @@
+"""
+Fleet Index
+Secondary indexes over the device registry for the /devices query endpoint
+"""
+
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from models import DeviceSimulator
+
+# Bucket = insertion-ordered dict used as an ordered set of device id -> device
+Bucket = Dict[str, DeviceSimulator]
+
+
+def ens_suffixes(ens_domain: str) -> List[str]:
+    """All dot-suffixes of an ENS name: "a.hq.eth" -> ["a.hq.eth", "hq.eth", "eth"]."""
+    labels = ens_domain.lower().split(".")
+    return [".".join(labels[i:]) for i in range(len(labels))]
+
+
+class FleetIndex:
+    """
+    Secondary indexes by type, status string, ENS suffix and in-stock product.
+
+    Devices are re-indexed from their change notifications (update() and job
+    mutations), so each change costs O(1) and a query only walks the smallest
+    matching bucket instead of the whole fleet.
+    """
+
+    def __init__(self):
+        self._all: Bucket = {}
+        self._by_type: Dict[str, Bucket] = {}
+        self._by_status: Dict[str, Bucket] = {}
+        self._by_ens_suffix: Dict[str, Bucket] = {}
+        self._by_product: Dict[str, Bucket] = {}
+        # Last indexed (status, products) per device id, to diff on change
+        self._keys: Dict[str, Tuple[str, FrozenSet[str]]] = {}
+
+    @staticmethod
+    def _put(index: Dict[str, Bucket], key: str, device: DeviceSimulator):
+        index.setdefault(key, {})[device.id] = device
+
+    @staticmethod
+    def _drop(index: Dict[str, Bucket], key: str, device_id: str):
+        bucket = index.get(key)
+        if bucket is None:
+            return
+        bucket.pop(device_id, None)
+        if not bucket:
+            del index[key]
+
+    def add(self, device: DeviceSimulator):
+        if device.id in self._all:
+            return
+        self._all[device.id] = device
+        self._put(self._by_type, device.type, device)
+        for suffix in ens_suffixes(device.ens_domain):
+            self._put(self._by_ens_suffix, suffix, device)
+        self._keys[device.id] = ("", frozenset())
+        self.reindex(device)
+        device.add_observer(self.reindex)
+
+    def remove(self, device: DeviceSimulator):
+        if device.id not in self._all:
+            return
+        device.remove_observer(self.reindex)
+        status, products = self._keys.pop(device.id)
+        del self._all[device.id]
+        self._drop(self._by_type, device.type, device.id)
+        self._drop(self._by_status, status, device.id)
+        for suffix in ens_suffixes(device.ens_domain):
+            self._drop(self._by_ens_suffix, suffix, device.id)
+        for product in products:
+            self._drop(self._by_product, product, device.id)
+
+    def reindex(self, device: DeviceSimulator):
+        old_status, old_products = self._keys[device.id]
+        status = device._get_status_string().upper()
+        products = frozenset(p.lower() for p in device.stocked_products())
+
+        if status != old_status:
+            self._drop(self._by_status, old_status, device.id)
+            self._put(self._by_status, status, device)
+        if products != old_products:
+            for product in old_products - products:
+                self._drop(self._by_product, product, device.id)
+            for product in products - old_products:
+                self._put(self._by_product, product, device)
+
+        self._keys[device.id] = (status, products)
+
+    def query(
+        self,
+        device_type: Optional[str] = None,
+        status: Optional[str] = None,
+        ens_suffix: Optional[str] = None,
+        product: Optional[str] = None,
+        limit: int = 50
+    ) -> List[DeviceSimulator]:
+        buckets: List[Bucket] = []
+        if device_type is not None:
+            buckets.append(self._by_type.get(device_type, {}))
+        if status is not None:
+            buckets.append(self._by_status.get(status.upper(), {}))
+        if ens_suffix is not None:
+            buckets.append(self._by_ens_suffix.get(ens_suffix.lower().lstrip("."), {}))
+        if product is not None:
+            buckets.append(self._by_product.get(product.lower(), {}))
+        if not buckets:
+            buckets.append(self._all)
+
+        # Walk the most selective bucket, probe the others by id
+        buckets.sort(key=len)
+        driver, others = buckets[0], buckets[1:]
+        results: List[DeviceSimulator] = []
+        for device_id, device in driver.items():
+            if all(device_id in other for other in others):
+                results.append(device)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def __len__(self) -> int:
+        return len(self._all)
@@ -0,0 +1,234 @@
+"""
+G-code Print Pipeline
+Streaming G-code parser with print time / filament estimation and a result cache
+"""
+
+import hashlib
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+# Machine defaults (Prusa i3 MK3S class printer)
+DEFAULT_FEEDRATE_MM_MIN = 1500.0
+DEFAULT_ACCEL_MM_S2 = 1250.0
+FILAMENT_DIAMETER_MM = 1.75
+FILAMENT_DENSITY_G_CM3 = {"PLA": 1.24, "ABS": 1.04, "PETG": 1.27, "TPU": 1.21}
+# Flat allowance for each blocking heat-up (M109 / M190)
+HEATUP_SEC = 90.0
+
+_READ_CHUNK = 1 << 20
+
+
+class PrintEstimate:
+    def __init__(self, digest: str, duration_sec: float, filament_mm: float,
+                 layers: int, moves: int, lines: int, source: str = "gcode"):
+        self.digest = digest
+        self.duration_sec = duration_sec
+        self.filament_mm = filament_mm
+        self.layers = layers
+        self.moves = moves
+        self.lines = lines
+        self.source = source
+
+    def filament_g(self, material: str = "PLA") -> float:
+        area_mm2 = math.pi * (FILAMENT_DIAMETER_MM / 2) ** 2
+        density = FILAMENT_DENSITY_G_CM3.get(material, FILAMENT_DENSITY_G_CM3["PLA"])
+        return self.filament_mm * area_mm2 / 1000.0 * density
+
+    def to_dict(self, material: str = "PLA") -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "content_sha256": self.digest,
+            "duration_sec": int(round(self.duration_sec)),
+            "filament_mm": round(self.filament_mm, 1),
+            "filament_g": round(self.filament_g(material), 1),
+            "layers": self.layers,
+            "moves": self.moves,
+            "lines": self.lines
+        }
+
+
+def default_estimate(duration_sec: float) -> PrintEstimate:
+    """Placeholder estimate for jobs whose G-code is not available locally."""
+    return PrintEstimate("", duration_sec, 0.0, 0, 0, 0, source="default")
+
+
+def iter_commands(lines: Iterable[str]) -> Iterator[Tuple[str, Dict[str, float]]]:
+    """
+    Yield (command, params) for each G-code line, e.g. ("G1", {"X": 10.0}).
+    Comments (";" and parentheses) and blank lines are skipped.
+    """
+    for raw in lines:
+        line = raw.split(";", 1)[0]
+        if "(" in line:
+            head, _, rest = line.partition("(")
+            line = head + rest.partition(")")[2]
+        words = line.split()
+        if not words:
+            continue
+        command = words[0].upper()
+        params: Dict[str, float] = {}
+        for word in words[1:]:
+            if len(word) < 2:
+                continue
+            try:
+                params[word[0].upper()] = float(word[1:])
+            except ValueError:
+                continue
+        yield command, params
+
+
+def _move_time(distance: float, feedrate_mm_s: float, accel: float) -> float:
+    """Rest-to-rest trapezoidal profile (triangular for short moves)."""
+    if distance <= 0 or feedrate_mm_s <= 0:
+        return 0.0
+    ramp = feedrate_mm_s * feedrate_mm_s / accel
+    if distance >= ramp:
+        return distance / feedrate_mm_s + feedrate_mm_s / accel
+    return 2.0 * math.sqrt(distance / accel)
+
+
+def estimate_commands(commands: Iterable[Tuple[str, Dict[str, float]]],
+                      accel: float = DEFAULT_ACCEL_MM_S2) -> Tuple[float, float, int, int, int]:
+    """
+    Walk the command stream once, keeping only the machine state (position,
+    modes, feedrate). Returns (duration_sec, filament_mm, layers, moves, lines).
+    """
+    x = y = z = e = 0.0
+    absolute = True
+    absolute_e = True
+    feedrate = DEFAULT_FEEDRATE_MM_MIN
+    duration = 0.0
+    filament = 0.0
+    layers = 0
+    layer_z = None
+    moves = 0
+    lines = 0
+
+    for command, p in commands:
+        lines += 1
+        if command in ("G0", "G1"):
+            if "F" in p and p["F"] > 0:
+                feedrate = p["F"]
+            if absolute:
+                nx, ny, nz = p.get("X", x), p.get("Y", y), p.get("Z", z)
+            else:
+                nx, ny, nz = x + p.get("X", 0.0), y + p.get("Y", 0.0), z + p.get("Z", 0.0)
+            if "E" in p:
+                de = p["E"] - e if absolute_e else p["E"]
+                e = p["E"] if absolute_e else e + p["E"]
+            else:
+                de = 0.0
+
+            distance = math.sqrt((nx - x) ** 2 + (ny - y) ** 2 + (nz - z) ** 2)
+            if distance == 0.0:
+                distance = abs(de)  # retract / prime only
+            duration += _move_time(distance, feedrate / 60.0, accel)
+            if de > 0:
+                filament += de
+                if layer_z is None or nz > layer_z:
+                    layer_z = nz
+                    layers += 1
+            x, y, z = nx, ny, nz
+            moves += 1
+        elif command == "G4":
+            duration += p.get("S", 0.0) + p.get("P", 0.0) / 1000.0
+        elif command == "G28":
+            x = y = z = 0.0
+        elif command == "G90":
+            absolute = True
+            absolute_e = True
+        elif command == "G91":
+            absolute = False
+            absolute_e = False
+        elif command == "M82":
+            absolute_e = True
+        elif command == "M83":
+            absolute_e = False
+        elif command == "G92":
+            x, y, z, e = p.get("X", x), p.get("Y", y), p.get("Z", z), p.get("E", e)
+        elif command in ("M109", "M190"):
+            duration += HEATUP_SEC
+
+    return duration, filament, layers, moves, lines
+
+
+def iter_file_lines(path: str) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            yield line
+
+
+def file_digest(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_READ_CHUNK), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def resolve_gcode_path(file_url: Optional[str], base_dir: str) -> Optional[str]:
+    """
+    Map a job's file_url ("benchy.gcode", "file://parts/benchy.gcode") to a
+    file under base_dir. Anything outside base_dir or missing returns None.
+    """
+    if not file_url:
+        return None
+    name = file_url[len("file://"):] if file_url.startswith("file://") else file_url
+    if "://" in name:
+        return None
+    root = os.path.realpath(base_dir)
+    path = os.path.realpath(os.path.join(root, name.lstrip("/")))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return None
+    return path
+
+
+class PrintEstimateCache:
+    """
+    Parsed estimates keyed by content hash (LRU).
+
+    A (path, size, mtime) -> hash map skips re-hashing unchanged files, so a
+    repeat quote for the same file costs one stat() call.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._by_digest: "OrderedDict[str, PrintEstimate]" = OrderedDict()
+        self._digests: Dict[Tuple[str, int, int], str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def estimate(self, path: str) -> PrintEstimate:
+        """Blocking (hash + parse on a miss); call from a worker thread."""
+        stat = os.stat(path)
+        stat_key = (path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(stat_key)
+            if digest and digest in self._by_digest:
+                self._by_digest.move_to_end(digest)
+                self.hits += 1
+                return self._by_digest[digest]
+
+        digest = file_digest(path)
+        with self._lock:
+            self._digests[stat_key] = digest
+            cached = self._by_digest.get(digest)
+            if cached:
+                self._by_digest.move_to_end(digest)
+                self.hits += 1
+                return cached
+
+        duration, filament, layers, moves, lines = estimate_commands(iter_commands(iter_file_lines(path)))
+        result = PrintEstimate(digest, duration, filament, layers, moves, lines)
+        with self._lock:
+            self.misses += 1
+            self._by_digest[digest] = result
+            while len(self._by_digest) > self.max_entries:
+                evicted, _ = self._by_digest.popitem(last=False)
+                for key in [k for k, v in self._digests.items() if v == evicted]:
+                    del self._digests[key]
+        return result
@@ -0,0 +1,168 @@
+"""
+HTTP Middleware
+Pure ASGI CORS and request logging: no call_next task or response buffering per request
+"""
+
+import logging
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from profiling import request_phases
+
+logger = logging.getLogger(__name__)
+
+ALL_METHODS = ("DELETE", "GET", "HEAD", "OPTIONS", "PATCH", "POST", "PUT", "QUERY")
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class CORSHeadersMiddleware:
+    """
+    CORS with every method and request header allowed, answering the same
+    headers as Starlette's CORSMiddleware. All static header lines are built
+    once here; per request only the Origin (and for preflights the requested
+    headers) is echoed. Preflights are answered without reaching the app.
+    """
+
+    def __init__(self, app, allow_origins: Sequence[str] = ("*",), allow_credentials: bool = True,
+                 max_age: int = 600):
+        self.app = app
+        self.allow_all_origins = "*" in allow_origins
+        self.allow_origins = {origin.encode("latin-1") for origin in allow_origins}
+        self.allow_credentials = allow_credentials
+        # Echo the Origin unless "*" is allowed without credentials
+        self.echo_origin = allow_credentials or not self.allow_all_origins
+
+        self.simple_headers: Headers = []
+        if self.allow_all_origins and not self.echo_origin:
+            self.simple_headers.append((b"access-control-allow-origin", b"*"))
+        if allow_credentials:
+            self.simple_headers.append((b"access-control-allow-credentials", b"true"))
+
+        self.preflight_headers: Headers = [
+            (b"vary", b"Origin, Access-Control-Request-Method, Access-Control-Request-Headers, "
+                      b"Access-Control-Request-Private-Network"),
+            (b"access-control-allow-methods", ", ".join(ALL_METHODS).encode("latin-1")),
+            (b"access-control-max-age", str(max_age).encode("latin-1")),
+            (b"content-type", b"text/plain; charset=utf-8"),
+        ]
+        if not self.echo_origin:
+            self.preflight_headers.append((b"access-control-allow-origin", b"*"))
+        if allow_credentials:
+            self.preflight_headers.append((b"access-control-allow-credentials", b"true"))
+        self._methods = {method.encode("latin-1") for method in ALL_METHODS}
+
+    def _allowed(self, origin: bytes) -> bool:
+        return self.allow_all_origins or origin in self.allow_origins
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        origin = request_method = request_headers = private_network = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name.startswith(b"access-control-request-"):
+                if name == b"access-control-request-method":
+                    request_method = value
+                elif name == b"access-control-request-headers":
+                    request_headers = value
+                elif name == b"access-control-request-private-network":
+                    private_network = value
+
+        if origin is not None and request_method is not None and scope["method"] == "OPTIONS":
+            return await self._preflight(send, origin, request_method, request_headers, private_network)
+
+        cors_headers: Headers = []
+        if origin is not None and self._allowed(origin):
+            cors_headers = list(self.simple_headers)
+            if self.echo_origin:
+                cors_headers.append((b"access-control-allow-origin", origin))
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", ()))
+                for i, (name, value) in enumerate(headers):
+                    if name.lower() == b"vary":
+                        headers[i] = (name, value + b", Origin")
+                        break
+                else:
+                    headers.append((b"vary", b"Origin"))
+                headers.extend(cors_headers)
+                message = dict(message, headers=headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+    async def _preflight(self, send, origin: bytes, request_method: bytes,
+                         request_headers: Optional[bytes], private_network: Optional[bytes]):
+        headers = list(self.preflight_headers)
+        failures = []
+        if self._allowed(origin):
+            if self.echo_origin:
+                headers.append((b"access-control-allow-origin", origin))
+        else:
+            failures.append("origin")
+        if request_method not in self._methods:
+            failures.append("method")
+        if request_headers is not None:
+            headers.append((b"access-control-allow-headers", request_headers))
+        if private_network is not None:
+            failures.append("private-network")
+
+        body = b"Disallowed CORS " + ", ".join(failures).encode("latin-1") if failures else b"OK"
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        await send({"type": "http.response.start", "status": 400 if failures else 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+class RequestLogMiddleware:
+    """
+    Request/response log lines, timing and error logging as a plain ASGI
+    wrapper. The response line is written when the headers go out (the
+    time-to-first-byte), so streaming endpoints log immediately. Requests
+    slower than slow_request_ms (0 disables) also log their phase breakdown.
+    """
+
+    def __init__(self, app, slow_request_ms: float = 0):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method, path = scope["method"], scope["path"]
+        client = scope.get("client")
+        logger.info(f"[REQUEST] {method} {path} - Client: {client[0] if client else 'unknown'}")
+        started = time.perf_counter()
+
+        phases = None
+        if self.slow_request_ms > 0:
+            phases = {}
+            phases_token = request_phases.set(phases)
+
+        async def send_logged(message):
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter() - started
+                logger.info(f"[RESPONSE] {method} {path} - Status: {message['status']} - Time: {elapsed:.3f}s")
+                if phases is not None and elapsed * 1000 >= self.slow_request_ms:
+                    self._log_slow_request(scope, elapsed * 1000, phases)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_logged)
+        except Exception as e:
+            elapsed = time.perf_counter() - started
+            logger.error(f"[ERROR] {method} {path} - Exception: {str(e)} - Time: {elapsed:.3f}s")
+            raise
+        finally:
+            if phases is not None:
+                request_phases.reset(phases_token)
+
+    def _log_slow_request(self, scope, total_ms: float, phases: Dict[str, float]):
+        route_path = getattr(scope.get("route"), "path", scope["path"])
+        breakdown = ", ".join(f"{name}={ms:.1f}ms" for name, ms in sorted(phases.items(), key=lambda p: -p[1]))
+        other_ms = max(0.0, total_ms - sum(phases.values()))
+        logger.warning(f"[SLOW] {scope['method']} {route_path} - {total_ms:.1f}ms (threshold {self.slow_request_ms:.0f}ms) - {breakdown + ', ' if breakdown else ''}other={other_ms:.1f}ms")
@@ -0,0 +1,367 @@
+"""
+Vending Inventory
+Array-backed slot counts with reserve/commit/release semantics for paid dispenses
+"""
+
+import array
+import threading
+import time
+import uuid
+from typing import Any, Collection, Dict, List, Optional, Tuple
+
+# Default hold on reserved stock while the buyer pays (seconds)
+DEFAULT_RESERVATION_TTL_SEC = 120.0
+
+
+class InventoryError(Exception):
+    """Base class for inventory failures."""
+
+
+class InsufficientStockError(InventoryError):
+    """The order cannot be satisfied from the currently available stock."""
+
+
+class UnknownSlotError(InventoryError):
+    """The order references a slot or product this machine does not carry."""
+
+
+class ReservationNotFoundError(InventoryError):
+    """The reservation does not exist, expired, or belongs to another machine."""
+
+
+class ReservationLimitError(InventoryError):
+    """The caller already holds as many reservations on this machine as allowed."""
+
+
+class ReservationMismatchError(InventoryError):
+    """The reservation holds a different order, or was quoted to another caller."""
+
+
+class Reservation:
+    def __init__(self, machine_id: str, lines: List[Tuple[int, int]], expires_at: float,
+                 owner: Optional[str] = None, order_key: Optional[Tuple] = None):
+        self.id = str(uuid.uuid4())
+        self.machine_id = machine_id
+        self.lines = lines  # (slot index, quantity)
+        self.expires_at = expires_at
+        # Who asked for the quote and what they ordered, so a repeated quote
+        # or the paid retry finds this hold without echoing its id
+        self.owner = owner
+        self.order_key = order_key
+
+    @property
+    def units(self) -> int:
+        return sum(qty for _, qty in self.lines)
+
+
+class StockLedger:
+    """
+    Fleet-wide on-hand and reserved totals per product.
+
+    Machines push deltas whenever their counts change, so reading the fleet
+    total is O(products) no matter how many machines there are.
+    """
+
+    def __init__(self):
+        self.on_hand: Dict[str, int] = {}
+        self.reserved: Dict[str, int] = {}
+        self.total_on_hand = 0
+        self.total_reserved = 0
+        self.machines = 0
+
+    def apply(self, product: Optional[str], on_hand_delta: int = 0, reserved_delta: int = 0):
+        if product is None:
+            return
+        if on_hand_delta:
+            self.on_hand[product] = self.on_hand.get(product, 0) + on_hand_delta
+            self.total_on_hand += on_hand_delta
+        if reserved_delta:
+            self.reserved[product] = self.reserved.get(product, 0) + reserved_delta
+            self.total_reserved += reserved_delta
+
+    def summary(self) -> Dict[str, Any]:
+        products = {}
+        for product in sorted(set(self.on_hand) | set(self.reserved)):
+            on_hand = self.on_hand.get(product, 0)
+            reserved = self.reserved.get(product, 0)
+            products[product] = {
+                "on_hand": on_hand,
+                "reserved": reserved,
+                "available": on_hand - reserved
+            }
+        return {"machines": self.machines, "products": products}
+
+
+class SlotInventory:
+    """
+    Per-machine slot counts held in two int arrays (on hand, reserved).
+
+    Every mutation runs under this machine's own lock, so concurrent orders on
+    different machines never contend and a single machine can never oversell:
+    an order is reserved only if every line fits in counts - reserved.
+    """
+
+    def __init__(self, machine_id: str, stock: Dict[str, int], slot_products: Dict[str, str]):
+        self.machine_id = machine_id
+        self.slot_names = list(stock)
+        self.slot_products = [slot_products.get(name) for name in self.slot_names]
+        self._slot_index = {name: i for i, name in enumerate(self.slot_names)}
+        self.counts = array.array("i", (int(stock[name]) for name in self.slot_names))
+        self.reserved = array.array("i", bytes(4 * len(self.slot_names)))
+        self._reservations: Dict[str, Reservation] = {}
+        self._lock = threading.Lock()
+        self.ledger: Optional[StockLedger] = None
+
+    # -- ledger -----------------------------------------------------------
+
+    def attach_ledger(self, ledger: StockLedger):
+        with self._lock:
+            self.ledger = ledger
+            ledger.machines += 1
+            for i, product in enumerate(self.slot_products):
+                ledger.apply(product, self.counts[i], self.reserved[i])
+
+    def _ledger(self, index: int, on_hand_delta: int = 0, reserved_delta: int = 0):
+        if self.ledger is not None:
+            self.ledger.apply(self.slot_products[index], on_hand_delta, reserved_delta)
+
+    # -- lookups ----------------------------------------------------------
+
+    def slot_for(self, slot: Any) -> int:
+        """Resolve a slot name ("B1") or 1-based slot number to an index."""
+        if isinstance(slot, str) and slot in self._slot_index:
+            return self._slot_index[slot]
+        try:
+            number = int(slot)
+        except (TypeError, ValueError):
+            raise UnknownSlotError(f"Unknown slot '{slot}'")
+        if 1 <= number <= len(self.slot_names):
+            return number - 1
+        raise UnknownSlotError(f"Unknown slot '{slot}'")
+
+    def slot_for_product(self, product: Any) -> int:
+        """First slot carrying the product (used for restocks)."""
+        wanted = str(product).lower()
+        for index, carried in enumerate(self.slot_products):
+            if carried is not None and carried.lower() == wanted:
+                return index
+        raise UnknownSlotError(f"Product '{product}' is not carried by {self.machine_id}")
+
+    def available(self, index: int) -> int:
+        return self.counts[index] - self.reserved[index]
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(zip(self.slot_names, self.counts))
+
+    def available_products(self) -> frozenset:
+        return frozenset(
+            self.slot_products[i] for i in range(len(self.slot_names))
+            if self.slot_products[i] and self.counts[i] > self.reserved[i]
+        )
+
+    def _plan(self, items: List[Dict[str, Any]]) -> List[Tuple[int, int]]:
+        """
+        Turn order items ({"slot"} or {"product_id"}, plus "quantity") into
+        (slot index, qty) lines. Product lines are spread over every slot
+        carrying that product. Caller holds the lock.
+        """
+        taken = [0] * len(self.slot_names)
+        lines: Dict[int, int] = {}
+        for item in items:
+            quantity = int(item.get("quantity", 1))
+            if quantity <= 0:
+                raise InventoryError("Quantity must be positive")
+
+            if item.get("slot") is not None:
+                candidates = [self.slot_for(item["slot"])]
+            else:
+                product = str(item.get("product_id", "")).lower()
+                candidates = [
+                    i for i, p in enumerate(self.slot_products)
+                    if p is not None and p.lower() == product
+                ]
+                if not candidates:
+                    raise UnknownSlotError(f"Product '{item.get('product_id')}' is not carried by {self.machine_id}")
+
+            remaining = quantity
+            for index in candidates:
+                free = self.available(index) - taken[index]
+                if free <= 0:
+                    continue
+                step = min(free, remaining)
+                taken[index] += step
+                lines[index] = lines.get(index, 0) + step
+                remaining -= step
+                if remaining == 0:
+                    break
+            if remaining:
+                label = item.get("slot") if item.get("slot") is not None else item.get("product_id")
+                raise InsufficientStockError(f"Not enough stock for '{label}' (requested {quantity})")
+        return list(lines.items())
+
+    def _order_key(self, items: List[Dict[str, Any]]) -> Tuple:
+        """The order's (slot or product, quantity) lines, independent of item order."""
+        key = []
+        for item in items:
+            if item.get("slot") is not None:
+                target = ("slot", self.slot_for(item["slot"]))
+            else:
+                target = ("product", str(item.get("product_id", "")).lower())
+            key.append((target, int(item.get("quantity", 1))))
+        return tuple(sorted(key))
+
+    def _held_by(self, owner: str, order_key: Tuple, now: float) -> Optional[Reservation]:
+        """The owner's live hold on the same order, if any. Caller holds the lock."""
+        for reservation in self._reservations.values():
+            if reservation.owner == owner and reservation.order_key == order_key and reservation.expires_at > now:
+                return reservation
+        return None
+
+    # -- reserve / commit / release --------------------------------------
+
+    def reserve(self, items: List[Dict[str, Any]], ttl_sec: float = DEFAULT_RESERVATION_TTL_SEC,
+                owner: Optional[str] = None, max_per_owner: Optional[int] = None) -> Reservation:
+        """
+        Atomically hold every line of a multi-item order, or nothing. With an
+        owner, quoting the same order again extends the existing hold, and
+        more than max_per_owner live holds raises ReservationLimitError.
+        """
+        with self._lock:
+            now = time.time()
+            order_key = self._order_key(items)
+            if owner is not None:
+                held = self._held_by(owner, order_key, now)
+                if held is not None:
+                    held.expires_at = now + ttl_sec
+                    return held
+                if max_per_owner is not None:
+                    holds = sum(1 for r in self._reservations.values() if r.owner == owner and r.expires_at > now)
+                    if holds >= max_per_owner:
+                        raise ReservationLimitError(f"{owner} already holds {holds} reservations on {self.machine_id}")
+            lines = self._plan(items)
+            for index, qty in lines:
+                self.reserved[index] += qty
+                self._ledger(index, reserved_delta=qty)
+            reservation = Reservation(self.machine_id, lines, now + ttl_sec, owner, order_key)
+            self._reservations[reservation.id] = reservation
+            return reservation
+
+    def _match(self, reservation: Reservation, items: List[Dict[str, Any]],
+               owners: Optional[Collection[str]] = None):
+        """Raise unless the hold is for exactly this order (and one of these owners). Caller holds the lock."""
+        if reservation.order_key != self._order_key(items):
+            raise ReservationMismatchError(f"Reservation '{reservation.id}' holds a different order")
+        if owners is not None and reservation.owner is not None and reservation.owner not in owners:
+            raise ReservationMismatchError(f"Reservation '{reservation.id}' was quoted to another caller")
+
+    def check_reservation(self, reservation_id: str, items: List[Dict[str, Any]],
+                          owners: Optional[Collection[str]] = None) -> bool:
+        """
+        True if the reservation is live and holds exactly this order, False if
+        it is gone. Raises ReservationMismatchError when it holds a different
+        order or, with owners, was quoted to someone else.
+        """
+        with self._lock:
+            reservation = self._reservations.get(reservation_id)
+            if reservation is None:
+                return False
+            self._match(reservation, items, owners)
+            return True
+
+    def commit(self, reservation_id: str, items: Optional[List[Dict[str, Any]]] = None) -> Reservation:
+        """
+        Turn a held reservation into a sale (stock leaves the machine). With
+        items, the hold must be for exactly that order, so a buyer cannot pay
+        for one order and take another's stock.
+        """
+        with self._lock:
+            reservation = self._reservations.get(reservation_id)
+            if reservation is None:
+                raise ReservationNotFoundError(f"Reservation '{reservation_id}' not found or expired")
+            if items is not None:
+                self._match(reservation, items)
+            del self._reservations[reservation_id]
+            self._sell(reservation)
+            return reservation
+
+    def _sell(self, reservation: Reservation):
+        for index, qty in reservation.lines:
+            self.reserved[index] -= qty
+            self.counts[index] -= qty
+            self._ledger(index, on_hand_delta=-qty, reserved_delta=-qty)
+
+    def release(self, reservation_id: str) -> bool:
+        with self._lock:
+            reservation = self._reservations.pop(reservation_id, None)
+            if reservation is None:
+                return False
+            self._release_lines(reservation)
+            return True
+
+    def _release_lines(self, reservation: Reservation):
+        for index, qty in reservation.lines:
+            self.reserved[index] -= qty
+            self._ledger(index, reserved_delta=-qty)
+
+    def purchase(self, items: List[Dict[str, Any]], owner: Optional[str] = None) -> Reservation:
+        """
+        Sell an order whose reservation id the buyer did not send back: the
+        owner's own hold on the same order is committed if there is one,
+        otherwise the order is reserved and committed in one step.
+        """
+        if owner is not None:
+            with self._lock:
+                held = self._held_by(owner, self._order_key(items), time.time())
+                if held is not None:
+                    del self._reservations[held.id]
+                    self._sell(held)
+                    return held
+        reservation = self.reserve(items)
+        return self.commit(reservation.id)
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Release holds whose payment window has passed."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            expired = [r for r in self._reservations.values() if r.expires_at <= now]
+            for reservation in expired:
+                del self._reservations[reservation.id]
+                self._release_lines(reservation)
+            return len(expired)
+
+    def next_expiry(self) -> Optional[float]:
+        """Earliest hold expiry (time.time() seconds), if any."""
+        with self._lock:
+            return min((r.expires_at for r in self._reservations.values()), default=None)
+
+    def has_reservation(self, reservation_id: str) -> bool:
+        return reservation_id in self._reservations
+
+    # -- direct stock changes ----------------------------------------------
+
+    def take(self, index: int, quantity: int = 1) -> bool:
+        """Remove unreserved stock immediately (walk-up purchase)."""
+        with self._lock:
+            if self.available(index) < quantity:
+                return False
+            self.counts[index] -= quantity
+            self._ledger(index, on_hand_delta=-quantity)
+            return True
+
+    def restock(self, index: int, quantity: int):
+        if quantity <= 0:
+            raise InventoryError("Quantity must be positive")
+        with self._lock:
+            self.counts[index] += quantity
+            self._ledger(index, on_hand_delta=quantity)
+
+    def load(self, stock: Dict[str, int]):
+        """Replace on-hand counts (snapshot restore). Reservations are kept."""
+        with self._lock:
+            for name, count in stock.items():
+                index = self._slot_index.get(name)
+                if index is None:
+                    continue
+                delta = int(count) - self.counts[index]
+                self.counts[index] = int(count)
+                self._ledger(index, on_hand_delta=delta)
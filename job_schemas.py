@@ -0,0 +1,335 @@
+"""
+Job Schemas
+Parameter schemas for device job actions and the validators compiled from them
+"""
+
+import math
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Paid camera viewing session length
+DEFAULT_VIEW_DURATION_SEC = 300
+MAX_VIEW_DURATION_SEC = 3600
+
+# One entry per (device type, action): the params a job takes, in JSON Schema.
+# Manifests publish these; POST /devices/{name}/job validates against them.
+# "default" fills a missing param, descriptions may use {price_per_min}.
+JOB_SCHEMAS: Dict[Tuple[str, str], Dict[str, Dict[str, Any]]] = {
+    ("smart_lock", "unlock"): {},
+    ("smart_lock", "lock"): {},
+    ("3d_printer", "print"): {
+        "file_url": {
+            "type": "string",
+            "default": "default_document.gcode",
+            "description": "URL of the file to print"
+        }
+    },
+    ("3d_printer", "buy_filament"): {
+        "material_type": {
+            "type": "string",
+            "enum": ["PLA", "ABS", "PETG", "TPU"],
+            "default": "PLA",
+            "description": "Type of filament material"
+        },
+        "color": {
+            "type": "string",
+            "default": "black",
+            "description": "Color of the filament (e.g., 'black', 'white', 'red')"
+        },
+        "weight_grams": {
+            "type": "number",
+            "exclusiveMinimum": 0,
+            "default": 1000,
+            "description": "Weight in grams (default: 1000g spool)"
+        }
+    },
+    ("3d_printer", "pause"): {},
+    ("3d_printer", "cancel"): {},
+    ("ev_charger", "charge"): {
+        "target_percent": {
+            "type": "number",
+            "exclusiveMinimum": 0,
+            "maximum": 100,
+            "default": 100,
+            "description": "Target battery percentage (default: 100%)"
+        }
+    },
+    ("ev_charger", "stop"): {},
+    ("vending_machine", "dispense"): {
+        "product_id": {
+            "type": "string",
+            "description": "Product ID or name to dispense"
+        },
+        "slot": {
+            "type": ["integer", "string"],
+            "description": "Slot number or name, e.g. 'B1' (optional)"
+        },
+        "quantity": {
+            "type": "integer",
+            "minimum": 1,
+            "default": 1,
+            "description": "Units to dispense (default: 1)"
+        },
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "product_id": {"type": "string"},
+                    "slot": {"type": ["integer", "string"]},
+                    "quantity": {"type": "integer", "minimum": 1, "default": 1}
+                }
+            },
+            "description": "Multi-item order: a list of objects with a slot or product_id and a quantity"
+        },
+        "reservation_id": {
+            "type": "string",
+            "description": "reservation_id from the 402 quote"
+        }
+    },
+    ("vending_machine", "restock"): {
+        "product_id": {
+            "type": "string",
+            "default": "unknown",
+            "description": "Product ID to restock"
+        },
+        "quantity": {
+            "type": "integer",
+            "minimum": 1,
+            "default": 1,
+            "description": "Quantity to add"
+        },
+        "slot": {
+            "type": ["integer", "string"],
+            "description": "Slot number or name"
+        }
+    },
+    ("security_camera", "view"): {
+        "duration_sec": {
+            "type": "number",
+            "exclusiveMinimum": 0,
+            "maximum": MAX_VIEW_DURATION_SEC,
+            "default": DEFAULT_VIEW_DURATION_SEC,
+            "description": f"Session length in seconds (default: {DEFAULT_VIEW_DURATION_SEC}, max: {MAX_VIEW_DURATION_SEC})"
+        }
+    }
+}
+
+
+class JobParamsError(ValueError):
+    """Job params that do not match the action's schema; one message per bad param."""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+class _Invalid(Exception):
+    def __init__(self, message: str, path: str = ""):
+        super().__init__(message)
+        self.message = message
+        # Where inside the param the bad value sits, e.g. "[0].quantity"
+        self.path = path
+
+
+_MISSING = object()
+
+# ASCII digits only: str.isdigit() also passes "²", which int() rejects
+_INTEGER_STRING = re.compile(r"\s*-?[0-9]+\s*\Z")
+
+
+@lru_cache(maxsize=None)
+def manifest_schema(device_type: str, action: str, price_per_min: Optional[float] = None) -> Dict[str, Any]:
+    """
+    The capability schema published in a device's manifest for a job action:
+    the action itself plus its params. Rendered once per (type, action);
+    callers must not mutate the result.
+    """
+    properties: Dict[str, Any] = {
+        "action": {
+            "type": "string",
+            "enum": [action],
+            "description": "Action to perform"
+        }
+    }
+    for name, spec in JOB_SCHEMAS[(device_type, action)].items():
+        spec = dict(spec)
+        if "description" in spec:
+            spec["description"] = spec["description"].format(price_per_min=price_per_min or 0)
+        properties[name] = spec
+    return {"type": "object", "properties": properties, "required": []}
+
+
+def _bounds_check(spec: Dict[str, Any]) -> Optional[Callable[[Any], Any]]:
+    low, high = spec.get("minimum"), spec.get("maximum")
+    above = spec.get("exclusiveMinimum")
+    if low is None and high is None and above is None:
+        return None
+    if high is not None:
+        message = f"must be between {low if low is not None else above:g} and {high:g}"
+    elif above is not None:
+        message = "must be positive" if above == 0 else f"must be greater than {above:g}"
+    else:
+        message = f"must be at least {low:g}"
+    low = -math.inf if low is None else low
+    high = math.inf if high is None else high
+    above = -math.inf if above is None else above
+
+    def check(value):
+        if value > above and low <= value <= high:
+            return value
+        raise _Invalid(message)
+    return check
+
+
+def _type_check(kind: str, spec: Dict[str, Any]) -> Callable[[Any], Any]:
+    if kind == "number":
+        def check(value):
+            # Numeric strings are accepted as before the schemas existed
+            if type(value) is not float and type(value) is not int:
+                if not isinstance(value, str):
+                    raise _Invalid("must be a number")
+                try:
+                    value = float(value)
+                except ValueError:
+                    raise _Invalid("must be a number")
+            if not math.isfinite(value):
+                raise _Invalid("must be a finite number")
+            return value
+    elif kind == "integer":
+        def check(value):
+            if type(value) is int:
+                return value
+            if type(value) is float and value.is_integer():
+                return int(value)
+            if isinstance(value, str) and _INTEGER_STRING.match(value):
+                return int(value)
+            raise _Invalid("must be an integer")
+    elif kind == "string":
+        def check(value):
+            if isinstance(value, str):
+                return value
+            raise _Invalid("must be a string")
+    elif kind == "object":
+        fields = _compile_fields(spec.get("properties", {}))
+
+        def check(value):
+            if not isinstance(value, dict):
+                raise _Invalid("must be an object")
+            result, errors = _check_fields(fields, value)
+            if errors:
+                name, e = errors[0]
+                raise _Invalid(e.message, f".{name}{e.path}")
+            return result
+    elif kind == "array":
+        item = _compile_value(spec["items"]) if "items" in spec else None
+
+        def check(value):
+            if not isinstance(value, list):
+                raise _Invalid("must be a list")
+            if item is None:
+                return value
+            checked = []
+            for index, element in enumerate(value):
+                try:
+                    checked.append(item(element))
+                except _Invalid as e:
+                    raise _Invalid(e.message, f"[{index}]{e.path}")
+            return checked
+    else:
+        raise ValueError(f"Unsupported schema type '{kind}'")
+    return check
+
+
+def _compile_value(spec: Dict[str, Any]) -> Callable[[Any], Any]:
+    """One param's schema as a single check(value) -> normalized value."""
+    kinds = spec["type"] if isinstance(spec["type"], list) else [spec["type"]]
+    checks = [_type_check(kind, spec) for kind in kinds]
+    if len(checks) == 1:
+        typed = checks[0]
+    else:
+        expected = " or ".join("an integer" if kind == "integer" else f"a {kind}" for kind in kinds)
+
+        def typed(value):
+            for check in checks:
+                try:
+                    return check(value)
+                except _Invalid:
+                    pass
+            raise _Invalid(f"must be {expected}")
+
+    steps = [typed]
+    if "enum" in spec:
+        allowed = frozenset(spec["enum"])
+        message = "must be one of " + ", ".join(str(v) for v in spec["enum"])
+
+        def in_enum(value):
+            if value in allowed:
+                return value
+            raise _Invalid(message)
+        steps.append(in_enum)
+    bounds = _bounds_check(spec)
+    if bounds is not None:
+        steps.append(bounds)
+
+    if len(steps) == 1:
+        return typed
+    if len(steps) == 2:
+        first, second = steps
+        return lambda value: second(first(value))
+
+    def chained(value):
+        for step in steps:
+            value = step(value)
+        return value
+    return chained
+
+
+def _compile_fields(properties: Dict[str, Dict[str, Any]]) -> List[Tuple[str, Callable[[Any], Any], Any]]:
+    return [(name, _compile_value(spec), spec.get("default", _MISSING)) for name, spec in properties.items()]
+
+
+def _check_fields(fields, params: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[Tuple[str, _Invalid]]]:
+    result = dict(params) if params else {}
+    errors = []
+    for name, check, default in fields:
+        value = result.get(name)
+        if value is None:
+            if default is not _MISSING:
+                result[name] = default
+            continue
+        try:
+            result[name] = check(value)
+        except _Invalid as e:
+            errors.append((name, e))
+    return result, errors
+
+
+def compile_params(properties: Dict[str, Dict[str, Any]]) -> Callable[[Optional[Dict[str, Any]]], Dict[str, Any]]:
+    """
+    Compile a params schema into validate(params) -> params with every
+    declared param checked and normalized and defaults filled in. Params the
+    schema does not declare pass through. Raises JobParamsError.
+    """
+    fields = _compile_fields(properties)
+
+    def validate(params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        result, errors = _check_fields(fields, params)
+        if errors:
+            raise JobParamsError([f"{name}{e.path} {e.message}" for name, e in errors])
+        return result
+    return validate
+
+
+VALIDATORS: Dict[Tuple[str, str], Callable[[Optional[Dict[str, Any]]], Dict[str, Any]]] = {
+    key: compile_params(properties) for key, properties in JOB_SCHEMAS.items()
+}
+
+
+def validate_job_params(device_type: str, action: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Checked params for a job; actions without a schema get theirs back unchanged."""
+    validate = VALIDATORS.get((device_type, action))
+    if validate is None:
+        return dict(params) if params else {}
+    return validate(params)
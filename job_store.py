@@ -0,0 +1,243 @@
+"""
+Job History Store
+Durable job receipts in SQLite, written in batches off the request path
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Result keys stored as their own indexed columns, so a charging session's
+# or purchase's receipts can be found without knowing the receipt ids
+INDEXED_RESULT_KEYS = ("session_id", "purchase_id")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    id          TEXT NOT NULL UNIQUE,
+    device_id   TEXT NOT NULL,
+    action      TEXT NOT NULL,
+    payer       TEXT,
+    tx_hash     TEXT,
+    amount      TEXT,
+    created_at  REAL NOT NULL,
+    result      TEXT NOT NULL,
+    session_id  TEXT,
+    purchase_id TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_device_time ON jobs (device_id, created_at, seq);
+CREATE INDEX IF NOT EXISTS jobs_payer_time ON jobs (payer, created_at, seq);
+CREATE INDEX IF NOT EXISTS jobs_time ON jobs (created_at, seq);
+"""
+
+_INDEXED_SCHEMA = """
+CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id, created_at, seq);
+CREATE INDEX IF NOT EXISTS jobs_purchase ON jobs (purchase_id, created_at, seq);
+"""
+
+_COLUMNS = "seq, id, device_id, action, payer, tx_hash, amount, created_at, result"
+
+
+def _text(value: Any) -> Optional[str]:
+    return str(value) if value is not None else None
+
+
+class JobStore:
+    """
+    Append-only job history.
+
+    record() only enqueues; run() drains the queue in batches (one
+    transaction each) on a worker thread. Records waiting for their batch
+    are served by get() from memory, so a receipt can be fetched right after
+    the job returns.
+    """
+
+    def __init__(self, path: str, batch_size: int = 256, flush_interval: float = 0.05):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._migrate()
+        self._db.executescript(_INDEXED_SCHEMA)
+        self._db_lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self.written = 0
+
+    def _migrate(self):
+        """Add the indexed result columns to a store created before they existed."""
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        missing = [key for key in INDEXED_RESULT_KEYS if key not in columns]
+        if not missing:
+            return
+        with self._db:
+            for key in missing:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {key} TEXT")
+                self._db.execute(f"UPDATE jobs SET {key} = json_extract(result, '$.{key}')")
+
+    def record(self, device_id: str, action: str, result: Dict[str, Any],
+               payer: Optional[str] = None, tx_hash: Optional[str] = None,
+               amount: Optional[str] = None, receipt_id: Optional[str] = None) -> str:
+        """
+        Queue a receipt and return its id: receipt_id (e.g. the 202 job_id)
+        or a fresh one. Every job gets its own receipt. Never blocks.
+        """
+        receipt_id = receipt_id or str(uuid.uuid4())
+        entry = {
+            "id": receipt_id,
+            "device_id": device_id,
+            "action": action,
+            "payer": payer.lower() if payer else None,
+            "tx_hash": tx_hash,
+            "amount": amount,
+            "created_at": time.time(),
+            "result": {k: v for k, v in result.items() if k != "device_status"}
+        }
+        self._pending[receipt_id] = entry
+        if self._queue is None:
+            # Writer not running (e.g. scripts): write through
+            self._write_batch([entry])
+        else:
+            self._queue.put_nowait(entry)
+        return receipt_id
+
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        with self._db_lock:
+            # Skip receipts a concurrent flush() already wrote: ids are unique
+            # and never overwritten
+            batch = [e for e in batch if e["id"] in self._pending]
+            rows = [
+                (e["id"], e["device_id"], e["action"], e["payer"], e["tx_hash"], e["amount"],
+                 e["created_at"], json.dumps(e["result"], default=str),
+                 *(_text(e["result"].get(key)) for key in INDEXED_RESULT_KEYS))
+                for e in batch
+            ]
+            with self._db:
+                self._db.executemany(
+                    "INSERT INTO jobs (id, device_id, action, payer, tx_hash, amount, created_at, result, "
+                    "session_id, purchase_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+            for e in batch:
+                self._pending.pop(e["id"], None)
+        self.written += len(batch)
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def run(self):
+        self._queue = asyncio.Queue()
+        while True:
+            batch = [await self._queue.get()]
+            # Let concurrent jobs join this transaction
+            await asyncio.sleep(self.flush_interval)
+            batch += self._drain()
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                logger.error(f"[JOBS] Failed to write {len(batch)} receipts: {str(e)}")
+
+    def flush(self):
+        """Write everything still queued (shutdown)."""
+        with self._db_lock:
+            batch = list(self._pending.values())
+        if batch:
+            self._write_batch(batch)
+
+    @staticmethod
+    def _public(entry: Dict[str, Any]) -> Dict[str, Any]:
+        public = dict(entry, status="completed")
+        public["created_at"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(entry["created_at"])) + "Z"
+        return public
+
+    @classmethod
+    def _row(cls, row) -> Dict[str, Any]:
+        _, receipt_id, device_id, action, payer, tx_hash, amount, created_at, result = row
+        return cls._public({
+            "id": receipt_id,
+            "device_id": device_id,
+            "action": action,
+            "payer": payer,
+            "tx_hash": tx_hash,
+            "amount": amount,
+            "created_at": created_at,
+            "result": json.loads(result)
+        })
+
+    def get(self, receipt_id: str) -> Optional[Dict[str, Any]]:
+        pending = self._pending.get(receipt_id)
+        if pending is not None:
+            return self._public(pending)
+        with self._db_lock:
+            row = self._db.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (receipt_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def query(self, device_id: Optional[str] = None, payer: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None,
+              cursor: Optional[str] = None, limit: int = 100,
+              session_id: Optional[str] = None, purchase_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Receipts in time order. Filters map onto the (device|payer|session|
+        purchase, created_at, seq) indexes; `cursor` is the opaque
+        next_cursor of a previous page.
+        """
+        clauses, args = [], []
+        if session_id:
+            clauses.append("session_id = ?")
+            args.append(session_id)
+        if purchase_id:
+            clauses.append("purchase_id = ?")
+            args.append(purchase_id)
+        if device_id:
+            clauses.append("device_id = ?")
+            args.append(device_id)
+        if payer:
+            clauses.append("payer = ?")
+            args.append(payer.lower())
+        if since is not None:
+            clauses.append("created_at >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("created_at <= ?")
+            args.append(until)
+        if cursor:
+            try:
+                after_ts, after_seq = cursor.split(":", 1)
+                after_ts, after_seq = float(after_ts), int(after_seq)
+            except ValueError:
+                raise ValueError(f"Invalid cursor '{cursor}'")
+            clauses.append("(created_at > ? OR (created_at = ? AND seq > ?))")
+            args += [after_ts, after_ts, after_seq]
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT {_COLUMNS} FROM jobs {where} ORDER BY created_at, seq LIMIT ?"
+        with self._db_lock:
+            rows = self._db.execute(sql, args + [limit + 1]).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = f"{last[7]!r}:{last[0]}"
+            rows = rows[:limit]
+        return {"jobs": [self._row(row) for row in rows], "next_cursor": next_cursor}
+
+    def close(self):
+        with self._db_lock:
+            self._db.close()
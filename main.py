@@ -1,12 +1,18 @@
-from fastapi import FastAPI, HTTPException, Header, Request
-from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional, Dict, Any
+from fastapi import FastAPI, HTTPException, Header, Request, Query, Depends
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse, Response
+from typing import List, Optional, Dict, Any, Tuple
 import asyncio
+import base64
 import os
 import logging
 import uuid
 import hashlib
+import json
+import secrets
+import threading
+import time
 from datetime import datetime
+from decimal import Decimal
 from models import (
     DeviceSimulator,
     EVStation,
@@ -17,6 +23,35 @@ from models import (
     DeviceDetail,
     DeviceSummary
 )
+from snapshots import FleetSnapshotter
+from job_store import JobStore
+from telemetry_encoding import NDJSON_MEDIA, choose_coding, choose_media, encode, ndjson_lines, representations
+from device_mutations import VersionConflictError
+from charging import charge_duration_sec
+from sites import DEFAULT_SITE_ID, Site, SiteRegistry, SiteRoutingMiddleware, build_devices, current_site, load_site_config
+from cluster import LOCAL_HEADER, Cluster, ShardRedirectMiddleware, parse_nodes
+from payment_pipeline import MockChain, PaymentError, PaymentPipeline, Web3ChainClient, eth_to_wei
+from vouchers import ChannelLedger, Voucher, VoucherVerifier
+from profiling import (
+    SamplingProfiler,
+    TickTracer,
+    RequestPhase,
+    TimedJSONResponse
+)
+from access_log import AccessLogStore
+from http_middleware import CORSHeadersMiddleware, RequestLogMiddleware
+from aggregates import merge_summaries
+from alerts import AlertHub, WebhookSink, load_rules
+from camera_streams import StreamBroker, StreamCapacityError, MULTIPART_BOUNDARY
+from gcode import PrintEstimate, PrintEstimateCache, default_estimate, resolve_gcode_path
+from job_schemas import JobParamsError, manifest_schema, validate_job_params
+from inventory import (
+    InventoryError,
+    InsufficientStockError,
+    ReservationLimitError,
+    ReservationMismatchError,
+    DEFAULT_RESERVATION_TTL_SEC
+)
 from pydantic import BaseModel
 
 # Configure logging
@@ -27,96 +62,844 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="IoT Simulator API", version="1.0.0")
+# Profiling: requests slower than SLOW_REQUEST_MS are logged with a phase
+# breakdown (0 disables); admin endpoints need the X-Admin-Token header
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+app = FastAPI(
+    title="IoT Simulator API",
+    version="1.0.0",
+    default_response_class=TimedJSONResponse if SLOW_REQUEST_MS > 0 else JSONResponse
+)
 
 # Configure CORS
 # Allow all origins for development and production flexibility
 # In production, you can restrict this to specific domains
 cors_origins = os.getenv("CORS_ORIGINS", "*").split(",") if os.getenv("CORS_ORIGINS") else ["*"]
 
+# Pure ASGI (no call_next): CORS innermost, request logging around it
 app.add_middleware(
-    CORSMiddleware,
+    CORSHeadersMiddleware,
     allow_origins=cors_origins if "*" not in cors_origins else ["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_credentials=True
 )
+app.add_middleware(RequestLogMiddleware, slow_request_ms=SLOW_REQUEST_MS)
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    start_time = datetime.now()
-    logger.info(f"[REQUEST] {request.method} {request.url.path} - Client: {request.client.host if request.client else 'unknown'}")
-    
-    try:
-        response = await call_next(request)
-        process_time = (datetime.now() - start_time).total_seconds()
-        logger.info(f"[RESPONSE] {request.method} {request.url.path} - Status: {response.status_code} - Time: {process_time:.3f}s")
-        return response
-    except Exception as e:
-        process_time = (datetime.now() - start_time).total_seconds()
-        logger.error(f"[ERROR] {request.method} {request.url.path} - Exception: {str(e)} - Time: {process_time:.3f}s")
-        raise
+RESERVATION_TTL_SEC = float(os.getenv("RESERVATION_TTL_SEC", str(DEFAULT_RESERVATION_TTL_SEC)))
+# Live quote holds one caller (payer address, else client IP) may keep per machine
+RESERVATION_MAX_PER_CLIENT = int(os.getenv("RESERVATION_MAX_PER_CLIENT", "3"))
+
+# Chargers in one site share its grid connection; power is re-split when a
+# job starts or stops a session, and at most once per scheduler tick for
+# simulated taper steps and session ends
+SITE_POWER_CAP_KW = float(os.getenv("SITE_POWER_CAP_KW", "150"))
+
+# Profilers are idle until an admin starts them
+sampling_profiler = SamplingProfiler()
+tick_tracer = TickTracer()
+loop_thread_id: Optional[int] = None
+
+# Devices are woken only at their next state change (auto-lock, print done,
+# charge target...); reads advance them lazily in between
+SIM_TICK_INTERVAL_SEC = float(os.getenv("SIM_TICK_INTERVAL_SEC", "5"))
+STATUS_MIN_COMPRESS_BYTES = int(os.getenv("STATUS_MIN_COMPRESS_BYTES", "1024"))
+# Large fleets: /status pages (?limit=&cursor=) and NDJSON streams are built
+# this many summaries at a time instead of as one list
+STATUS_PAGE_MAX = int(os.getenv("STATUS_PAGE_MAX", "5000"))
+STATUS_STREAM_CHUNK = int(os.getenv("STATUS_STREAM_CHUNK", "500"))
+
+# Sites (buildings): each has its own devices, vendor address, pricing and
+# ENS namespace. Without SITES_CONFIG the node runs one default site.
+SITES_CONFIG = os.getenv("SITES_CONFIG", "")
+
+# Cluster mode: devices are sharded across nodes by consistent hashing.
+# Every node must run the same site config; each keeps only its own shard.
+CLUSTER_NODES = os.getenv("CLUSTER_NODES", "")
+CLUSTER_SELF = os.getenv("CLUSTER_SELF", "")
+CLUSTER_TIMEOUT_SEC = float(os.getenv("CLUSTER_TIMEOUT_SEC", "2"))
+cluster = Cluster(parse_nodes(CLUSTER_NODES), CLUSTER_SELF, CLUSTER_TIMEOUT_SEC) if CLUSTER_NODES else None
+
+# Alert rules (JSON list; built-in defaults when unset), delivered to
+# /alerts/stream subscribers and optionally POSTed to a webhook
+ALERT_RULES = os.getenv("ALERT_RULES", "")
+ALERT_WEBHOOK_URL = os.getenv("ALERT_WEBHOOK_URL", "")
+alert_rules = load_rules(ALERT_RULES)
+alert_hub = AlertHub(webhook=WebhookSink(ALERT_WEBHOOK_URL) if ALERT_WEBHOOK_URL else None)
+
+def _make_site(id: str, name: str, devices: List[DeviceSimulator], vendor_address: Optional[str] = None,
+               power_cap_kw: Optional[float] = None, **options) -> Site:
+    if cluster:
+        for d in devices:
+            cluster.register(id, d.id, d.ens_domain, d.name, d.type)
+        devices = [d for d in devices if cluster.owns(d.id)]
+    return Site(
+        id, name, devices,
+        vendor_address=vendor_address or os.getenv("VENDOR_ADDRESS", "0x13EB37a124F98A76c973c3fce0F3FF829c7df57C"),
+        power_cap_kw=float(power_cap_kw if power_cap_kw is not None else SITE_POWER_CAP_KW),
+        tick_interval=SIM_TICK_INTERVAL_SEC,
+        tracer=tick_tracer,
+        min_compress_bytes=STATUS_MIN_COMPRESS_BYTES,
+        alert_rules=alert_rules,
+        alert_hub=alert_hub,
+        **options
+    )
 
-# Initialize devices
-devices: List[DeviceSimulator] = [
-    EVStation(),
-    Printer3D(),
-    SmartLock(),
-    VendingMachine(),
-    SecurityCamera()
-]
+if SITES_CONFIG:
+    site_config = load_site_config(SITES_CONFIG)
+    site_registry = SiteRegistry(site_config.get("default_site", site_config["sites"][0]["id"]))
+    for spec in site_config["sites"]:
+        site_registry.add(_make_site(
+            spec["id"], spec.get("name", spec["id"]),
+            build_devices(spec.get("devices", []), spec.get("ens_namespace")),
+            vendor_address=spec.get("vendor_address"),
+            power_cap_kw=spec.get("power_cap_kw"),
+            ens_namespace=spec.get("ens_namespace"),
+            pricing=spec.get("pricing"),
+            hosts=spec.get("hosts", []),
+            base_url=spec.get("base_url")
+        ))
+else:
+    site_registry = SiteRegistry()
+    site_registry.add(_make_site(DEFAULT_SITE_ID, "Default", [
+        EVStation(),
+        Printer3D(),
+        SmartLock(),
+        VendingMachine(),
+        SecurityCamera()
+    ]))
 
-device_map = {d.id: d for d in devices}
+if cluster:
+    # Added first so it runs inside site routing (sees the stripped path)
+    app.add_middleware(ShardRedirectMiddleware, cluster=cluster, site_prefix=lambda: _site().path_prefix)
+app.add_middleware(SiteRoutingMiddleware, registry=site_registry)
 
-ens_map = {d.ens_domain: d for d in devices}
+def _site() -> Site:
+    """Site of the current request (default site outside a request)."""
+    return current_site.get() or site_registry.default
+
+def _encoded_response(request: Request, resource, version, build, columnar: bool = False) -> Response:
+    media = choose_media(request.headers.get("accept"), columnar)
+    coding = choose_coding(request.headers.get("accept-encoding"))
+    with RequestPhase("encode"):
+        body, used = _site().payload_cache.get(resource, version, media, coding, build)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if used != "identity":
+        headers["Content-Encoding"] = used
+    return Response(body, media_type=media, headers=headers)
+
+# Print jobs: G-code is read from GCODE_DIR and estimates are cached by content hash
+GCODE_DIR = os.getenv("GCODE_DIR", "gcode")
+DEFAULT_PRINT_DURATION_SEC = float(os.getenv("DEFAULT_PRINT_DURATION_SEC", "1800"))
+print_estimates = PrintEstimateCache()
+
+# Smart lock audit trail: set ACCESS_LOG_DIR to an empty string to disable
+ACCESS_LOG_DIR = os.getenv("ACCESS_LOG_DIR", "state/access-log")
+access_logs = AccessLogStore(ACCESS_LOG_DIR) if ACCESS_LOG_DIR else None
+if access_logs:
+    for d in site_registry.all_devices():
+        if isinstance(d, SmartLock):
+            d.access_log = access_logs.log_for(d.id)
+
+# Paid camera viewing: sessions are admitted against the node's stream budget
+NODE_STREAM_BUDGET_MBPS = float(os.getenv("NODE_STREAM_BUDGET_MBPS", "1000"))
+stream_broker = StreamBroker(NODE_STREAM_BUDGET_MBPS)
+for d in site_registry.all_devices():
+    if isinstance(d, SecurityCamera):
+        d.viewers = stream_broker.register_camera(d)
+
+# Durable state: set SNAPSHOT_PATH to an empty string to disable checkpoints
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "state/fleet.snapshot")
+SNAPSHOT_INTERVAL_SEC = float(os.getenv("SNAPSHOT_INTERVAL_SEC", "15"))
+snapshotter = FleetSnapshotter(SNAPSHOT_PATH, lambda: list(site_registry.all_devices())) if SNAPSHOT_PATH else None
+
+# Job receipts: set JOB_STORE_PATH to an empty string to disable history
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "state/jobs.sqlite3")
+job_store = JobStore(JOB_STORE_PATH) if JOB_STORE_PATH else None
+
+# Payment verification: "off" only checks the tx hash format (legacy),
+# "rpc" confirms payments on chain via RPC_URL, "mock" uses an in-process chain.
+# With verification on, paid jobs return 202 and run once confirmed.
+CHAIN_VERIFICATION = os.getenv("CHAIN_VERIFICATION", "off").lower()
+PAYMENT_CONFIRMATIONS = int(os.getenv("PAYMENT_CONFIRMATIONS", "2"))
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", "4"))
+PAYMENT_POLL_INTERVAL_SEC = float(os.getenv("PAYMENT_POLL_INTERVAL_SEC", "2"))
+mock_chain: Optional[MockChain] = None
+payment_pipeline: Optional[PaymentPipeline] = None
+if CHAIN_VERIFICATION == "rpc":
+    payment_pipeline = PaymentPipeline(
+        Web3ChainClient(), PAYMENT_CONFIRMATIONS, PAYMENT_WORKERS, PAYMENT_POLL_INTERVAL_SEC
+    )
+elif CHAIN_VERIFICATION == "mock":
+    mock_chain = MockChain(float(os.getenv("MOCK_BLOCK_TIME_SEC", "1")))
+    payment_pipeline = PaymentPipeline(
+        mock_chain, PAYMENT_CONFIRMATIONS, PAYMENT_WORKERS,
+        min(PAYMENT_POLL_INTERVAL_SEC, mock_chain.block_time_sec)
+    )
+
+# Payment channels: agents open a channel with one on-chain deposit, then pay
+# per job with signed cumulative vouchers (Authorization: Voucher ...) that
+# are checked off-chain; balances checkpoint to CHANNEL_STORE_PATH and settle
+# every CHANNEL_SETTLE_INTERVAL_SEC. Channels live on the node that opened them.
+PAYMENT_CHANNELS = os.getenv("PAYMENT_CHANNELS", "1") == "1"
+CHANNEL_STORE_PATH = os.getenv("CHANNEL_STORE_PATH", "state/channels.sqlite3")
+CHANNEL_CHECKPOINT_SEC = float(os.getenv("CHANNEL_CHECKPOINT_SEC", "5"))
+CHANNEL_SETTLE_INTERVAL_SEC = float(os.getenv("CHANNEL_SETTLE_INTERVAL_SEC", "300"))
+channel_ledger: Optional[ChannelLedger] = None
+if PAYMENT_CHANNELS:
+    channel_ledger = ChannelLedger(
+        CHANNEL_STORE_PATH or None, VoucherVerifier(), CHANNEL_CHECKPOINT_SEC, CHANNEL_SETTLE_INTERVAL_SEC,
+        # The mock chain pays the vendor out of the deposit; elsewhere the
+        # recorded voucher is what the vendor redeems on the channel contract
+        settler=(lambda channel, amount: mock_chain.send(channel.vendor, amount, sender=channel.payer)) if mock_chain else None
+    )
+
+# Metered billing: printing, charging and viewing accrue their per-minute
+# price against the balance the job's payment bought (in USDC): its expected
+# duration times METER_PREPAID_MARGIN. The device stops when it runs out.
+METER_PREPAID_MARGIN = float(os.getenv("METER_PREPAID_MARGIN", "1.25"))
+
+# Shutdown waits up to this long for accepted paid jobs to confirm and run
+SHUTDOWN_DRAIN_SEC = float(os.getenv("SHUTDOWN_DRAIN_SEC", "30"))
+
+# Build encoded /status bodies and G-code estimates at startup instead of on
+# the first requests (server.py turns this on)
+PREWARM_CACHES = os.getenv("PREWARM_CACHES", "0") == "1"
+
+def _prewarm_status() -> int:
+    warmed = 0
+    for site in site_registry.sites.values():
+        build = lambda site=site: [d.get_status_summary() for d in site.devices]
+        for media, coding in representations():
+            site.payload_cache.get("status", site.version, media, coding, build)
+            warmed += 1
+    return warmed
+
+def _prewarm_gcode() -> int:
+    """Blocking (parses every file); run on a worker thread."""
+    warmed = 0
+    for root, _, files in os.walk(GCODE_DIR):
+        for name in files:
+            if name.lower().endswith(".gcode"):
+                print_estimates.estimate(os.path.join(root, name))
+                warmed += 1
+    return warmed
 
-device_name_map = {d.id.replace("-", "_"): d for d in devices}  # e.g., "printer_3d_01" -> device
 
 @app.on_event("startup")
 async def startup_event():
+    global loop_thread_id
+    loop_thread_id = threading.get_ident()
     logger.info("[STARTUP] IoT Simulator API starting up...")
-    logger.info(f"[STARTUP] Initialized {len(devices)} devices: {[d.id for d in devices]}")
-    asyncio.create_task(simulation_loop())
-    logger.info("[STARTUP] Simulation loop started")
+    for site in site_registry.sites.values():
+        logger.info(f"[STARTUP] Site '{site.id}': {len(site.devices)} devices: {[d.id for d in site.devices]}")
+    if cluster:
+        logger.info(f"[STARTUP] Cluster node '{cluster.self_name}' of {list(cluster.ring.nodes)}")
+    if snapshotter:
+        try:
+            restored = snapshotter.restore(site_registry.device_map())
+            logger.info(f"[STARTUP] Restored {restored} devices from {SNAPSHOT_PATH}")
+            if restored:
+                # Indexes and rollups were built from the constructor defaults
+                for device in site_registry.all_devices():
+                    device.notify_changed()
+        except Exception as e:
+            logger.error(f"[STARTUP] Failed to restore snapshot {SNAPSHOT_PATH}: {str(e)}")
+        asyncio.create_task(snapshotter.run(SNAPSHOT_INTERVAL_SEC))
+        logger.info(f"[STARTUP] Snapshot checkpoints every {SNAPSHOT_INTERVAL_SEC}s")
+    if job_store:
+        asyncio.create_task(job_store.run())
+        logger.info(f"[STARTUP] Job history at {JOB_STORE_PATH}")
+    if access_logs:
+        asyncio.create_task(access_logs.run())
+    if alert_hub.webhook:
+        asyncio.create_task(alert_hub.webhook.run())
+    if payment_pipeline:
+        asyncio.create_task(payment_pipeline.run())
+        if mock_chain:
+            asyncio.create_task(mock_chain.run())
+        logger.info(f"[STARTUP] Payment pipeline: {CHAIN_VERIFICATION}, {PAYMENT_CONFIRMATIONS} confirmations")
+    if channel_ledger:
+        asyncio.create_task(channel_ledger.verifier.run())
+        asyncio.create_task(channel_ledger.run())
+        logger.info(f"[STARTUP] Payment channels: {len(channel_ledger.channels)} restored, settling every {CHANNEL_SETTLE_INTERVAL_SEC:g}s")
+    # One scheduler task per site, so a busy site never delays another's events
+    for site in site_registry.sites.values():
+        for device in site.devices:
+            device_path = f"{site.path_prefix}/devices/{device.id.replace('-', '_')}"
+            site.capability_index.register(device, _build_device_capabilities(site, device, device_path))
+        site.rebalance_chargers()
+        site.scheduler.schedule_all(site.devices)
+        asyncio.create_task(site.scheduler.run())
+        logger.info(f"[STARTUP] Site '{site.id}' scheduler started ({site.scheduler.pending()} devices with pending events)")
+    if PREWARM_CACHES:
+        started = time.perf_counter()
+        warmed = _prewarm_status() + await asyncio.to_thread(_prewarm_gcode)
+        logger.info(f"[STARTUP] Pre-warmed {warmed} cache entries in {(time.perf_counter() - started) * 1000:.0f}ms")
 
-async def simulation_loop():
-    while True:
-        for device in devices:
-            device.update()
-        await asyncio.sleep(5)
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Paid jobs already accepted (202) run once their payment confirms; give
+    # them the drain window instead of dropping them with the process
+    if payment_pipeline and payment_pipeline.in_flight():
+        logger.info(f"[SHUTDOWN] Draining {payment_pipeline.in_flight()} paid jobs (up to {SHUTDOWN_DRAIN_SEC:g}s)")
+        deadline = time.monotonic() + SHUTDOWN_DRAIN_SEC
+        while payment_pipeline.in_flight() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if payment_pipeline.in_flight():
+            logger.warning(f"[SHUTDOWN] {payment_pipeline.in_flight()} paid jobs still unconfirmed at shutdown")
+    if snapshotter:
+        try:
+            await asyncio.to_thread(snapshotter.write, snapshotter.collect())
+            logger.info(f"[SHUTDOWN] Final snapshot written to {SNAPSHOT_PATH}")
+        except Exception as e:
+            logger.error(f"[SHUTDOWN] Final snapshot failed: {str(e)}")
+    if job_store:
+        try:
+            job_store.flush()
+            job_store.close()
+        except Exception as e:
+            logger.error(f"[SHUTDOWN] Job history flush failed: {str(e)}")
+    if access_logs:
+        try:
+            await asyncio.to_thread(access_logs.flush)
+        except Exception as e:
+            logger.error(f"[SHUTDOWN] Access log flush failed: {str(e)}")
+    if channel_ledger:
+        try:
+            channel_ledger.flush()
+            channel_ledger.close_store()
+        except Exception as e:
+            logger.error(f"[SHUTDOWN] Channel checkpoint failed: {str(e)}")
 
 @app.get("/status", response_model=List[DeviceSummary])
-async def get_all_status():
+async def get_all_status(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=STATUS_PAGE_MAX),
+    cursor: Optional[str] = None
+):
     """
     Get a summary list of all devices.
+    Accept: application/msgpack or application/vnd.fleet.columnar+json for
+    compact bodies; Accept-Encoding: br / gzip for compression.
+    For large fleets: ?limit=N returns one page as {"devices", "next_cursor"}
+    (pass next_cursor back as ?cursor= until it is null), and
+    Accept: application/x-ndjson streams one summary per line.
     """
     logger.info("[API] GET /status - Request received")
+    site = _site()
+    local = not cluster or LOCAL_HEADER in request.headers
+
+    def build():
+        with RequestPhase("summaries"):
+            return [d.get_status_summary() for d in site.devices]
+
+    if limit is not None or cursor is not None:
+        return await _status_page(request, site, limit or STATUS_PAGE_MAX, cursor, local)
+    if choose_media(request.headers.get("accept"), streaming=True) == NDJSON_MEDIA:
+        logger.info(f"[API] GET /status - Streaming {len(site.devices)} local devices as NDJSON")
+        return StreamingResponse(_status_lines(site, local), media_type=NDJSON_MEDIA)
+
     try:
-        summaries = [d.get_status_summary() for d in devices]
-        logger.info(f"[API] GET /status - Returning {len(summaries)} devices")
-        return summaries
+        if not local:
+            return await _cluster_status(request, site, build)
+        response = _encoded_response(request, "status", site.version, build, columnar=True)
+        logger.info(f"[API] GET /status - Returning {len(site.devices)} devices ({response.media_type})")
+        return response
     except Exception as e:
         logger.error(f"[API] GET /status - Error: {str(e)}")
         raise
 
+async def _cluster_status(request: Request, site: Site, build) -> Response:
+    """Merge this node's shard of the site with every peer's (scatter-gather)."""
+    with RequestPhase("cluster_gather"):
+        bodies, missing = await cluster.gather(f"{site.path_prefix}/status")
+    summaries = build()
+    for body in bodies.values():
+        summaries.extend(body)
+    media = choose_media(request.headers.get("accept"), True)
+    coding = choose_coding(request.headers.get("accept-encoding"))
+    with RequestPhase("encode"):
+        body, used = encode(summaries, media, coding, STATUS_MIN_COMPRESS_BYTES)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if used != "identity":
+        headers["Content-Encoding"] = used
+    if missing:
+        # Partial answer: the listed nodes did not respond in time
+        headers["X-Cluster-Missing"] = ",".join(missing)
+    logger.info(f"[API] GET /status - Returning {len(summaries)} devices from {len(bodies) + 1} nodes")
+    return Response(body, media_type=media, headers=headers)
+
+def _encode_cursor(node: str, after: str) -> str:
+    return base64.urlsafe_b64encode(f"{node}\n{after}".encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    """(node, last device id of the previous page; "" = that node's first page)."""
+    try:
+        node, after = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8").split("\n", 1)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return node, after
+
+def _local_page(site: Site, after: str, limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Summaries of this node's devices after `after`, and the last id (None at the end)."""
+    start = 0
+    if after:
+        if after not in site.device_rows:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        start = site.device_rows[after] + 1
+    devices = site.devices[start:start + limit]
+    with RequestPhase("summaries"):
+        summaries = [d.get_status_summary() for d in devices]
+    return summaries, devices[-1].id if start + limit < len(site.devices) else None
+
+async def _status_page(request: Request, site: Site, limit: int, cursor: Optional[str], local: bool) -> Response:
+    """
+    One /status page. Cursors name a node and a position in its shard, so a
+    cluster is paged node by node (in ring name order) and any node can
+    serve the next page; pages are short at node boundaries.
+    """
+    self_node = cluster.self_name if cluster else ""
+    nodes = [self_node] if local else sorted(cluster.ring.nodes)
+    node, after = _decode_cursor(cursor) if cursor else (nodes[0], "")
+    if node not in nodes:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if node == self_node:
+        summaries, last = _local_page(site, after, limit)
+    else:
+        query = f"limit={limit}" + (f"&cursor={cursor}" if after else "")
+        try:
+            with RequestPhase("cluster_gather"):
+                body = await cluster.fetch(node, f"{site.path_prefix}/status?{query}")
+        except Exception as e:
+            logger.warning(f"[API] GET /status - Page from {node} failed: {str(e)}")
+            raise HTTPException(status_code=502, detail=f"Cluster node '{node}' did not respond")
+        summaries = body["devices"]
+        last = _decode_cursor(body["next_cursor"])[1] if body["next_cursor"] else None
+
+    if last is not None:
+        next_cursor = _encode_cursor(node, last)
+    else:
+        following = nodes.index(node) + 1
+        next_cursor = _encode_cursor(nodes[following], "") if following < len(nodes) else None
+
+    media = choose_media(request.headers.get("accept"))
+    coding = choose_coding(request.headers.get("accept-encoding"))
+    with RequestPhase("encode"):
+        body, used = encode({"devices": summaries, "next_cursor": next_cursor}, media, coding, STATUS_MIN_COMPRESS_BYTES)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if used != "identity":
+        headers["Content-Encoding"] = used
+    logger.info(f"[API] GET /status - Returning page of {len(summaries)} devices (node: {node or 'local'})")
+    return Response(body, media_type=media, headers=headers)
+
+async def _status_lines(site: Site, local: bool):
+    """
+    NDJSON chunks of STATUS_STREAM_CHUNK summaries, each built as it is
+    sent, so memory per request stays flat and clients can start on the
+    first lines. Peers' shards follow, read page by page; a peer that
+    fails is logged and skipped (the status line has already been sent).
+    """
+    devices = site.devices
+    for start in range(0, len(devices), STATUS_STREAM_CHUNK):
+        yield ndjson_lines([d.get_status_summary() for d in devices[start:start + STATUS_STREAM_CHUNK]])
+        # Let other requests run between the chunks of a large fleet
+        await asyncio.sleep(0)
+    if local:
+        return
+    for node in sorted(cluster.peers):
+        cursor = None
+        while True:
+            query = f"limit={STATUS_STREAM_CHUNK}" + (f"&cursor={cursor}" if cursor else "")
+            try:
+                body = await cluster.fetch(node, f"{site.path_prefix}/status?{query}")
+            except Exception as e:
+                logger.warning(f"[API] GET /status - Stream from {node} cut short: {str(e)}")
+                break
+            if body["devices"]:
+                yield ndjson_lines(body["devices"])
+            cursor = body["next_cursor"]
+            if not cursor:
+                break
+
 @app.get("/status/{device_id}", response_model=DeviceDetail)
-async def get_device_status(device_id: str):
+async def get_device_status(device_id: str, request: Request):
     """
-    Get detailed telemetry for a specific device.
+    Get detailed telemetry for a specific device (same negotiation as /status).
     """
     logger.info(f"[API] GET /status/{device_id} - Request received")
-    if device_id not in device_map:
+    site = _site()
+    if device_id not in site.device_map:
         logger.warning(f"[API] GET /status/{device_id} - Device not found")
         raise HTTPException(status_code=404, detail="Device not found")
     
     try:
-        detail = device_map[device_id].get_detail()
+        device = site.device_map[device_id]
+        tick = int(time.monotonic() // SIM_TICK_INTERVAL_SEC)
+        response = _encoded_response(
+            request, ("detail", device_id), (site.device_versions.get(device_id, 0), tick), device.get_detail
+        )
         logger.info(f"[API] GET /status/{device_id} - Returning device detail")
-        return detail
+        return response
     except Exception as e:
         logger.error(f"[API] GET /status/{device_id} - Error: {str(e)}")
         raise
 
+@app.get("/devices", response_model=List[DeviceSummary])
+async def query_devices(
+    device_type: Optional[str] = Query(None, alias="type"),
+    status: Optional[str] = None,
+    ens_suffix: Optional[str] = None,
+    product: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000)
+):
+    """
+    Query devices by type, status, ENS suffix and in-stock product.
+    Example: /devices?type=ev_charger&status=AVAILABLE&limit=1
+    """
+    logger.info(f"[API] GET /devices - Query type={device_type} status={status} ens_suffix={ens_suffix} product={product} limit={limit}")
+    matches = _site().fleet_index.query(
+        device_type=device_type,
+        status=status,
+        ens_suffix=ens_suffix,
+        product=product,
+        limit=limit
+    )
+    logger.info(f"[API] GET /devices - Returning {len(matches)} devices")
+    return [d.get_status_summary() for d in matches]
+
+@app.get("/inventory")
+async def get_fleet_inventory():
+    """
+    Fleet-wide vending stock per product (on hand, reserved, available).
+    """
+    logger.info("[API] GET /inventory - Request received")
+    return _site().stock_ledger.summary()
+
+@app.get("/charging/site")
+async def get_site_charging():
+    """
+    Site power budget and how much of it the chargers are drawing.
+    """
+    logger.info("[API] GET /charging/site - Request received")
+    return _site().load_balancer.summary()
+
+@app.get("/capabilities/search")
+async def search_capabilities(
+    request: Request,
+    q: str = Query(..., min_length=1, description="Free text, e.g. 'buy PLA filament'"),
+    type: Optional[str] = Query(None, description="Only capabilities of this device type"),
+    limit: int = Query(20, ge=1, le=200)
+):
+    """
+    Ranked capabilities across the site's devices, so agents do not need to
+    fetch and scan every device manifest.
+    """
+    logger.info(f"[API] GET /capabilities/search - q='{q}'")
+    site = _site()
+    with RequestPhase("search"):
+        hits = site.capability_index.search(q, limit=limit, device_type=type)
+    headers = {}
+    if cluster and LOCAL_HEADER not in request.headers:
+        with RequestPhase("cluster_gather"):
+            bodies, missing = await cluster.gather(f"{site.path_prefix}{request.url.path}?{request.url.query}")
+        # Endpoints are relative to the node that owns the device
+        for node, body in bodies.items():
+            for hit in body["results"]:
+                hit["endpoint"] = cluster.ring.url(node) + hit["endpoint"]
+                hits.append(hit)
+        hits = sorted(hits, key=lambda hit: -hit["score"])[:limit]
+        if missing:
+            headers["X-Cluster-Missing"] = ",".join(missing)
+    logger.info(f"[API] GET /capabilities/search - Returning {len(hits)} results")
+    return JSONResponse({"query": q, "results": hits}, headers=headers)
+
+@app.get("/fleet/aggregates")
+async def get_fleet_aggregates(request: Request):
+    """
+    Fleet-wide rollups per device type (charger kW, printer progress,
+    low-battery locks, vending stock), per site and merged. Served from
+    running aggregates, so the cost does not depend on the fleet size.
+    """
+    logger.info("[API] GET /fleet/aggregates - Request received")
+    sites = {site.id: site.aggregates.summary() for site in site_registry.sites.values()}
+    headers = {}
+    if cluster and LOCAL_HEADER not in request.headers:
+        with RequestPhase("cluster_gather"):
+            bodies, missing = await cluster.gather("/fleet/aggregates")
+        # Every node runs every site, each with its own shard of devices
+        for body in bodies.values():
+            for site_id, summary in body["sites"].items():
+                sites[site_id] = merge_summaries([sites.get(site_id, {}), summary])
+        if missing:
+            headers["X-Cluster-Missing"] = ",".join(missing)
+    return JSONResponse({"fleet": merge_summaries(sites.values()), "sites": sites}, headers=headers)
+
+@app.get("/alerts")
+async def get_alerts(site_id: Optional[str] = None, limit: int = Query(100, ge=1, le=500)):
+    """Active alerts and the most recent alert events (newest first)."""
+    active = [a for a in alert_hub.active.values() if not site_id or a["site_id"] == site_id]
+    recent = [a for a in reversed(alert_hub.recent) if not site_id or a["site_id"] == site_id][:limit]
+    return {"active": active, "recent": recent}
+
+@app.get("/alerts/stream")
+async def stream_alerts(request: Request, site_id: Optional[str] = None):
+    """
+    Server-Sent Events: one "alert" event per firing / resolved / event
+    alert, with a comment heartbeat every 15s to keep proxies from timing out.
+    """
+    logger.info(f"[API] GET /alerts/stream - Subscriber connected (site: {site_id or 'all'})")
+    queue = alert_hub.subscribe()
+
+    async def events():
+        try:
+            yield ": connected\n\n"
+            while not await request.is_disconnected():
+                try:
+                    alert = await asyncio.wait_for(queue.get(), 15)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if site_id and alert["site_id"] != site_id:
+                    continue
+                yield f"id: {alert['id']}\nevent: alert\ndata: {json.dumps(alert)}\n\n"
+        finally:
+            alert_hub.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/sites")
+async def list_sites():
+    """
+    Sites served by this node and how to reach each one (host or /sites/<id> prefix).
+    """
+    logger.info("[API] GET /sites - Request received")
+    return {"default_site": site_registry.default_site_id, "sites": [s.summary() for s in site_registry.sites.values()]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Receipt of a completed job, by the receipt_id in its response (or the
+    job_id of a 202).
+    """
+    logger.info(f"[API] GET /jobs/{job_id} - Request received")
+    payment = payment_pipeline.get(job_id) if payment_pipeline else None
+    if payment and (payment.status != "completed" or not job_store):
+        return payment.to_dict(payment_pipeline.confirmations)
+    if not job_store:
+        raise HTTPException(status_code=404, detail="Job history is disabled")
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if not job:
+        logger.warning(f"[API] GET /jobs/{job_id} - Job not found")
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
+
+@app.get("/jobs")
+async def list_jobs(
+    device: Optional[str] = None,
+    payer: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    session_id: Optional[str] = None,
+    purchase_id: Optional[str] = None
+):
+    """
+    Paginated job receipts, filtered by device, payer address, time, and
+    charging session or purchase (e.g. a session's charge and stop jobs).
+    """
+    logger.info(f"[API] GET /jobs - Request received (device={device}, payer={payer}, since={since})")
+    if not job_store:
+        raise HTTPException(status_code=404, detail="Job history is disabled")
+    device_id = device.replace("_", "-") if device else None
+    try:
+        page = await asyncio.to_thread(
+            job_store.query, device_id, payer, _parse_time(since), _parse_time(until), cursor, limit,
+            session_id, purchase_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"[API] GET /jobs - Returning {len(page['jobs'])} jobs")
+    return page
+
+# ============================================================================
+# Payment Channels
+# ============================================================================
+
+class ChannelOpenRequest(BaseModel):
+    payer: str
+    deposit_eth: str
+    deposit_tx: str
+
+def _require_channels() -> ChannelLedger:
+    if not channel_ledger:
+        raise HTTPException(status_code=404, detail="Payment channels are disabled")
+    return channel_ledger
+
+@app.post("/channels", status_code=201)
+async def open_payment_channel(channel_request: ChannelOpenRequest):
+    """
+    Open a payment channel backed by a deposit transaction from `payer` to
+    the site vendor. With chain verification on, the channel opens once the
+    deposit confirms (202); after that, paid jobs take
+    `Authorization: Voucher <channel_id>:<cumulative_wei>:<signature>`.
+    """
+    ledger = _require_channels()
+    site = _site()
+    logger.info(f"[API] POST /channels - Deposit {channel_request.deposit_eth} ETH from {channel_request.payer}")
+    try:
+        deposit_wei = eth_to_wei(channel_request.deposit_eth)
+    except ArithmeticError:
+        raise HTTPException(status_code=400, detail="deposit_eth must be a decimal ETH value")
+    try:
+        channel = ledger.open(channel_request.payer, site.vendor_address, deposit_wei, channel_request.deposit_tx)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PaymentError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if payment_pipeline:
+        try:
+            payment = payment_pipeline.submit(
+                channel_request.deposit_tx, site.vendor_address, channel_request.deposit_eth,
+                lambda payment: ledger.activate(channel), sender=channel_request.payer,
+                on_failed=lambda payment: ledger.fail(channel, payment.error)
+            )
+        except PaymentError as e:
+            ledger.fail(channel, str(e))
+            raise HTTPException(status_code=409, detail=str(e))
+        return JSONResponse(status_code=202, content=dict(
+            channel.to_dict(), deposit_job_id=payment.job_id, status_url=f"/channels/{channel.id}"
+        ))
+    # No chain verification: like tx hashes, the deposit is taken at its word
+    ledger.activate(channel)
+    return channel.to_dict()
+
+@app.get("/channels/{channel_id}")
+async def get_payment_channel(channel_id: str):
+    channel = _require_channels().get(channel_id)
+    if not channel:
+        raise HTTPException(status_code=404, detail=f"Channel '{channel_id}' not found")
+    return channel.to_dict()
+
+@app.post("/channels/{channel_id}/close")
+async def close_payment_channel(channel_id: str, authorization: Optional[str] = Header(None)):
+    """
+    Settle and close the channel. The payer proves the request with a
+    voucher for exactly the accepted amount; the unspent deposit is reported
+    as remaining_wei.
+    """
+    ledger = _require_channels()
+    if not Voucher.is_voucher(authorization):
+        raise HTTPException(status_code=401, detail="A voucher for the accepted amount is required")
+    try:
+        voucher = Voucher.parse(authorization)
+        if voucher.channel_id != channel_id.lower():
+            raise ValueError("Voucher is for another channel")
+        channel = await ledger.close(voucher, _site().vendor_address)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PaymentError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(f"[API] POST /channels/{channel_id[:10]}.../close - Closed")
+    return channel.to_dict()
+
+# ============================================================================
+# Admin: Profiling
+# ============================================================================
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/metering")
+async def get_metering(limit: int = Query(100, ge=1, le=500)):
+    """Open metering sessions of this site, its running totals and recently closed sessions."""
+    meter = _site().meter
+    return {
+        "summary": meter.summary(),
+        "active": [s.usage() for s in meter.by_id.values()],
+        "recent": [s.usage() for s in reversed(meter.ended)][:limit]
+    }
+
+@app.get("/metering/sessions/{session_id}")
+async def get_metering_session(session_id: str):
+    session = _site().meter.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Metering session '{session_id}' not found")
+    return session.usage()
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def start_profile(
+    seconds: float = Query(10, gt=0, le=300),
+    interval_ms: float = Query(5, ge=1, le=1000)
+):
+    """
+    Sample the event loop thread for N seconds. Download the result from
+    /admin/profile/collapsed (flamegraph.pl / speedscope format).
+    """
+    logger.info(f"[ADMIN] POST /admin/profile - Sampling for {seconds}s every {interval_ms}ms")
+    try:
+        sampling_profiler.start(loop_thread_id or threading.main_thread().ident, seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return sampling_profiler.status()
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def get_profile_status():
+    return sampling_profiler.status()
+
+@app.delete("/admin/profile", dependencies=[Depends(require_admin)])
+async def stop_profile():
+    await asyncio.to_thread(sampling_profiler.stop)
+    return sampling_profiler.status()
+
+@app.get("/admin/profile/collapsed", dependencies=[Depends(require_admin)])
+async def download_profile():
+    return PlainTextResponse(
+        sampling_profiler.collapsed(),
+        headers={"Content-Disposition": f"attachment; filename=profile-{int(time.time())}.collapsed"}
+    )
+
+@app.post("/admin/ticks", dependencies=[Depends(require_admin)])
+async def set_tick_tracing(enabled: bool = True):
+    """
+    Turn per-tick phase tracing of the event scheduler on or off.
+    """
+    tick_tracer.enabled = enabled
+    logger.info(f"[ADMIN] POST /admin/ticks - Tick tracing {'enabled' if enabled else 'disabled'}")
+    return {"enabled": tick_tracer.enabled}
+
+@app.get("/admin/ticks", dependencies=[Depends(require_admin)])
+async def get_tick_traces(limit: int = Query(60, ge=1, le=240)):
+    return {"enabled": tick_tracer.enabled, "ticks": tick_tracer.recent(limit)}
+
+class MockTransfer(BaseModel):
+    amount: str
+    to: Optional[str] = None
+    sender: Optional[str] = None
+
+@app.post("/admin/chain/transactions", dependencies=[Depends(require_admin)])
+async def send_mock_transaction(transfer: MockTransfer):
+    """
+    Send a transfer on the mock chain (CHAIN_VERIFICATION=mock) and return
+    its hash, to pay for jobs in tests and demos.
+    """
+    if not mock_chain:
+        raise HTTPException(status_code=404, detail="Mock chain is not enabled")
+    to = transfer.to or _site().vendor_address
+    try:
+        value_wei = eth_to_wei(transfer.amount)
+    except ArithmeticError:
+        raise HTTPException(status_code=400, detail="amount must be a decimal ETH value")
+    tx_hash = mock_chain.send(to, value_wei, sender=transfer.sender)
+    logger.info(f"[ADMIN] POST /admin/chain/transactions - Mock transfer {tx_hash[:10]}... ({transfer.amount} ETH)")
+    return {"transaction_hash": tx_hash, "block_number": mock_chain.height + 1}
+
 @app.get("/")
 async def root():
     logger.info("[API] GET / - Root endpoint accessed")
@@ -126,6 +909,27 @@ async def root():
 # x402 Protocol & AI Manifest Endpoints
 # ============================================================================
 
+def _manifest_devices(site: Site) -> List[Dict[str, Any]]:
+    """Every device of the site with its manifest URL (on its owner node in cluster mode)."""
+    if not cluster:
+        base = os.getenv("API_BASE_URL", "http://localhost:8000") + site.path_prefix
+        entries = [(d.id, d.name, d.type, base) for d in site.devices]
+    else:
+        entries = [
+            (device_id, name, device_type, cluster.ring.url(owner) + site.path_prefix)
+            for device_id, (site_id, owner, name, device_type) in cluster.directory.items()
+            if site_id == site.id
+        ]
+    return [
+        {
+            "id": device_id,
+            "name": name,
+            "type": device_type,
+            "manifest": f"{base}/devices/{device_id.replace('-', '_')}/ai-manifest"
+        }
+        for device_id, name, device_type, base in entries
+    ]
+
 @app.get("/ai-manifest")
 async def get_ai_manifest():
     """
@@ -186,10 +990,13 @@ async def get_ai_manifest():
             "chainId": 11155111,  # Ethereum Sepolia
             "chainName": "Ethereum Sepolia",
             "token": "ETH",  # Native ETH
-            "recipient": os.getenv("VENDOR_ADDRESS", "0x13EB37a124F98A76c973c3fce0F3FF829c7df57C"),  # seller-agent
+            "recipient": _site().vendor_address,  # seller-agent
             "rpcUrl": "https://rpc.sepolia.org"
+        },
+        "devices": _manifest_devices(_site())
         }
-        }
+        if cluster:
+            manifest["cluster"] = {"node": cluster.self_name, "nodes": list(cluster.ring.nodes)}
         logger.info(f"[API] GET /ai-manifest - Returning manifest with {len(manifest['capabilities'])} capabilities")
         return manifest
     except Exception as e:
@@ -215,12 +1022,15 @@ async def unlock_device(
     """
     logger.info(f"[API] POST /v1/devices/{device_id}/unlock - Request received (auth: {bool(authorization)})")
     
-    if device_id not in device_map:
+    site = _site()
+    if device_id not in site.device_map:
         logger.warning(f"[API] POST /v1/devices/{device_id}/unlock - Device not found")
         raise HTTPException(status_code=404, detail="Device not found")
     
-    device = device_map[device_id]
+    device = site.device_map[device_id]
     
+    amount = "0.001"  # Default price
+
     # Check if payment proof is provided
     if not authorization:
         # Step 1: Return 402 Payment Required (x402 protocol)
@@ -233,8 +1043,8 @@ async def unlock_device(
                     "chainId": 11155111,  # Ethereum Sepolia
                     "chainName": "Ethereum Sepolia",
                     "token": "ETH",
-                    "recipient": os.getenv("VENDOR_ADDRESS", "0x13EB37a124F98A76c973c3fce0F3FF829c7df57C"),  # seller-agent
-                    "amount": "0.001",  # Default price
+                    "recipient": site.vendor_address,  # seller-agent
+                    "amount": amount,
                     "description": f"Unlock device {device_id}"
                 }
             }
@@ -244,70 +1054,60 @@ async def unlock_device(
     tx_hash = authorization.replace("Bearer ", "").strip()
     logger.info(f"[API] POST /v1/devices/{device_id}/unlock - Verifying payment with tx_hash: {tx_hash[:20]}...")
     
-    # TODO: Implement actual blockchain verification
-    # For now, we'll accept any valid-looking transaction hash
     if not tx_hash.startswith("0x") or len(tx_hash) != 66:
         logger.warning(f"[API] POST /v1/devices/{device_id}/unlock - Invalid tx_hash format")
         raise HTTPException(
             status_code=401,
             detail="Invalid payment proof. Transaction hash must be a valid hex string (0x...)"
         )
-    
-    # Verify transaction on-chain
-    try:
-        # Import verifier (optional - can work without it for demo)
-        try:
-            from blockchain_verifier import verify_transaction_on_chain
-            
-            # Get payment config from manifest
-            payment_config = {
-                "recipient": os.getenv("VENDOR_ADDRESS", "0x13EB37a124F98A76c973c3fce0F3FF829c7df57C"),  # seller-agent
-                "amount": "0.001",
-                "rpcUrl": os.getenv("RPC_URL", "https://rpc.sepolia.org")
-            }
-            
-            # Verify transaction (async, but we'll use sync for simplicity in FastAPI)
-            # For hackathon: simplified verification
-            # In production: use async verification
-            is_valid = tx_hash.startswith("0x") and len(tx_hash) == 66
-            
-            # TODO: Uncomment for real blockchain verification
-            # is_valid = await verify_transaction_on_chain(
-            #     tx_hash,
-            #     payment_config["recipient"],
-            #     payment_config["amount"],
-            #     payment_config["rpcUrl"]
-            # )
-            
-            if not is_valid:
-                raise HTTPException(
-                    status_code=401,
-                    detail="Payment verification failed. Invalid transaction."
-                )
-        except ImportError:
-            # Fallback: basic format validation
-            if not (tx_hash.startswith("0x") and len(tx_hash) == 66):
-                raise HTTPException(
-                    status_code=401,
-                    detail="Invalid transaction hash format"
-                )
-        
-        # Unlock the device
-        logger.info(f"[API] POST /v1/devices/{device_id}/unlock - Payment verified, unlocking device")
+
+    def unlock():
         if hasattr(device, 'is_locked'):
             device.is_locked = False
             if hasattr(device, 'last_unlocked_by'):
                 device.last_unlocked_by = tx_hash[:10] + "..."  # Use tx hash prefix
-        
-        device.update()
-        
-        logger.info(f"[API] POST /v1/devices/{device_id}/unlock - Device unlocked successfully")
+            if hasattr(device, 'record_access'):
+                device.record_access("unlock", device.last_unlocked_by, tx_hash)
         return {
             "success": True,
             "message": f"Device {device_id} unlocked successfully",
             "transaction_hash": tx_hash,
             "device_status": device.get_detail()
         }
+
+    # With chain verification on, this route pays like /devices/{name}/job:
+    # the unlock runs once the transaction is confirmed, and a hash is
+    # accepted only once
+    if payment_pipeline:
+        async def release(payment):
+            result = await site.mutator.apply(device, unlock)
+            # GET /jobs/{job_id} serves the receipt once the job completes
+            if job_store:
+                result["receipt_id"] = job_store.record(
+                    device.id, "unlock", result, None, tx_hash, amount, receipt_id=payment.job_id
+                )
+            return result
+
+        try:
+            payment = payment_pipeline.submit(tx_hash, site.vendor_address, amount, release)
+        except PaymentError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        logger.info(f"[API] POST /v1/devices/{device_id}/unlock - Payment queued for verification, job {payment.job_id}")
+        return JSONResponse(status_code=202, content={
+            "success": True,
+            "job_id": payment.job_id,
+            "status": payment.status,
+            "transaction_hash": tx_hash,
+            "confirmations_required": payment_pipeline.confirmations,
+            "status_url": f"/jobs/{payment.job_id}"
+        })
+
+    # Without a pipeline (demo mode) any well-formed hash is accepted
+    try:
+        logger.info(f"[API] POST /v1/devices/{device_id}/unlock - Payment accepted, unlocking device")
+        result = await site.mutator.apply(device, unlock)
+        logger.info(f"[API] POST /v1/devices/{device_id}/unlock - Device unlocked successfully")
+        return result
     except HTTPException:
         raise
     except Exception as e:
@@ -341,55 +1141,51 @@ async def resolve_ens(ens_name: str):
     normalized_ens = ens_name.lower().replace(".eth", "")
     full_ens = normalized_ens + ".eth"
     
-    # Find device by ENS domain
-    device = ens_map.get(full_ens)
-    if not device:
-        logger.warning(f"[API] GET /resolve/{ens_name} - ENS domain not found")
-        raise HTTPException(status_code=404, detail=f"ENS domain '{ens_name}' not found")
+    # Find device by ENS domain (names are unique across sites); in cluster
+    # mode the directory also knows devices sharded to other nodes
+    device_id = cluster.ens_directory.get(full_ens) if cluster else None
+    if device_id:
+        site_id, owner, device_display_name, _ = cluster.directory[device_id]
+        site = site_registry.sites[site_id]
+    else:
+        site, device = site_registry.ens_index.get(full_ens, (None, None))
+        if not device:
+            logger.warning(f"[API] GET /resolve/{ens_name} - ENS domain not found")
+            raise HTTPException(status_code=404, detail=f"ENS domain '{ens_name}' not found")
+        device_id, device_display_name = device.id, device.name
     
-    # Get base URL from environment or use default
-    base_url = os.getenv("API_BASE_URL", "http://localhost:8000")
+    # Sites served on their own host have a base_url; others live under /sites/<id>.
+    # Cluster nodes hand out the owner node's URL so agents talk to it directly.
+    if cluster:
+        base_url = cluster.ring.url(owner) + site.path_prefix
+    else:
+        base_url = site.base_url or os.getenv("API_BASE_URL", "http://localhost:8000") + site.path_prefix
     
-    # Device-specific payment address (could be different per device, but using same for now)
-    # In production, each device could have its own wallet
-    payment_address = os.getenv("VENDOR_ADDRESS", "0x13EB37a124F98A76c973c3fce0F3FF829c7df57C")
+    # Each site is paid at its own vendor address
+    payment_address = site.vendor_address
     
     # Create device-specific URL path
-    device_name = device.id.replace("-", "_")  # e.g., "printer-3d-01" -> "printer_3d_01"
+    device_name = device_id.replace("-", "_")  # e.g., "printer-3d-01" -> "printer_3d_01"
     device_url = f"{base_url}/devices/{device_name}"
     
     result = {
         "url": device_url,
         "payment_address": payment_address,
-        "device_id": device.id,
-        "device_name": device.name,
-        "ens_domain": full_ens
+        "device_id": device_id,
+        "device_name": device_display_name,
+        "ens_domain": full_ens,
+        "site_id": site.id
     }
+    if cluster:
+        result["node"] = owner
     
-    logger.info(f"[API] GET /resolve/{ens_name} - Resolved to device: {device.id}")
+    logger.info(f"[API] GET /resolve/{ens_name} - Resolved to device: {device_id}")
     return result
 
-@app.get("/devices/{device_name}/ai-manifest")
-async def get_device_manifest(device_name: str):
+def _build_device_capabilities(site: Site, device: DeviceSimulator, device_path: str) -> List[Dict[str, Any]]:
     """
-    Device-Specific Manifest: Returns capabilities for a specific device.
-    This allows each device to appear as a separate machine with its own manifest.
+    Capabilities advertised in a device's AI manifest, by device type.
     """
-    logger.info(f"[API] GET /devices/{device_name}/ai-manifest - Request received")
-    
-    # Find device by name (convert from URL format to device ID)
-    device_id = device_name.replace("_", "-")  # e.g., "printer_3d_01" -> "printer-3d-01"
-    device = device_map.get(device_id)
-    
-    if not device:
-        logger.warning(f"[API] GET /devices/{device_name}/ai-manifest - Device not found")
-        raise HTTPException(status_code=404, detail=f"Device '{device_name}' not found")
-    
-    # Get base URL
-    base_url = os.getenv("API_BASE_URL", "http://localhost:8000")
-    device_path = f"/devices/{device_name}"
-    
-    # Build device-specific capabilities based on device type
     capabilities = []
     
     # Common capability: get device status
@@ -413,46 +1209,43 @@ async def get_device_manifest(device_name: str):
             "endpoint": f"{device_path}/job",
             "method": "POST",
             "description": f"Unlock {device.name} (requires payment)",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "action": {
-                        "type": "string",
-                        "enum": ["unlock"],
-                        "description": "Action to perform"
-                    }
-                },
-                "required": []
-            },
+            "schema": manifest_schema(device.type, "unlock", device.PRICE_PER_MIN),
             "payment_required": True,
-            "default_amount_eth": "0.001"
+            "default_amount_eth": site.price(device.type, "unlock")
         })
         capabilities.append({
             "id": "lock_device",
             "endpoint": f"{device_path}/job",
             "method": "POST",
             "description": f"Lock {device.name} manually",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "action": {
-                        "type": "string",
-                        "enum": ["lock"],
-                        "description": "Action to perform"
-                    }
-                },
-                "required": []
-            },
+            "schema": manifest_schema(device.type, "lock", device.PRICE_PER_MIN),
             "payment_required": False
         })
         capabilities.append({
             "id": "check_access_log",
-            "endpoint": f"{device_path}/status",
+            "endpoint": f"{device_path}/access-log",
             "method": "GET",
             "description": f"Get access log and history for {device.name}",
             "schema": {
                 "type": "object",
-                "properties": {},
+                "properties": {
+                    "since": {
+                        "type": "string",
+                        "description": "Start of the time range (ISO 8601 or unix seconds)"
+                    },
+                    "until": {
+                        "type": "string",
+                        "description": "End of the time range (ISO 8601 or unix seconds)"
+                    },
+                    "cursor": {
+                        "type": "string",
+                        "description": "next_cursor from the previous page"
+                    },
+                    "limit": {
+                        "type": "number",
+                        "description": "Events per page (default: 100, max: 1000)"
+                    }
+                },
                 "required": []
             },
             "payment_required": False
@@ -463,72 +1256,25 @@ async def get_device_manifest(device_name: str):
             "endpoint": f"{device_path}/job",
             "method": "POST",
             "description": f"Print document on {device.name} (requires payment)",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "action": {
-                        "type": "string",
-                        "enum": ["print"],
-                        "description": "Action to perform"
-                    },
-                    "file_url": {
-                        "type": "string",
-                        "description": "URL of the file to print"
-                    }
-                },
-                "required": []
-            },
+            "schema": manifest_schema(device.type, "print", device.PRICE_PER_MIN),
             "payment_required": True,
-            "default_amount_eth": "0.002"
+            "default_amount_eth": site.price(device.type, "print")
         })
         capabilities.append({
             "id": "buy_filament",
             "endpoint": f"{device_path}/job",
             "method": "POST",
             "description": f"Purchase filament/material for {device.name} (requires payment)",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "action": {
-                        "type": "string",
-                        "enum": ["buy_filament"],
-                        "description": "Action to perform"
-                    },
-                    "material_type": {
-                        "type": "string",
-                        "enum": ["PLA", "ABS", "PETG", "TPU"],
-                        "description": "Type of filament material"
-                    },
-                    "color": {
-                        "type": "string",
-                        "description": "Color of the filament (e.g., 'black', 'white', 'red')"
-                    },
-                    "weight_grams": {
-                        "type": "number",
-                        "description": "Weight in grams (default: 1000g spool)"
-                    }
-                },
-                "required": []
-            },
+            "schema": manifest_schema(device.type, "buy_filament", device.PRICE_PER_MIN),
             "payment_required": True,
-            "default_amount_eth": "0.003"
+            "default_amount_eth": site.price(device.type, "buy_filament")
         })
         capabilities.append({
             "id": "pause_print",
             "endpoint": f"{device_path}/job",
             "method": "POST",
             "description": f"Pause current print job on {device.name}",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "action": {
-                        "type": "string",
-                        "enum": ["pause"],
-                        "description": "Action to perform"
-                    }
-                },
-                "required": []
-            },
+            "schema": manifest_schema(device.type, "pause", device.PRICE_PER_MIN),
             "payment_required": False
         })
         capabilities.append({
@@ -536,17 +1282,7 @@ async def get_device_manifest(device_name: str):
             "endpoint": f"{device_path}/job",
             "method": "POST",
             "description": f"Cancel current print job on {device.name}",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "action": {
-                        "type": "string",
-                        "enum": ["cancel"],
-                        "description": "Action to perform"
-                    }
-                },
-                "required": []
-            },
+            "schema": manifest_schema(device.type, "cancel", device.PRICE_PER_MIN),
             "payment_required": False
         })
     elif device.type == "ev_charger":
@@ -555,40 +1291,16 @@ async def get_device_manifest(device_name: str):
             "endpoint": f"{device_path}/job",
             "method": "POST",
             "description": f"Start charging session at {device.name} (requires payment)",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "action": {
-                        "type": "string",
-                        "enum": ["charge"],
-                        "description": "Action to perform"
-                    },
-                    "target_percent": {
-                        "type": "number",
-                        "description": "Target battery percentage (default: 100%)"
-                    }
-                },
-                "required": []
-            },
+            "schema": manifest_schema(device.type, "charge", device.PRICE_PER_MIN),
             "payment_required": True,
-            "default_amount_eth": "0.005"
+            "default_amount_eth": site.price(device.type, "charge")
         })
         capabilities.append({
             "id": "stop_charging",
             "endpoint": f"{device_path}/job",
             "method": "POST",
             "description": f"Stop current charging session at {device.name}",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "action": {
-                        "type": "string",
-                        "enum": ["stop"],
-                        "description": "Action to perform"
-                    }
-                },
-                "required": []
-            },
+            "schema": manifest_schema(device.type, "stop", device.PRICE_PER_MIN),
             "payment_required": False
         })
         capabilities.append({
@@ -609,27 +1321,9 @@ async def get_device_manifest(device_name: str):
             "endpoint": f"{device_path}/job",
             "method": "POST",
             "description": f"Dispense product from {device.name} (requires payment)",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "action": {
-                        "type": "string",
-                        "enum": ["dispense"],
-                        "description": "Action to perform"
-                    },
-                    "product_id": {
-                        "type": "string",
-                        "description": "Product ID or name to dispense"
-                    },
-                    "slot": {
-                        "type": "number",
-                        "description": "Slot number (optional)"
-                    }
-                },
-                "required": []
-            },
+            "schema": manifest_schema(device.type, "dispense", device.PRICE_PER_MIN),
             "payment_required": True,
-            "default_amount_eth": "0.003"
+            "default_amount_eth": site.price(device.type, "dispense")
         })
         capabilities.append({
             "id": "check_inventory",
@@ -648,33 +1342,65 @@ async def get_device_manifest(device_name: str):
             "endpoint": f"{device_path}/job",
             "method": "POST",
             "description": f"Restock product in {device.name} (requires payment)",
+            "schema": manifest_schema(device.type, "restock", device.PRICE_PER_MIN),
+            "payment_required": True,
+            "default_amount_eth": site.price(device.type, "restock")
+        })
+    elif device.type == "security_camera":
+        capabilities.append({
+            "id": "view_stream",
+            "endpoint": f"{device_path}/job",
+            "method": "POST",
+            "description": f"Open a paid live viewing session on {device.name} (requires payment)",
+            "schema": manifest_schema(device.type, "view", device.PRICE_PER_MIN),
+            "payment_required": True,
+            "default_amount_eth": site.price(device.type, "view")
+        })
+        capabilities.append({
+            "id": "watch_stream",
+            "endpoint": f"{device_path}/stream",
+            "method": "GET",
+            "description": f"Live multipart frame stream from {device.name} for an open session",
             "schema": {
                 "type": "object",
                 "properties": {
-                    "action": {
-                        "type": "string",
-                        "enum": ["restock"],
-                        "description": "Action to perform"
-                    },
-                    "product_id": {
+                    "session_id": {
                         "type": "string",
-                        "description": "Product ID to restock"
-                    },
-                    "quantity": {
-                        "type": "number",
-                        "description": "Quantity to add"
-                    },
-                    "slot": {
-                        "type": "number",
-                        "description": "Slot number"
+                        "description": "session_id returned by view_stream"
                     }
                 },
-                "required": []
+                "required": ["session_id"]
             },
-            "payment_required": True,
-            "default_amount_eth": "0.004"
+            "payment_required": False
         })
     
+    return capabilities
+
+@app.get("/devices/{device_name}/ai-manifest")
+async def get_device_manifest(device_name: str):
+    """
+    Device-Specific Manifest: Returns capabilities for a specific device.
+    This allows each device to appear as a separate machine with its own manifest.
+    """
+    logger.info(f"[API] GET /devices/{device_name}/ai-manifest - Request received")
+    
+    # Find device by name (convert from URL format to device ID)
+    site = _site()
+    device_id = device_name.replace("_", "-")  # e.g., "printer_3d_01" -> "printer-3d-01"
+    device = site.device_map.get(device_id)
+    
+    if not device:
+        logger.warning(f"[API] GET /devices/{device_name}/ai-manifest - Device not found")
+        raise HTTPException(status_code=404, detail=f"Device '{device_name}' not found")
+    
+    # Get base URL
+    base_url = os.getenv("API_BASE_URL", "http://localhost:8000")
+    device_path = f"{site.path_prefix}/devices/{device_name}"
+    
+    # Build device-specific capabilities based on device type
+    with RequestPhase("manifest"):
+        capabilities = _build_device_capabilities(site, device, device_path)
+    
     manifest = {
         "name": device.name,
         "version": "1.0.0",
@@ -684,7 +1410,7 @@ async def get_device_manifest(device_name: str):
             "chainId": 11155111,  # Ethereum Sepolia
             "chainName": "Ethereum Sepolia",
             "token": "ETH",
-            "recipient": os.getenv("VENDOR_ADDRESS", "0x13EB37a124F98A76c973c3fce0F3FF829c7df57C"),
+            "recipient": site.vendor_address,
             "rpcUrl": "https://rpc.sepolia.org"
         },
         "device_info": {
@@ -705,7 +1431,7 @@ async def get_device_status_by_name(device_name: str):
     logger.info(f"[API] GET /devices/{device_name}/status - Request received")
     
     device_id = device_name.replace("_", "-")
-    device = device_map.get(device_id)
+    device = _site().device_map.get(device_id)
     
     if not device:
         logger.warning(f"[API] GET /devices/{device_name}/status - Device not found")
@@ -714,16 +1440,463 @@ async def get_device_status_by_name(device_name: str):
     logger.info(f"[API] GET /devices/{device_name}/status - Returning device detail")
     return device.get_detail()
 
+def _vending_order_items(device: VendingMachine, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Normalize dispense params into order items. Accepts a multi-item
+    "items" list, a single product_id/slot, or nothing (first slot in stock).
+    """
+    if params.get("items"):
+        return params["items"]
+    quantity = params["quantity"]
+    if params.get("slot") is not None:
+        return [{"slot": params["slot"], "quantity": quantity}]
+    if params.get("product_id") not in (None, "", "unknown"):
+        return [{"product_id": params["product_id"], "quantity": quantity}]
+    for index in range(len(device.inventory.slot_names)):
+        if device.inventory.available(index) > 0:
+            return [{"slot": index + 1, "quantity": quantity}]
+    raise HTTPException(status_code=409, detail=f"{device.name} is sold out")
+
+def _hold_owner(request: Request, payer: Optional[str]) -> str:
+    """Who a vending quote hold belongs to: the payer address, else the client IP."""
+    if payer:
+        return payer.lower()
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+async def _estimate_print(file_url: Optional[str]):
+    """
+    Resolve a print job's file_url to a local G-code file and estimate it off
+    the event loop. Returns (path or None, estimate).
+    """
+    path = resolve_gcode_path(file_url, GCODE_DIR)
+    if path is None:
+        return None, default_estimate(DEFAULT_PRINT_DURATION_SEC)
+    try:
+        return path, await asyncio.to_thread(print_estimates.estimate, path)
+    except OSError as e:
+        raise HTTPException(status_code=400, detail=f"Cannot read G-code file '{file_url}': {str(e)}")
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    """Accept unix seconds or ISO 8601 (with optional trailing Z)."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid time '{value}'")
+    if parsed.tzinfo is None:
+        return (parsed - datetime(1970, 1, 1)).total_seconds()
+    return parsed.timestamp()
+
+@app.get("/devices/{device_name}/access-log")
+async def get_device_access_log(
+    device_name: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """
+    Paginated access events (unlock, lock, auto_lock) for a smart lock.
+    """
+    logger.info(f"[API] GET /devices/{device_name}/access-log - Request received (since={since}, until={until})")
+
+    device_id = device_name.replace("_", "-")
+    device = _site().device_map.get(device_id)
+    if not device:
+        logger.warning(f"[API] GET /devices/{device_name}/access-log - Device not found")
+        raise HTTPException(status_code=404, detail=f"Device '{device_name}' not found")
+    if not isinstance(device, SmartLock) or device.access_log is None:
+        raise HTTPException(status_code=404, detail=f"Device '{device_name}' has no access log")
+
+    try:
+        page = await asyncio.to_thread(device.access_log.query, _parse_time(since), _parse_time(until), cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    logger.info(f"[API] GET /devices/{device_name}/access-log - Returning {len(page['events'])} events")
+    return {
+        "device_id": device.id,
+        "events": page["events"],
+        "next_cursor": page["next_cursor"],
+        "total_events": device.access_log.count
+    }
+
+@app.get("/devices/{device_name}/stream")
+async def stream_device(device_name: str, session_id: str):
+    """
+    Live multipart (MJPEG-style) stream for a paid viewing session.
+    """
+    logger.info(f"[API] GET /devices/{device_name}/stream - Request received (session: {session_id[:8]}...)")
+
+    device_id = device_name.replace("_", "-")
+    device = _site().device_map.get(device_id)
+    if not device or not isinstance(device, SecurityCamera):
+        logger.warning(f"[API] GET /devices/{device_name}/stream - Camera not found")
+        raise HTTPException(status_code=404, detail=f"Camera '{device_name}' not found")
+
+    session = stream_broker.registries[device.id].get(session_id)
+    if session is None:
+        raise HTTPException(status_code=403, detail="Viewing session not found or expired")
+
+    return StreamingResponse(
+        stream_broker.frames(device, session),
+        media_type=f"multipart/x-mixed-replace; boundary={MULTIPART_BOUNDARY}"
+    )
+
+@app.get("/streams/capacity")
+async def get_stream_capacity():
+    """
+    Node stream budget, current viewers and how many more can be admitted.
+    """
+    logger.info("[API] GET /streams/capacity - Request received")
+    return stream_broker.capacity()
+
 class JobRequest(BaseModel):
     action: Optional[str] = None
     params: Optional[Dict[str, Any]] = None
 
+def _open_meter(site: Site, device: DeviceSimulator, ref: str, payer: Optional[str],
+                expected_sec: float) -> Dict[str, Any]:
+    """
+    Start metering a session. The balance is what the paid job covers, its
+    expected duration plus the margin, never a number the client picks.
+    """
+    prepaid = device.PRICE_PER_MIN * max(60.0, expected_sec) / 60.0 * METER_PREPAID_MARGIN
+    return site.meter.open(device, ref, payer, prepaid).usage()
+
+def _apply_job(
+    site: Site,
+    device: DeviceSimulator,
+    device_name: str,
+    action: str,
+    params: Dict[str, Any],
+    tx_hash: Optional[str],
+    requires_payment: bool,
+    amount: str,
+    x_payer_address: Optional[str],
+    order_items: Optional[List[Dict[str, Any]]],
+    print_path: Optional[str],
+    print_estimate: Optional[PrintEstimate],
+    receipt_id: Optional[str] = None,
+    hold_owner: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Perform a job whose payment has been accepted and return its result.
+    params were checked against the action's schema (job_schemas) on
+    arrival, so declared params are present or defaulted and well-typed.
+    Runs inline for free actions and unverified payments, or from the
+    payment pipeline once the transaction is deep enough; either way as a
+    site.mutator transition, so validation and mutation are not split by
+    an await and jobs on one device never interleave.
+    """
+    # Device-specific action execution
+    result_data = {
+        "success": True,
+        "message": f"Action '{action}' executed on {device.name} successfully",
+        "transaction_hash": tx_hash,
+        "device_status": device.get_detail()
+    }
+    
+    # Execute action based on device type and action
+    if device.type == "smart_lock":
+        if action == "unlock":
+            if hasattr(device, 'is_locked'):
+                device.is_locked = False
+            if hasattr(device, 'last_unlocked_by'):
+                device.last_unlocked_by = tx_hash[:10] + "..." if requires_payment else "manual"
+            if hasattr(device, 'auto_lock_timer_sec'):
+                device.auto_lock_timer_sec = 300  # 5 minutes auto-lock
+            device.record_access(
+                "unlock",
+                x_payer_address or device.last_unlocked_by,
+                tx_hash if requires_payment else None
+            )
+            result_data["message"] = f"{device.name} unlocked successfully"
+            logger.info(f"[API] POST /devices/{device_name}/job - Device unlocked")
+        elif action == "lock":
+            if hasattr(device, 'is_locked'):
+                device.is_locked = True
+            if hasattr(device, 'auto_lock_timer_sec'):
+                device.auto_lock_timer_sec = 0
+            device.record_access("lock", x_payer_address or "manual")
+            result_data["message"] = f"{device.name} locked manually"
+            logger.info(f"[API] POST /devices/{device_name}/job - Device locked")
+            
+    elif device.type == "3d_printer":
+        if action == "print":
+            # Simulate printing with proof
+            logger.info(f"[API] POST /devices/{device_name}/job - Starting print job")
+            
+            file_url = params["file_url"]
+            
+            # Generate unique job ID and proof
+            job_id = str(uuid.uuid4())
+            job_proof = hashlib.sha256(f"{job_id}{tx_hash}{device.id}".encode()).hexdigest()[:16]
+            
+            # Local G-code keeps its name; unknown files get a synthesized one
+            if print_path:
+                filename = os.path.basename(print_path)
+            else:
+                timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+                filename = f"print_job_{timestamp}_{job_proof}.gcode"
+            
+            # Update printer state; progress is driven by the estimate
+            device.start_print(filename, print_estimate)
+            metering = _open_meter(site, device, filename, x_payer_address, print_estimate.duration_sec)
+            
+            # Add print job proof to response
+            result_data.update({
+                "job_id": job_id,
+                "job_proof": job_proof,
+                "file_name": filename,
+                "file_url": file_url,
+                "estimate": print_estimate.to_dict(device.material),
+                "metering": metering,
+                "message": f"Print job '{filename}' started successfully on {device.name}"
+            })
+            
+            logger.info(f"[API] POST /devices/{device_name}/job - Print job created: {job_id} ({filename})")
+            
+        elif action == "buy_filament":
+            # Simulate filament purchase
+            material_type = params["material_type"]
+            color = params["color"]
+            weight = params["weight_grams"]
+            
+            # Generate purchase ID
+            purchase_id = str(uuid.uuid4())
+            purchase_proof = hashlib.sha256(f"{purchase_id}{tx_hash}{device.id}".encode()).hexdigest()[:16]
+            
+            result_data.update({
+                "purchase_id": purchase_id,
+                "purchase_proof": purchase_proof,
+                "material_type": material_type,
+                "color": color,
+                "weight_grams": weight,
+                "message": f"Filament purchase successful: {weight}g of {material_type} ({color}) for {device.name}"
+            })
+            
+            logger.info(f"[API] POST /devices/{device_name}/job - Filament purchased: {purchase_id} ({material_type}, {color}, {weight}g)")
+            
+        elif action == "pause":
+            if hasattr(device, 'status') and device.status == "PRINTING":
+                device.status = "PAUSED"
+                result_data["message"] = f"Print job paused on {device.name}"
+                logger.info(f"[API] POST /devices/{device_name}/job - Print job paused")
+            else:
+                result_data["message"] = f"No active print job to pause on {device.name}"
+                logger.warning(f"[API] POST /devices/{device_name}/job - No active print to pause")
+                
+        elif action == "cancel":
+            if hasattr(device, 'status') and device.status in ["PRINTING", "PAUSED"]:
+                device.status = "IDLE"
+                if hasattr(device, 'progress_percent'):
+                    device.progress_percent = 0.0
+                if hasattr(device, 'current_file'):
+                    device.current_file = None
+                result_data["message"] = f"Print job cancelled on {device.name}"
+                logger.info(f"[API] POST /devices/{device_name}/job - Print job cancelled")
+            else:
+                result_data["message"] = f"No active print job to cancel on {device.name}"
+                logger.warning(f"[API] POST /devices/{device_name}/job - No active print to cancel")
+                
+    elif device.type == "ev_charger":
+        if action == "charge":
+            target_percent = float(params["target_percent"])
+            session = device.start_session(target_percent, tx_hash if requires_payment else None)
+            site.rebalance_chargers()
+            expected_sec = charge_duration_sec(
+                device.battery_percent, target_percent, device.battery_capacity_kwh,
+                device.max_power_kw, device.allocated_power_kw
+            )
+            metering = _open_meter(site, device, session.id, x_payer_address, expected_sec)
+            
+            result_data.update({
+                "session_id": session.id,
+                "target_percent": target_percent,
+                "allocated_power_kw": round(device.allocated_power_kw, 2),
+                "metering": metering,
+                "message": f"Charging session started on {device.name} (target: {target_percent:g}%)"
+            })
+            logger.info(f"[API] POST /devices/{device_name}/job - Starting charging session (target: {target_percent}%)")
+            
+        elif action == "stop":
+            if hasattr(device, 'status') and device.status == "CHARGING":
+                device.stop_session()
+                site.rebalance_chargers()
+                result_data.update({
+                    "session_id": device.session.id if device.session else None,
+                    "session_kwh": round(device.session.energy_kwh, 3) if device.session else 0.0,
+                    "message": f"Charging session stopped on {device.name}"
+                })
+                logger.info(f"[API] POST /devices/{device_name}/job - Charging session stopped")
+            else:
+                result_data["message"] = f"No active charging session to stop on {device.name}"
+                logger.warning(f"[API] POST /devices/{device_name}/job - No active charging to stop")
+    
+    elif device.type == "vending_machine":
+        if action == "dispense":
+            # Commit the reservation from the 402 quote, by id or by the
+            # caller's hold on the same order, or reserve and commit in one
+            # step if the client paid without one
+            reservation_id = params.get("reservation_id")
+            try:
+                if reservation_id and device.inventory.has_reservation(reservation_id):
+                    reservation = device.inventory.commit(reservation_id, order_items)
+                else:
+                    reservation = device.inventory.purchase(order_items, hold_owner)
+            except (InsufficientStockError, ReservationMismatchError) as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            except InventoryError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            device.last_dispensed = datetime.utcnow().isoformat()
+
+            items = [
+                {
+                    "slot": device.inventory.slot_names[index],
+                    "product_id": device.inventory.slot_products[index],
+                    "quantity": qty
+                }
+                for index, qty in reservation.lines
+            ]
+            product_id = items[0]["product_id"]
+            slot = items[0]["slot"]
+            
+            # Generate dispense ID
+            dispense_id = str(uuid.uuid4())
+            dispense_proof = hashlib.sha256(f"{dispense_id}{tx_hash}{device.id}".encode()).hexdigest()[:16]
+            
+            result_data.update({
+                "dispense_id": dispense_id,
+                "dispense_proof": dispense_proof,
+                "product_id": product_id,
+                "slot": slot,
+                "items": items,
+                "message": f"Product '{product_id}' dispensed successfully from {device.name}" + (f" (slot {slot})" if len(items) == 1 else f" (+{reservation.units - 1} more units)")
+            })
+            
+            logger.info(f"[API] POST /devices/{device_name}/job - Product dispensed: {dispense_id} ({product_id})")
+            
+        elif action == "restock":
+            # Simulate restocking
+            product_id = params["product_id"]
+            quantity = params["quantity"]
+            slot = params.get("slot")
+
+            try:
+                if slot is not None:
+                    index = device.inventory.slot_for(slot)
+                else:
+                    index = device.inventory.slot_for_product(product_id)
+                device.inventory.restock(index, quantity)
+            except InventoryError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            slot = device.inventory.slot_names[index]
+            product_id = device.inventory.slot_products[index] or product_id
+            
+            # Generate restock ID
+            restock_id = str(uuid.uuid4())
+            restock_proof = hashlib.sha256(f"{restock_id}{tx_hash}{device.id}".encode()).hexdigest()[:16]
+            
+            result_data.update({
+                "restock_id": restock_id,
+                "restock_proof": restock_proof,
+                "product_id": product_id,
+                "quantity": quantity,
+                "slot": slot,
+                "message": f"Restocked {quantity} units of '{product_id}' in {device.name}" + (f" (slot {slot})" if slot else "")
+            })
+            
+            logger.info(f"[API] POST /devices/{device_name}/job - Product restocked: {restock_id} ({product_id}, qty: {quantity})")
+
+    elif device.type == "security_camera":
+        if action == "view":
+            duration_sec = float(params["duration_sec"])
+            if device.privacy_mode:
+                raise HTTPException(status_code=409, detail=f"{device.name} is in privacy mode")
+
+            try:
+                session = stream_broker.open_session(device, x_payer_address, duration_sec, tx_hash)
+            except StreamCapacityError as e:
+                raise HTTPException(status_code=503, detail=str(e))
+            metering = _open_meter(site, device, session.id, x_payer_address, duration_sec)
+
+            result_data.update({
+                **session.to_dict(),
+                "stream_url": f"{site.path_prefix}/devices/{device_name}/stream?session_id={session.id}",
+                "metering": metering,
+                "message": f"Viewing session opened on {device.name} for {int(duration_sec)}s"
+            })
+            logger.info(f"[API] POST /devices/{device_name}/job - Stream session opened: {session.id}")
+    
+    if job_store:
+        result_data["receipt_id"] = job_store.record(
+            device.id, action, result_data, x_payer_address,
+            tx_hash if requires_payment else None, amount, receipt_id=receipt_id
+        )
+    return result_data
+
+async def _execute_voucher_job(
+    site: Site,
+    device: DeviceSimulator,
+    device_name: str,
+    action: str,
+    params: Dict[str, Any],
+    amount: str,
+    authorization: str,
+    order_items: Optional[List[Dict[str, Any]]],
+    print_path: Optional[str],
+    print_estimate: Optional[PrintEstimate],
+    expected_version: Optional[int],
+    hold_owner: Optional[str]
+) -> Dict[str, Any]:
+    try:
+        voucher = Voucher.parse(authorization)
+        channel = await channel_ledger.authorize(voucher, site.vendor_address)
+    except ValueError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    except PaymentError as e:
+        raise HTTPException(status_code=402, detail=str(e))
+
+    reference = f"voucher:{channel.id}:{voucher.cumulative_wei}"
+    price_wei = eth_to_wei(amount)
+
+    def transition():
+        previous = channel_ledger.charge(channel, voucher, price_wei)
+        try:
+            return _apply_job(
+                site, device, device_name, action, params, reference, True, amount,
+                channel.payer, order_items, print_path, print_estimate, hold_owner=hold_owner
+            )
+        except Exception:
+            channel_ledger.refund(channel, previous)
+            raise
+
+    try:
+        result_data = await site.mutator.apply(device, transition, expected_version)
+    except PaymentError as e:
+        raise HTTPException(status_code=402, detail=str(e))
+    except VersionConflictError as e:
+        raise HTTPException(status_code=412, detail=str(e))
+    # The accepted voucher is on disk before the payer sees the result
+    await channel_ledger.persist(channel)
+    result_data["channel"] = channel.to_dict()
+    logger.info(f"[API] POST /devices/{device_name}/job - Paid by voucher on {channel.id[:10]}... ({channel.accepted_wei} wei accepted)")
+    return result_data
+
 @app.post("/devices/{device_name}/job")
 async def execute_device_job(
     device_name: str,
     request: Request,
     job_request: Optional[JobRequest] = None,
-    authorization: Optional[str] = Header(None)
+    authorization: Optional[str] = Header(None),
+    x_payer_address: Optional[str] = Header(None),
+    if_match: Optional[str] = Header(None)
 ):
     """
     Device-Specific Job Execution: Execute actions on a specific device.
@@ -733,72 +1906,143 @@ async def execute_device_job(
     1. First request (no auth) -> Returns 402 Payment Required with device-specific payment details
     2. Client pays and gets transaction hash
     3. Second request (with tx hash in Authorization header) -> Verifies payment and executes action
+
+    With a payment channel open (POST /channels), step 2 is replaced by a
+    signed voucher: Authorization: Voucher <channel_id>:<cumulative_wei>:<signature>.
+
+    If-Match: <version> (from the device detail) runs the job only if the
+    device has not changed since; otherwise 412. The 402 quote returns the
+    current version (device_version, and the ETag header): a vending quote's
+    stock hold changes the device, so the paid retry must use that one. For payments verified in
+    the background (202) the check runs at release: a changed device fails
+    the job, with a refund note in its error.
     """
     logger.info(f"[API] POST /devices/{device_name}/job - Request received (auth: {bool(authorization)})")
     
     # Find device
+    site = _site()
     device_id = device_name.replace("_", "-")
-    device = device_map.get(device_id)
+    device = site.device_map.get(device_id)
     
     if not device:
         logger.warning(f"[API] POST /devices/{device_name}/job - Device not found")
         raise HTTPException(status_code=404, detail=f"Device '{device_name}' not found")
     
+    expected_version = None
+    if if_match:
+        try:
+            expected_version = int(if_match.strip('"'))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="If-Match must be a device version number")
+
     # Determine action and payment amount based on device type and action
     action = job_request.action if job_request and job_request.action else "default"
     
-    # Action-specific pricing
-    action_amounts = {
-        "smart_lock": {
-            "unlock": "0.001",
-            "lock": "0",  # Free
-            "default": "0.001"
-        },
-        "3d_printer": {
-            "print": "0.002",
-            "buy_filament": "0.003",
-            "pause": "0",  # Free
-            "cancel": "0",  # Free
-            "default": "0.002"
-        },
-        "ev_charger": {
-            "charge": "0.005",
-            "stop": "0",  # Free
-            "default": "0.005"
-        },
-        "vending_machine": {
-            "dispense": "0.003",
-            "restock": "0.004",
-            "default": "0.003"
-        },
-        "security_camera": {
-            "default": "0.001"
-        }
-    }
-    
-    device_actions = action_amounts.get(device.type, {})
-    amount = device_actions.get(action, device_actions.get("default", "0.001"))
+    # Params are checked against the action's schema before any quote,
+    # reservation or payment check
+    try:
+        params = validate_job_params(device.type, action, job_request.params if job_request else None)
+    except JobParamsError as e:
+        logger.warning(f"[API] POST /devices/{device_name}/job - Invalid params for '{action}': {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Action-specific pricing (the site's table)
+    amount = site.price(device.type, action)
     requires_payment = amount != "0"
+
+    # Vending orders are priced per unit, so resolve the items before quoting
+    order_items, hold_owner = None, None
+    if device.type == "vending_machine" and action == "dispense":
+        hold_owner = _hold_owner(request, x_payer_address)
+        order_items = _vending_order_items(device, params)
+        units = sum(item["quantity"] for item in order_items)
+        amount = str(Decimal(amount) * units)
+        # The price is for order_items, so an echoed reservation must hold
+        # exactly that order, quoted to this payer (or, for an anonymous
+        # quote, this client IP). Checked before any payment is taken
+        if params.get("reservation_id"):
+            try:
+                device.inventory.check_reservation(
+                    params["reservation_id"], order_items, {hold_owner, _hold_owner(request, None)}
+                )
+            except ReservationMismatchError as e:
+                logger.warning(f"[API] POST /devices/{device_name}/job - {str(e)}")
+                raise HTTPException(status_code=409, detail=str(e))
+            except InventoryError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+    # Print quotes carry the estimated duration and filament for the file
+    print_path, print_estimate = None, None
+    if device.type == "3d_printer" and action == "print":
+        print_path, print_estimate = await _estimate_print(params["file_url"])
     
     # Check if payment proof is provided (only for paid actions)
     if requires_payment and not authorization:
         # Step 1: Return 402 Payment Required (x402 protocol)
         logger.info(f"[API] POST /devices/{device_name}/job - No authorization, returning 402 Payment Required for action: {action}")
+        payment_details = {
+            "chainId": 11155111,  # Ethereum Sepolia
+            "chainName": "Ethereum Sepolia",
+            "token": "ETH",
+            "recipient": site.vendor_address,
+            "amount": amount,
+            "description": f"Execute {action} on {device.name}"
+        }
+
+        # Hold the stock while the buyer pays so the paid retry cannot oversell.
+        # Repeated quotes of one order extend the caller's hold, and the paid
+        # retry takes it over even without echoing reservation_id
+        if order_items is not None:
+            def reserve():
+                try:
+                    return device.inventory.reserve(
+                        order_items, RESERVATION_TTL_SEC, hold_owner, RESERVATION_MAX_PER_CLIENT
+                    )
+                except ReservationLimitError as e:
+                    # Quote without a hold rather than let one caller pin the stock
+                    logger.warning(f"[API] POST /devices/{device_name}/job - {str(e)}, quoting without a hold")
+                    return None
+                except InsufficientStockError as e:
+                    raise HTTPException(status_code=409, detail=str(e))
+                except InventoryError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+
+            reservation = await site.mutator.apply(device, reserve)
+            if reservation is not None:
+                payment_details["reservation_id"] = reservation.id
+                payment_details["reservation_expires_at"] = datetime.utcfromtimestamp(reservation.expires_at).isoformat() + "Z"
+                logger.info(f"[API] POST /devices/{device_name}/job - Reserved {reservation.units} units ({reservation.id})")
+
+        if print_estimate is not None:
+            payment_details["estimate"] = print_estimate.to_dict(device.material)
+
+        if channel_ledger:
+            payment_details["channel"] = {
+                "scheme": "voucher",
+                "amount_wei": str(eth_to_wei(amount)),
+                "open_url": f"{site.path_prefix}/channels"
+            }
+
+        # A stock hold is a device change: hand back the version the paid
+        # retry's If-Match must carry
         raise HTTPException(
             status_code=402,
             detail={
                 "error": "Payment Required",
-                "paymentDetails": {
-                    "chainId": 11155111,  # Ethereum Sepolia
-                    "chainName": "Ethereum Sepolia",
-                    "token": "ETH",
-                    "recipient": os.getenv("VENDOR_ADDRESS", "0x13EB37a124F98A76c973c3fce0F3FF829c7df57C"),
-                    "amount": amount,
-                    "description": f"Execute {action} on {device.name}"
-                }
-            }
+                "paymentDetails": payment_details,
+                "device_version": device.version
+            },
+            headers={"ETag": f'"{device.version}"'}
         )
     
+    # Payment channel voucher instead of a tx hash: verified off-chain and
+    # charged inside the device transition, so the job runs at once
+    if requires_payment and channel_ledger and Voucher.is_voucher(authorization):
+        return await _execute_voucher_job(
+            site, device, device_name, action, params, amount, authorization,
+            order_items, print_path, print_estimate, expected_version, hold_owner
+        )
+
     # For free actions, skip payment verification
     if not requires_payment:
         logger.info(f"[API] POST /devices/{device_name}/job - Free action '{action}', skipping payment verification")
@@ -823,186 +2067,50 @@ async def execute_device_job(
                 detail="Invalid payment proof. Transaction hash must be a valid hex string (0x...)"
             )
     
+    # Deferred verification: accept the job now and run it once the payment
+    # is PAYMENT_CONFIRMATIONS blocks deep
+    if requires_payment and payment_pipeline:
+        async def release(payment):
+            try:
+                return await site.mutator.apply(device, lambda: _apply_job(
+                    site, device, device_name, action, params, tx_hash, requires_payment, amount,
+                    x_payer_address, order_items, print_path, print_estimate, receipt_id=payment.job_id,
+                    hold_owner=hold_owner
+                ), expected_version)
+            except VersionConflictError as e:
+                # The job fails; the confirmed payment was not spent
+                raise PaymentError(f"Precondition failed: {str(e)}. The job did not run; transaction {tx_hash} is due a refund")
+
+        try:
+            payment = payment_pipeline.submit(tx_hash, site.vendor_address, amount, release)
+        except PaymentError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        logger.info(f"[API] POST /devices/{device_name}/job - Payment queued for verification, job {payment.job_id}")
+        return JSONResponse(status_code=202, content={
+            "success": True,
+            "job_id": payment.job_id,
+            "status": payment.status,
+            "transaction_hash": tx_hash,
+            "confirmations_required": payment_pipeline.confirmations,
+            "status_url": f"/jobs/{payment.job_id}"
+        })
+
     # Execute device-specific action
     try:
         logger.info(f"[API] POST /devices/{device_name}/job - Payment verified, executing action: {action}")
         
-        # Device-specific action execution
-        result_data = {
-            "success": True,
-            "message": f"Action '{action}' executed on {device.name} successfully",
-            "transaction_hash": tx_hash,
-            "device_status": device.get_detail()
-        }
-        
-        # Execute action based on device type and action
-        if device.type == "smart_lock":
-            if action == "unlock":
-                if hasattr(device, 'is_locked'):
-                    device.is_locked = False
-                if hasattr(device, 'last_unlocked_by'):
-                    device.last_unlocked_by = tx_hash[:10] + "..." if requires_payment else "manual"
-                if hasattr(device, 'auto_lock_timer_sec'):
-                    device.auto_lock_timer_sec = 300  # 5 minutes auto-lock
-                result_data["message"] = f"{device.name} unlocked successfully"
-                logger.info(f"[API] POST /devices/{device_name}/job - Device unlocked")
-            elif action == "lock":
-                if hasattr(device, 'is_locked'):
-                    device.is_locked = True
-                if hasattr(device, 'auto_lock_timer_sec'):
-                    device.auto_lock_timer_sec = 0
-                result_data["message"] = f"{device.name} locked manually"
-                logger.info(f"[API] POST /devices/{device_name}/job - Device locked")
-                
-        elif device.type == "3d_printer":
-            if action == "print":
-                # Simulate printing with proof
-                logger.info(f"[API] POST /devices/{device_name}/job - Starting print job")
-                
-                # Get file URL from params if provided
-                file_url = job_request.params.get("file_url", "default_document.gcode") if job_request and job_request.params else "default_document.gcode"
-                
-                # Generate unique job ID and proof
-                job_id = str(uuid.uuid4())
-                job_proof = hashlib.sha256(f"{job_id}{tx_hash}{device.id}".encode()).hexdigest()[:16]
-                
-                # Generate filename
-                timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-                filename = f"print_job_{timestamp}_{job_proof}.gcode"
-                
-                # Update printer state
-                if hasattr(device, 'status'):
-                    device.status = "PRINTING"
-                if hasattr(device, 'current_file'):
-                    device.current_file = filename
-                if hasattr(device, 'progress_percent'):
-                    device.progress_percent = 0.0  # Start at 0%
-                
-                # Add print job proof to response
-                result_data.update({
-                    "job_id": job_id,
-                    "job_proof": job_proof,
-                    "file_name": filename,
-                    "file_url": file_url,
-                    "message": f"Print job '{filename}' started successfully on {device.name}"
-                })
-                
-                logger.info(f"[API] POST /devices/{device_name}/job - Print job created: {job_id} ({filename})")
-                
-            elif action == "buy_filament":
-                # Simulate filament purchase
-                material_type = job_request.params.get("material_type", "PLA") if job_request and job_request.params else "PLA"
-                color = job_request.params.get("color", "black") if job_request and job_request.params else "black"
-                weight = job_request.params.get("weight_grams", 1000) if job_request and job_request.params else 1000
-                
-                # Generate purchase ID
-                purchase_id = str(uuid.uuid4())
-                purchase_proof = hashlib.sha256(f"{purchase_id}{tx_hash}{device.id}".encode()).hexdigest()[:16]
-                
-                result_data.update({
-                    "purchase_id": purchase_id,
-                    "purchase_proof": purchase_proof,
-                    "material_type": material_type,
-                    "color": color,
-                    "weight_grams": weight,
-                    "message": f"Filament purchase successful: {weight}g of {material_type} ({color}) for {device.name}"
-                })
-                
-                logger.info(f"[API] POST /devices/{device_name}/job - Filament purchased: {purchase_id} ({material_type}, {color}, {weight}g)")
-                
-            elif action == "pause":
-                if hasattr(device, 'status') and device.status == "PRINTING":
-                    device.status = "PAUSED"
-                    result_data["message"] = f"Print job paused on {device.name}"
-                    logger.info(f"[API] POST /devices/{device_name}/job - Print job paused")
-                else:
-                    result_data["message"] = f"No active print job to pause on {device.name}"
-                    logger.warning(f"[API] POST /devices/{device_name}/job - No active print to pause")
-                    
-            elif action == "cancel":
-                if hasattr(device, 'status') and device.status in ["PRINTING", "PAUSED"]:
-                    device.status = "IDLE"
-                    if hasattr(device, 'progress_percent'):
-                        device.progress_percent = 0.0
-                    if hasattr(device, 'current_file'):
-                        device.current_file = None
-                    result_data["message"] = f"Print job cancelled on {device.name}"
-                    logger.info(f"[API] POST /devices/{device_name}/job - Print job cancelled")
-                else:
-                    result_data["message"] = f"No active print job to cancel on {device.name}"
-                    logger.warning(f"[API] POST /devices/{device_name}/job - No active print to cancel")
-                    
-        elif device.type == "ev_charger":
-            if action == "charge":
-                # Simulate charging start
-                if hasattr(device, 'status'):
-                    device.status = "CHARGING"
-                if hasattr(device, 'vehicle_connected'):
-                    device.vehicle_connected = True
-                target_percent = job_request.params.get("target_percent", 100) if job_request and job_request.params else 100
-                
-                result_data.update({
-                    "target_percent": target_percent,
-                    "message": f"Charging session started on {device.name} (target: {target_percent}%)"
-                })
-                logger.info(f"[API] POST /devices/{device_name}/job - Starting charging session (target: {target_percent}%)")
-                
-            elif action == "stop":
-                if hasattr(device, 'status') and device.status == "CHARGING":
-                    device.status = "COMPLETE"
-                    if hasattr(device, 'current_power_kw'):
-                        device.current_power_kw = 0.0
-                    result_data["message"] = f"Charging session stopped on {device.name}"
-                    logger.info(f"[API] POST /devices/{device_name}/job - Charging session stopped")
-                else:
-                    result_data["message"] = f"No active charging session to stop on {device.name}"
-                    logger.warning(f"[API] POST /devices/{device_name}/job - No active charging to stop")
-        
-        elif device.type == "vending_machine":
-            if action == "dispense":
-                # Simulate product dispensing
-                product_id = job_request.params.get("product_id", "unknown") if job_request and job_request.params else "unknown"
-                slot = job_request.params.get("slot") if job_request and job_request.params else None
-                
-                # Generate dispense ID
-                dispense_id = str(uuid.uuid4())
-                dispense_proof = hashlib.sha256(f"{dispense_id}{tx_hash}{device.id}".encode()).hexdigest()[:16]
-                
-                result_data.update({
-                    "dispense_id": dispense_id,
-                    "dispense_proof": dispense_proof,
-                    "product_id": product_id,
-                    "slot": slot,
-                    "message": f"Product '{product_id}' dispensed successfully from {device.name}" + (f" (slot {slot})" if slot else "")
-                })
-                
-                logger.info(f"[API] POST /devices/{device_name}/job - Product dispensed: {dispense_id} ({product_id})")
-                
-            elif action == "restock":
-                # Simulate restocking
-                product_id = job_request.params.get("product_id", "unknown") if job_request and job_request.params else "unknown"
-                quantity = job_request.params.get("quantity", 1) if job_request and job_request.params else 1
-                slot = job_request.params.get("slot") if job_request and job_request.params else None
-                
-                # Generate restock ID
-                restock_id = str(uuid.uuid4())
-                restock_proof = hashlib.sha256(f"{restock_id}{tx_hash}{device.id}".encode()).hexdigest()[:16]
-                
-                result_data.update({
-                    "restock_id": restock_id,
-                    "restock_proof": restock_proof,
-                    "product_id": product_id,
-                    "quantity": quantity,
-                    "slot": slot,
-                    "message": f"Restocked {quantity} units of '{product_id}' in {device.name}" + (f" (slot {slot})" if slot else "")
-                })
-                
-                logger.info(f"[API] POST /devices/{device_name}/job - Product restocked: {restock_id} ({product_id}, qty: {quantity})")
-        
-        device.update()
+        result_data = await site.mutator.apply(device, lambda: _apply_job(
+            site, device, device_name, action, params, tx_hash, requires_payment, amount,
+            x_payer_address, order_items, print_path, print_estimate, hold_owner=hold_owner
+        ), expected_version)
         
         logger.info(f"[API] POST /devices/{device_name}/job - Action executed successfully")
         return result_data
+    except VersionConflictError as e:
+        logger.info(f"[API] POST /devices/{device_name}/job - Version conflict: {str(e)}")
+        raise HTTPException(status_code=412, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"[API] POST /devices/{device_name}/job - Exception: {str(e)}")
         raise HTTPException(
@@ -0,0 +1,271 @@
+"""
+Usage Metering
+Per-minute billing for time-based sessions (printing, charging, viewing) against prepaid balances
+"""
+
+import array
+import itertools
+import logging
+import operator
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from models import DeviceSimulator
+
+logger = logging.getLogger(__name__)
+
+METER_CURRENCY = "USDC"
+
+# A new session on these types replaces the running one; a camera serves
+# several metered viewers at once
+EXCLUSIVE_TYPES = {"3d_printer", "ev_charger"}
+
+# Scheduler wake-ups may land a hair before the computed exhaustion time
+DEADLINE_SLACK_SEC = 1e-3
+
+
+def _running(device: DeviceSimulator, ref: str) -> bool:
+    """Whether the device is still doing the work a session meters."""
+    if device.type == "3d_printer":
+        return device.status == "PRINTING"
+    if device.type == "ev_charger":
+        return device.status == "CHARGING" and device.session is not None and device.session.id == ref
+    if device.type == "security_camera":
+        return device.viewers is not None and ref in device.viewers.sessions
+    return False
+
+
+def _stop(device: DeviceSimulator, ref: str):
+    """Halt the metered work once its balance is spent."""
+    if device.type == "3d_printer":
+        device.status = "PAUSED"
+    elif device.type == "ev_charger":
+        device.stop_session()
+    elif device.type == "security_camera":
+        device.viewers.remove(ref)
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.utcfromtimestamp(ts).isoformat() + "Z" if ts is not None else None
+
+
+class MeterSession:
+    def __init__(self, meter: "Meter", device: DeviceSimulator, ref: str, payer: Optional[str],
+                 rate_per_min: float, prepaid: float):
+        self.id = str(uuid.uuid4())
+        self.meter = meter
+        self.device = device
+        self.ref = ref
+        self.payer = payer
+        self.rate_per_min = rate_per_min
+        self.prepaid = prepaid
+        self.started_at = time.time()
+        self.ended_at: Optional[float] = None
+        self.end_reason: Optional[str] = None
+        # Row in the meter's columns while open; final figure once closed
+        self.row: Optional[int] = None
+        self.accrued = 0.0
+        # time.monotonic() at which the prepaid balance runs out
+        self.deadline = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self.row is not None
+
+    def usage(self, now: Optional[float] = None) -> Dict[str, Any]:
+        accrued = self.meter.accrued(self, now) if self.active else self.accrued
+        return {
+            "session_id": self.id,
+            "device_id": self.device.id,
+            "ref": self.ref,
+            "payer": self.payer,
+            "rate_per_min": self.rate_per_min,
+            "currency": METER_CURRENCY,
+            "prepaid": round(self.prepaid, 6),
+            "accrued": round(accrued, 6),
+            "balance": round(max(0.0, self.prepaid - accrued), 6),
+            "elapsed_sec": round((self.ended_at or time.time()) - self.started_at, 1),
+            "started_at": _iso(self.started_at),
+            "ended_at": _iso(self.ended_at),
+            "end_reason": self.end_reason
+        }
+
+
+class Meter:
+    """
+    Open metering sessions for one site, accrued on the scheduler tick.
+
+    Rates (per second), balances, accrued totals and last-accrual times live
+    in parallel array columns holding only the open sessions: closing one
+    moves the last row into its slot. Each tick accrues every row in one
+    pass of C-level maps over the columns, so its cost follows the number of
+    open sessions, never the fleet size.
+
+    A session's exhaustion time is also set as its device's scheduler
+    deadline, so the device is stopped when the balance runs out rather than
+    at the next tick. Sessions close on their own when the device stops the
+    metered work (print done, charge target reached, viewer expired).
+    """
+
+    def __init__(self, scheduler, on_stop: Optional[Callable[[DeviceSimulator], None]] = None,
+                 history: int = 500):
+        self.scheduler = scheduler
+        self.on_stop = on_stop
+        self._sessions: List[MeterSession] = []
+        self._rate = array.array("d")
+        self._balance = array.array("d")
+        self._accrued = array.array("d")
+        self._last = array.array("d")
+        self.by_id: Dict[str, MeterSession] = {}
+        self.ended: deque = deque(maxlen=history)
+        self._watched = set()
+        self.accruals = 0
+        scheduler.on_event(self.on_event)
+        scheduler.on_tick(self.accrue)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def open(self, device: DeviceSimulator, ref: str, payer: Optional[str], prepaid: float,
+             rate_per_min: Optional[float] = None) -> MeterSession:
+        """Start metering `ref` (print file, charging or viewing session id) on the device."""
+        rate_per_min = device.PRICE_PER_MIN if rate_per_min is None else rate_per_min
+        if not rate_per_min or rate_per_min <= 0:
+            raise ValueError(f"{device.type} is not metered")
+        if prepaid <= 0:
+            raise ValueError("prepaid balance must be positive")
+        if device.type in EXCLUSIVE_TYPES:
+            for previous in list(device.meter_sessions):
+                self.close(previous, "replaced")
+
+        session = MeterSession(self, device, ref, payer, rate_per_min, prepaid)
+        now = time.monotonic()
+        rate = rate_per_min / 60.0
+        session.row = len(self._sessions)
+        session.deadline = now + prepaid / rate
+        self._sessions.append(session)
+        self._rate.append(rate)
+        self._balance.append(prepaid)
+        self._accrued.append(0.0)
+        self._last.append(now)
+        self.by_id[session.id] = session
+
+        device.meter_sessions.append(session)
+        self._set_deadline(device)
+        if device.id not in self._watched:
+            self._watched.add(device.id)
+            device.add_observer(self._device_changed)
+        self.scheduler.schedule(device)
+        logger.info(f"[METER] Session {session.id} on {device.id}: {rate_per_min:g} {METER_CURRENCY}/min, {prepaid:g} prepaid")
+        return session
+
+    def get(self, session_id: str) -> Optional[MeterSession]:
+        session = self.by_id.get(session_id)
+        if session is None:
+            session = next((s for s in self.ended if s.id == session_id), None)
+        return session
+
+    def accrued(self, session: MeterSession, now: Optional[float] = None) -> float:
+        """Accrued cost of an open session up to now, between ticks included."""
+        row = session.row
+        elapsed = (now if now is not None else time.monotonic()) - self._last[row]
+        return self._accrued[row] + min(self._rate[row] * max(0.0, elapsed), self._balance[row])
+
+    def _accrue_row(self, row: int, now: float):
+        cost = min(self._rate[row] * max(0.0, now - self._last[row]), self._balance[row])
+        self._accrued[row] += cost
+        self._balance[row] -= cost
+        self._last[row] = now
+
+    def accrue(self, now: Optional[float] = None) -> int:
+        """Tick hook: accrue every open session up to now, stop exhausted ones."""
+        n = len(self._sessions)
+        if not n:
+            return 0
+        now = now if now is not None else time.monotonic()
+        elapsed = map(operator.sub, itertools.repeat(now, n), self._last)
+        cost = array.array("d", map(operator.mul, self._rate, elapsed))
+        self._accrued = array.array("d", map(operator.add, self._accrued, cost))
+        self._balance = array.array("d", map(operator.sub, self._balance, cost))
+        self._last = array.array("d", [now]) * n
+        self.accruals += n
+
+        # Overdrawn rows are charged only what was left; normally the
+        # deadline wake-up got there first
+        spent_rows = list(itertools.compress(range(n), map(operator.le, self._balance, itertools.repeat(0.0, n))))
+        for row in spent_rows:
+            self._accrued[row] += self._balance[row]
+            self._balance[row] = 0.0
+        spent = [self._sessions[row] for row in spent_rows]
+        for session in spent:
+            if session.active:
+                self._exhaust(session.device, [session])
+                self.scheduler.schedule(session.device)
+        return n
+
+    def close(self, session: MeterSession, reason: str):
+        row = session.row
+        if row is None:
+            return
+        self._accrue_row(row, time.monotonic())
+        session.accrued = self._accrued[row]
+
+        last = len(self._sessions) - 1
+        if row != last:
+            moved = self._sessions[last]
+            self._sessions[row] = moved
+            for column in (self._rate, self._balance, self._accrued, self._last):
+                column[row] = column[last]
+            moved.row = row
+        self._sessions.pop()
+        for column in (self._rate, self._balance, self._accrued, self._last):
+            column.pop()
+
+        session.row = None
+        session.ended_at = time.time()
+        session.end_reason = reason
+        del self.by_id[session.id]
+        self.ended.append(session)
+        device = session.device
+        device.meter_sessions.remove(session)
+        self._set_deadline(device)
+        logger.info(f"[METER] Session {session.id} on {device.id} {reason}: {session.accrued:.6f} {METER_CURRENCY}")
+
+    def _set_deadline(self, device: DeviceSimulator):
+        device.deadline = min((s.deadline for s in device.meter_sessions), default=None)
+
+    def _device_changed(self, device: DeviceSimulator):
+        # Observer: only settles sessions whose work ended, never mutates the device
+        for session in list(device.meter_sessions):
+            if not _running(device, session.ref):
+                self.close(session, "ended")
+
+    def on_event(self, device: DeviceSimulator):
+        """Scheduler wake-up: stop sessions whose balance ran out."""
+        if not device.meter_sessions:
+            return
+        now = time.monotonic()
+        spent = [s for s in device.meter_sessions if now >= s.deadline - DEADLINE_SLACK_SEC]
+        if spent:
+            self._exhaust(device, spent)
+
+    def _exhaust(self, device: DeviceSimulator, sessions: List[MeterSession]):
+        for session in sessions:
+            self.close(session, "exhausted")
+            _stop(device, session.ref)
+        device.update()
+        if self.on_stop is not None:
+            self.on_stop(device)
+
+    def summary(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "active_sessions": len(self._sessions),
+            "rate_per_min": round(sum(self._rate) * 60.0, 6),
+            "accrued": round(sum((self.accrued(s, now) for s in self._sessions), 0.0), 6),
+            "currency": METER_CURRENCY,
+            "accruals": self.accruals
+        }
@@ -1,8 +1,12 @@
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Callable
 import random
 import time
 from datetime import datetime
+from inventory import SlotInventory
+from charging import ChargingSession, power_demand_kw, next_power_step_percent
+from gcode import PrintEstimate
+from camera_streams import CAMERA_BASE_MBPS, VIEWER_MBPS
 
 # --- Base Models ---
 
@@ -21,23 +25,100 @@ class DeviceSummary(DeviceCommon):
 
 class DeviceDetail(DeviceCommon):
     last_updated: str
+    version: int = 0
     payment_config: Optional[Dict[str, Any]] = None
     telemetry: Dict[str, Any]
 
 # --- Simulation Logic Classes ---
 
 class DeviceSimulator:
+    # (attribute, column kind) pairs persisted by snapshots.FleetSnapshotter.
+    # Kinds: "d" float, "q" int, "?" bool, "s" optional string, "j" JSON value.
+    SNAPSHOT_FIELDS: Tuple[Tuple[str, str], ...] = ()
+    # Metered price while a session runs (metering.Meter); None when the
+    # device is only paid per action
+    PRICE_PER_MIN: Optional[float] = None
+
     def __init__(self, id: str, name: str, type: str, ens_domain: str):
         self.id = id
         self.name = name
         self.type = type
         self.ens_domain = ens_domain
         self.last_updated = datetime.utcnow()
+        self.snapshot_dirty = True
+        self._observers: List[Callable[["DeviceSimulator"], None]] = []
+        self._last_tick = time.monotonic()
+        self._changed = False
+        # Bumped on every observable change; clients compare-and-set on it
+        self.version = 0
+        # Open metering sessions, and the monotonic time the scheduler must
+        # wake the device by for the earliest prepaid balance to run out
+        self.meter_sessions: List[Any] = []
+        self.deadline: Optional[float] = None
     
-    def update(self):
+    def sync(self, now: Optional[float] = None):
+        """
+        Lazily advance the simulation to `now` (time.monotonic() seconds).
+        Observers are notified only when a discrete change happened (status
+        string, or a subclass calling mark_changed()).
+        """
+        if self._advance(now if now is not None else time.monotonic()):
+            self.notify_changed()
+
+    def _advance(self, now: float) -> bool:
+        """Integrate up to `now`; True if a discrete change happened."""
+        dt = now - self._last_tick
+        if dt <= 0:
+            return False
+        self._last_tick = now
+        status = self._get_status_string()
         self.last_updated = datetime.utcnow()
+        self._simulate(dt)
+        changed = self._changed or self._get_status_string() != status
+        self._changed = False
+        return changed
+
+    def update(self):
+        """Advance to now and notify observers once (used after a job mutates state)."""
+        self._advance(time.monotonic())
+        self._changed = False
+        self.notify_changed()
+
+    def mark_changed(self):
+        """Flag a discrete change inside _simulate() that observers must see."""
+        self._changed = True
+
+    def next_event_in(self) -> Optional[float]:
+        """
+        Seconds until this device's next discrete state change (timer expiry,
+        job completion...), or None when it is idle. The event scheduler only
+        wakes a device at these times; everything in between is computed
+        lazily by sync().
+        """
+        return None
+
+    def add_observer(self, callback: Callable[["DeviceSimulator"], None]):
+        self._observers.append(callback)
+
+    def remove_observer(self, callback: Callable[["DeviceSimulator"], None]):
+        if callback in self._observers:
+            self._observers.remove(callback)
+
+    def notify_changed(self):
+        """Tell observers (indexes, caches) that this device's state changed."""
+        self.version += 1
+        # Reads only integrate continuous state; checkpoints sync and save
+        # active devices themselves (FleetSnapshotter.collect)
+        self.snapshot_dirty = True
+        for callback in self._observers:
+            callback(self)
+
+    def stocked_products(self) -> frozenset:
+        """Products this device currently has in stock (for the fleet index)."""
+        return frozenset()
 
     def get_status_summary(self) -> Dict[str, Any]:
+        self.sync()
         return {
             "id": self.id,
             "name": self.name,
@@ -48,31 +129,57 @@ class DeviceSimulator:
         }
 
     def get_detail(self) -> Dict[str, Any]:
+        self.sync()
+        telemetry = self._get_telemetry()
+        if self.meter_sessions:
+            telemetry["metering"] = [s.usage() for s in self.meter_sessions]
         return {
             "id": self.id,
             "name": self.name,
             "type": self.type,
             "ens_domain": self.ens_domain,
             "last_updated": self.last_updated.isoformat() + "Z",
+            "version": self.version,
             "payment_config": self._get_payment_config(),
-            "telemetry": self._get_telemetry()
+            "telemetry": telemetry
         }
 
+    def _simulate(self, dt: float):
+        """Advance the simulation by dt seconds of wall time."""
+        pass
+
     def _get_status_string(self) -> str:
         return "UNKNOWN"
 
     def _get_payment_config(self) -> Optional[Dict[str, Any]]:
-        return None
+        if self.PRICE_PER_MIN is None:
+            return None
+        return {
+            "price_per_min": self.PRICE_PER_MIN,
+            "currency": "USDC"
+        }
 
     def _get_telemetry(self) -> Dict[str, Any]:
         return {}
 
 
 class EVStation(DeviceSimulator):
-    def __init__(self):
-        super().__init__("ev-station-01", "Tesla Supercharger - Centro", "ev_charger", "evcharger.eth")
+    SNAPSHOT_FIELDS = (
+        ("status", "s"),
+        ("vehicle_connected", "?"),
+        ("current_power_kw", "d"),
+        ("total_energy_delivered_kwh", "d"),
+        ("battery_percent", "d"),
+        ("estimated_time_remaining_min", "d"),
+        ("session_state", "j"),
+    )
+    PRICE_PER_MIN = 0.05
+
+    def __init__(self, id: str = "ev-station-01", name: str = "Tesla Supercharger - Centro", ens_domain: str = "evcharger.eth"):
+        super().__init__(id, name, "ev_charger", ens_domain)
         self.max_power_kw = 22.0
         self.connector_type = "Type 2 (Mennekes)"
+        self.battery_capacity_kwh = 75.0
         
         # Dynamic state
         self.status = "CHARGING" # AVAILABLE | CHARGING | COMPLETE | FAULT
@@ -81,21 +188,81 @@ class EVStation(DeviceSimulator):
         self.total_energy_delivered_kwh = 45.2
         self.battery_percent = 78
         self.estimated_time_remaining_min = 45
-
-    def update(self):
-        super().update()
+        # Set by the site load balancer each tick; defaults to the full rating
+        self.allocated_power_kw = self.max_power_kw
+        self.session: Optional[ChargingSession] = ChargingSession(id, 100)
+
+    @property
+    def session_state(self) -> Optional[Dict[str, Any]]:
+        return self.session.to_dict() if self.session else None
+
+    @session_state.setter
+    def session_state(self, data: Optional[Dict[str, Any]]):
+        self.session = ChargingSession.from_dict(data) if data else None
+
+    def power_demand_kw(self) -> float:
+        if self.status != "CHARGING" or not self.session:
+            return 0.0
+        return power_demand_kw(self.max_power_kw, self.battery_percent)
+
+    def set_allocation(self, allocated_kw: float):
+        """Apply the site balancer's grant (call sync() first)."""
+        self.allocated_power_kw = allocated_kw
         if self.status == "CHARGING":
-            # Simulate power fluctuation
-            self.current_power_kw = 18.0 + random.uniform(-0.5, 0.5)
-            # Simulate energy delivery
-            self.total_energy_delivered_kwh += (self.current_power_kw / 3600) * 5 # assuming 5 sec update
-            # Simulate battery charging
-            if self.battery_percent < 100:
-                self.battery_percent += 0.1
-            else:
-                self.status = "COMPLETE"
-                self.current_power_kw = 0.0
-                self.estimated_time_remaining_min = 0
+            self.current_power_kw = min(self.power_demand_kw(), allocated_kw)
+
+    def next_event_in(self) -> Optional[float]:
+        # Next stop: the session target, or the next taper step where the
+        # accepted power changes
+        if self.status != "CHARGING" or not self.session or self.current_power_kw <= 0:
+            return None
+        checkpoint = next_power_step_percent(self.battery_percent, min(100.0, self.session.target_percent))
+        kwh = max(0.0, (checkpoint - self.battery_percent) / 100.0 * self.battery_capacity_kwh)
+        return kwh / self.current_power_kw * 3600.0
+
+    def start_session(self, target_percent: float, tx_hash: Optional[str] = None) -> ChargingSession:
+        if self.session and self.session.active:
+            self.session.end()
+        self.session = ChargingSession(self.id, target_percent, tx_hash)
+        self.status = "CHARGING"
+        self.vehicle_connected = True
+        self.current_power_kw = 0.0
+        return self.session
+
+    def stop_session(self):
+        if self.session:
+            self.session.end()
+        self.status = "COMPLETE"
+        self.current_power_kw = 0.0
+        self.estimated_time_remaining_min = 0
+
+    def _simulate(self, dt: float):
+        if self.status != "CHARGING" or not self.session:
+            return
+
+        # The draw since the last tick was current_power_kw (piecewise
+        # constant between ticks), so integrate that over the real dt
+        target = min(100.0, self.session.target_percent)
+        needed_kwh = max(0.0, (target - self.battery_percent) / 100.0 * self.battery_capacity_kwh)
+        energy_kwh = min(self.current_power_kw * dt / 3600.0, needed_kwh)
+
+        self.total_energy_delivered_kwh += energy_kwh
+        self.session.energy_kwh += energy_kwh
+        self.battery_percent += energy_kwh / self.battery_capacity_kwh * 100.0
+
+        if self.battery_percent >= target - 1e-9:
+            self.battery_percent = target
+            self.stop_session()
+            return
+
+        # Draw for the next interval: what the car accepts, capped by the site
+        power_kw = min(self.power_demand_kw(), self.allocated_power_kw)
+        if power_kw != self.current_power_kw:
+            self.mark_changed()  # Taper step: site power totals move
+        self.current_power_kw = power_kw
+        remaining_kwh = needed_kwh - energy_kwh
+        if self.current_power_kw > 0:
+            self.estimated_time_remaining_min = remaining_kwh / self.current_power_kw * 60.0
 
     def _get_status_string(self) -> str:
         return self.status
@@ -105,15 +272,37 @@ class EVStation(DeviceSimulator):
             "status": self.status,
             "vehicle_connected": self.vehicle_connected,
             "current_power_kw": round(self.current_power_kw, 2),
-            "session_kwh": round(self.total_energy_delivered_kwh, 2), # Using total as session for simplicity
+            "allocated_power_kw": round(self.allocated_power_kw, 2),
+            "session_kwh": round(self.session.energy_kwh, 2) if self.session else 0.0,
+            "total_energy_delivered_kwh": round(self.total_energy_delivered_kwh, 2),
+            "estimated_time_remaining_min": int(self.estimated_time_remaining_min),
+            "session": {
+                "id": self.session.id,
+                "target_percent": self.session.target_percent,
+                "started_at": self.session.started_at,
+                "ended_at": self.session.ended_at
+            } if self.session else None,
             "battery_simulation": {
                 "percent": int(self.battery_percent)
             }
         }
 
 class Printer3D(DeviceSimulator):
-    def __init__(self):
-        super().__init__("printer-3d-01", "Prusa Lab", "3d_printer", "3dprinter.eth")
+    SNAPSHOT_FIELDS = (
+        ("status", "s"),
+        ("progress_percent", "d"),
+        ("nozzle_temp_c", "d"),
+        ("bed_temp_c", "d"),
+        ("current_file", "s"),
+        ("time_remaining_sec", "d"),
+        ("print_duration_sec", "d"),
+        ("print_elapsed_sec", "d"),
+        ("filament_g", "d"),
+    )
+    PRICE_PER_MIN = 0.10
+
+    def __init__(self, id: str = "printer-3d-01", name: str = "Prusa Lab", ens_domain: str = "3dprinter.eth"):
+        super().__init__(id, name, "3d_printer", ens_domain)
         self.model = "Prusa i3 MK3S"
         self.material = "PLA"
         self.nozzle_diameter = 0.4
@@ -125,36 +314,55 @@ class Printer3D(DeviceSimulator):
         self.bed_temp_c = 60.0
         self.current_file = "benchy_boat.gcode"
         self.time_remaining_sec = 1240
-
-    def update(self):
-        super().update()
+        # Progress is elapsed / estimated duration of the current job
+        self.print_duration_sec = 2275.0
+        self.print_elapsed_sec = 1035.0
+        self.filament_g = 0.0
+
+    def start_print(self, filename: str, estimate: PrintEstimate):
+        self.status = "PRINTING"
+        self.current_file = filename
+        self.progress_percent = 0.0
+        self.print_duration_sec = max(1.0, estimate.duration_sec)
+        self.print_elapsed_sec = 0.0
+        self.time_remaining_sec = self.print_duration_sec
+        self.filament_g = estimate.filament_g(self.material)
+
+    # Passive cooling rate once a print finishes (C/s)
+    COOLING_RATE_C_S = 1.0
+
+    def _simulate(self, dt: float):
         if self.status == "PRINTING":
             # Thermal noise
             self.nozzle_temp_c = 210.0 + random.uniform(-0.5, 0.5)
             self.bed_temp_c = 60.0 + random.uniform(-0.2, 0.2)
             
             # Progress
-            if self.progress_percent < 100:
-                self.progress_percent += 0.5
-                self.time_remaining_sec = max(0, self.time_remaining_sec - 5)
-            else:
+            overrun = max(0.0, self.print_elapsed_sec + dt - self.print_duration_sec)
+            self.print_elapsed_sec = min(self.print_duration_sec, self.print_elapsed_sec + dt)
+            self.progress_percent = self.print_elapsed_sec / self.print_duration_sec * 100.0
+            self.time_remaining_sec = self.print_duration_sec - self.print_elapsed_sec
+            if self.print_elapsed_sec >= self.print_duration_sec:
                 self.status = "COOLING"
+                # Time past completion is spent cooling
+                dt = overrun
 
-        elif self.status == "COOLING":
-            self.nozzle_temp_c = max(25, self.nozzle_temp_c - 5)
+        if self.status == "COOLING":
+            self.nozzle_temp_c = max(25, self.nozzle_temp_c - self.COOLING_RATE_C_S * dt)
             if self.nozzle_temp_c < 50:
                 self.status = "IDLE"
                 self.progress_percent = 0
 
+    def next_event_in(self) -> Optional[float]:
+        if self.status == "PRINTING":
+            return max(0.0, self.print_duration_sec - self.print_elapsed_sec)
+        if self.status == "COOLING":
+            return max(0.0, (self.nozzle_temp_c - 50) / self.COOLING_RATE_C_S) + 0.01
+        return None
+
     def _get_status_string(self) -> str:
         return self.status
 
-    def _get_payment_config(self) -> Optional[Dict[str, Any]]:
-        return {
-            "price_per_min": 0.10,
-            "currency": "USDC"
-        }
-
     def _get_telemetry(self) -> Dict[str, Any]:
         return {
             "status": self.status,
@@ -162,13 +370,23 @@ class Printer3D(DeviceSimulator):
             "nozzle_temp_c": round(self.nozzle_temp_c, 1),
             "bed_temp_c": round(self.bed_temp_c, 1),
             "current_file": self.current_file,
-            "time_remaining_sec": int(self.time_remaining_sec)
+            "time_remaining_sec": int(self.time_remaining_sec),
+            "estimated_duration_sec": int(self.print_duration_sec),
+            "filament_g": round(self.filament_g, 1)
         }
 
 class SmartLock(DeviceSimulator):
-    def __init__(self):
-        super().__init__("smart-lock-01", "Main Door - Room 402", "smart_lock", "smartlock.eth")
-        self.location = "Main Door - Room 402"
+    SNAPSHOT_FIELDS = (
+        ("is_locked", "?"),
+        ("battery_level", "d"),
+        ("last_unlocked_by", "s"),
+        ("auto_lock_timer_sec", "d"),
+        ("access_log_count", "q"),
+    )
+
+    def __init__(self, id: str = "smart-lock-01", name: str = "Main Door - Room 402", ens_domain: str = "smartlock.eth"):
+        super().__init__(id, name, "smart_lock", ens_domain)
+        self.location = name
         self.model = "August Wi-Fi Smart Lock Gen 4"
         
         # Dynamic state
@@ -177,18 +395,42 @@ class SmartLock(DeviceSimulator):
         self.last_unlocked_by = "0x123...abc"
         self.auto_lock_timer_sec = 0
         self.access_log_count = 12
+        # access_log.LockAccessLog, attached by the API when logging is enabled
+        self.access_log = None
 
-    def update(self):
-        super().update()
+    def record_access(self, action: str, who: Optional[str], tx_hash: Optional[str] = None):
+        """Count an access event and append it to the lock's audit log."""
+        self.access_log_count += 1
+        if self.access_log is not None:
+            self.access_log.append(action, who, tx_hash)
+
+    # Battery drain (% per second)
+    BATTERY_DRAIN_PER_SEC = 0.0002
+    # Below this the lock counts as low-battery in fleet aggregates
+    LOW_BATTERY_PERCENT = 20.0
+
+    def _simulate(self, dt: float):
         # Battery drain
-        self.battery_level = max(0, self.battery_level - 0.001)
+        was_low = self.battery_level < self.LOW_BATTERY_PERCENT
+        self.battery_level = max(0, self.battery_level - self.BATTERY_DRAIN_PER_SEC * dt)
+        if not was_low and self.battery_level < self.LOW_BATTERY_PERCENT:
+            self.mark_changed()
         
         if not self.is_locked:
-            if self.auto_lock_timer_sec > 0:
-                self.auto_lock_timer_sec -= 5
-            else:
+            self.auto_lock_timer_sec = max(0, self.auto_lock_timer_sec - dt)
+            if self.auto_lock_timer_sec <= 0:
                 self.is_locked = True
                 self.auto_lock_timer_sec = 0
+                self.record_access("auto_lock", "auto")
+
+    def next_event_in(self) -> Optional[float]:
+        # Auto-lock expiry, or the battery crossing into low-battery
+        low_battery_in = None
+        if self.battery_level >= self.LOW_BATTERY_PERCENT:
+            low_battery_in = (self.battery_level - self.LOW_BATTERY_PERCENT) / self.BATTERY_DRAIN_PER_SEC + 0.01
+        if self.is_locked:
+            return low_battery_in
+        return min(max(0.0, self.auto_lock_timer_sec), low_battery_in if low_battery_in is not None else float("inf"))
 
     def _get_status_string(self) -> str:
         return "LOCKED" if self.is_locked else "UNLOCKED"
@@ -198,34 +440,71 @@ class SmartLock(DeviceSimulator):
             "is_locked": self.is_locked,
             "battery_level": f"{int(self.battery_level)}%",
             "last_unlocked_by": self.last_unlocked_by,
-            "auto_lock_timer_sec": self.auto_lock_timer_sec,
+            "auto_lock_timer_sec": int(self.auto_lock_timer_sec),
             "access_log_count": self.access_log_count
         }
 
 class VendingMachine(DeviceSimulator):
-    def __init__(self):
-        super().__init__("vending-machine-01", "Hall Dispenser", "vending_machine", "vendingmachine.eth")
+    SNAPSHOT_FIELDS = (
+        ("stock_level", "j"),
+        ("temperature_internal", "d"),
+        ("last_dispensed", "s"),
+        ("is_jammed", "?"),
+    )
+
+    def __init__(self, id: str = "vending-machine-01", name: str = "Hall Dispenser", ens_domain: str = "vendingmachine.eth"):
+        super().__init__(id, name, "vending_machine", ens_domain)
         self.slots = 6
         self.products = ["Coke", "Water", "Snack"]
+        self.slot_products = {"A1": "Coke", "A2": "Coke", "B1": "Water", "B2": "Water", "C1": "Snack", "C2": "Snack"}
         
         # Dynamic state
-        self.stock_level = {"A1": 5, "A2": 2, "B1": 8, "B2": 1, "C1": 10, "C2": 4}
+        self.inventory = SlotInventory(
+            id,
+            {"A1": 5, "A2": 2, "B1": 8, "B2": 1, "C1": 10, "C2": 4},
+            self.slot_products
+        )
         self.temperature_internal = 4.2
         self.last_dispensed = datetime.utcnow().isoformat()
         self.is_jammed = False
+        self._next_walk_up_in = random.expovariate(self.WALK_UP_RATE_PER_SEC)
 
-    def update(self):
-        super().update()
+    @property
+    def stock_level(self) -> Dict[str, int]:
+        return self.inventory.as_dict()
+
+    @stock_level.setter
+    def stock_level(self, stock: Dict[str, int]):
+        self.inventory.load(stock)
+
+    # Walk-up purchases arrive as a Poisson process (~1 per 500 s)
+    WALK_UP_RATE_PER_SEC = 0.002
+
+    def _simulate(self, dt: float):
         # Temp fluctuation
         self.temperature_internal = 4.2 + random.uniform(-0.3, 0.3)
+
+        # Drop holds whose payment never arrived
+        if self.inventory.expire():
+            self.mark_changed()
         
-        # Randomly simulate a purchase (very rare)
-        if random.random() < 0.01:
-            keys = list(self.stock_level.keys())
-            slot = random.choice(keys)
-            if self.stock_level[slot] > 0:
-                self.stock_level[slot] -= 1
+        # Randomly simulate walk-up purchases (never touches reserved stock)
+        self._next_walk_up_in -= dt
+        while self._next_walk_up_in <= 0:
+            slot = random.randrange(len(self.inventory.slot_names))
+            if self.inventory.take(slot):
                 self.last_dispensed = datetime.utcnow().isoformat()
+                self.mark_changed()
+            self._next_walk_up_in += random.expovariate(self.WALK_UP_RATE_PER_SEC)
+
+    def next_event_in(self) -> Optional[float]:
+        expiry = self.inventory.next_expiry()
+        if expiry is None:
+            return max(0.0, self._next_walk_up_in)
+        return max(0.0, min(self._next_walk_up_in, expiry - time.time()))
+
+    def stocked_products(self) -> frozenset:
+        return self.inventory.available_products()
 
     def _get_status_string(self) -> str:
         return "JAMMED" if self.is_jammed else "OK"
@@ -239,26 +518,41 @@ class VendingMachine(DeviceSimulator):
         }
 
 class SecurityCamera(DeviceSimulator):
-    def __init__(self):
-        super().__init__("camera-01", "Hall Camera", "security_camera", "camera.eth")
+    SNAPSHOT_FIELDS = (
+        ("is_streaming", "?"),
+        ("active_viewers", "q"),
+        ("bandwidth_usage_mbps", "d"),
+        ("privacy_mode", "?"),
+    )
+    PRICE_PER_MIN = 0.02
+
+    def __init__(self, id: str = "camera-01", name: str = "Hall Camera", ens_domain: str = "camera.eth"):
+        super().__init__(id, name, "security_camera", ens_domain)
         self.resolution = "1080p"
         self.codec = "H.264"
         
         # Dynamic state
         self.is_streaming = True
-        self.active_viewers = 2
-        self.bandwidth_usage_mbps = 4.5
+        self.active_viewers = 0
+        self.bandwidth_usage_mbps = CAMERA_BASE_MBPS
         self.privacy_mode = False
+        # camera_streams.ViewerRegistry, attached by the API's stream broker
+        self.viewers = None
 
-    def update(self):
-        super().update()
+    def _simulate(self, dt: float):
+        if self.viewers is not None and self.viewers.expire():
+            self.mark_changed()
         
         if self.privacy_mode:
             self.bandwidth_usage_mbps = 0.1
             self.active_viewers = 0
         else:
-            self.active_viewers = random.randint(0, 5)
-            self.bandwidth_usage_mbps = 4.0 + (self.active_viewers * 0.5) + random.uniform(-0.2, 0.2)
+            self.active_viewers = len(self.viewers) if self.viewers is not None else 0
+            self.bandwidth_usage_mbps = CAMERA_BASE_MBPS + self.active_viewers * VIEWER_MBPS
+
+    def next_event_in(self) -> Optional[float]:
+        expiry = self.viewers.next_expiry() if self.viewers is not None else None
+        return max(0.0, expiry - time.time()) if expiry is not None else None
 
     def _get_status_string(self) -> str:
         return "PRIVACY" if self.privacy_mode else "STREAMING"
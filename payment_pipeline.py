@@ -0,0 +1,292 @@
+"""
+Payment Verification Pipeline
+Background x402 payment checks with confirmation-depth tracking
+"""
+
+import asyncio
+import inspect
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Optional: Use web3.py for the RPC-backed chain client
+try:
+    from web3 import Web3
+    WEB3_AVAILABLE = True
+except ImportError:
+    WEB3_AVAILABLE = False
+
+WEI_PER_ETH = Decimal(10) ** 18
+
+
+def eth_to_wei(amount: str) -> int:
+    return int(Decimal(amount) * WEI_PER_ETH)
+
+
+class PaymentError(Exception):
+    """The payment cannot be accepted (reused or malformed transaction)."""
+
+
+class ChainClient:
+    """
+    What the pipeline needs from a chain:
+
+        block_number() -> latest block height
+        get_payment(tx_hash) -> {"block_number", "status", "from", "to", "value_wei"}
+                                or None while the tx is not mined
+    """
+
+    async def block_number(self) -> int:
+        raise NotImplementedError
+
+    async def get_payment(self, tx_hash: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class Web3ChainClient(ChainClient):
+    """JSON-RPC client; web3 calls are blocking so they run on worker threads."""
+
+    def __init__(self, rpc_url: Optional[str] = None):
+        if not WEB3_AVAILABLE:
+            raise RuntimeError("web3.py is required for CHAIN_VERIFICATION=rpc")
+        self.rpc_url = rpc_url or os.getenv("RPC_URL", "https://sepolia.base.org")
+        self.w3 = Web3(Web3.HTTPProvider(self.rpc_url))
+
+    async def block_number(self) -> int:
+        return await asyncio.to_thread(lambda: self.w3.eth.block_number)
+
+    def _get_payment(self, tx_hash: str) -> Optional[Dict[str, Any]]:
+        try:
+            receipt = self.w3.eth.get_transaction_receipt(tx_hash)
+        except Exception:
+            return None  # Not mined yet
+        tx = self.w3.eth.get_transaction(tx_hash)
+        return {
+            "block_number": receipt.blockNumber,
+            "status": receipt.status,
+            "from": tx["from"],
+            "to": tx.to,
+            "value_wei": tx.value
+        }
+
+    async def get_payment(self, tx_hash: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get_payment, tx_hash)
+
+
+class MockChain(ChainClient):
+    """
+    In-process chain for tests and demos. send() queues a transfer for the
+    next block; mine() (or run() with a block time) produces blocks.
+    """
+
+    def __init__(self, block_time_sec: float = 1.0):
+        self.block_time_sec = block_time_sec
+        self.height = 0
+        self._mempool: Dict[str, Dict[str, Any]] = {}
+        self._mined: Dict[str, Dict[str, Any]] = {}
+
+    def send(self, to: str, value_wei: int, tx_hash: Optional[str] = None, status: int = 1,
+             sender: Optional[str] = None) -> str:
+        tx_hash = tx_hash or "0x" + uuid.uuid4().hex + uuid.uuid4().hex
+        self._mempool[tx_hash] = {"status": status, "from": sender, "to": to, "value_wei": value_wei}
+        return tx_hash
+
+    def mine(self, blocks: int = 1):
+        for _ in range(blocks):
+            self.height += 1
+            for tx_hash, tx in self._mempool.items():
+                self._mined[tx_hash] = {**tx, "block_number": self.height}
+            self._mempool.clear()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.block_time_sec)
+            self.mine()
+
+    async def block_number(self) -> int:
+        return self.height
+
+    async def get_payment(self, tx_hash: str) -> Optional[Dict[str, Any]]:
+        return self._mined.get(tx_hash)
+
+
+class PendingPayment:
+    def __init__(self, tx_hash: str, recipient: str, amount: str,
+                 on_confirmed: Callable[["PendingPayment"], Any], job_id: Optional[str] = None,
+                 sender: Optional[str] = None, on_failed: Optional[Callable[["PendingPayment"], Any]] = None):
+        self.job_id = job_id or str(uuid.uuid4())
+        self.tx_hash = tx_hash
+        self.recipient = recipient
+        self.sender = sender
+        self.amount = amount
+        self.value_wei = eth_to_wei(amount)
+        self.on_confirmed = on_confirmed
+        self.on_failed = on_failed
+        self.status = "pending_payment"
+        self.block_number: Optional[int] = None
+        self.confirmations = 0
+        self.created_at = time.time()
+        self.error: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+
+    def to_dict(self, required: int) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "transaction_hash": self.tx_hash,
+            "amount": self.amount,
+            "block_number": self.block_number,
+            "confirmations": self.confirmations,
+            "confirmations_required": required,
+            "error": self.error,
+            "result": self.result
+        }
+
+
+class PaymentPipeline:
+    """
+    Payments move pending_payment -> confirming -> completed (or failed).
+
+    Workers look up receipts for queued hashes. A single watcher polls the
+    block height for every payment at once: each new block bumps the depth
+    of all confirming payments and re-queues hashes that were not mined yet,
+    so an RPC node sees one head poll per interval plus one lookup per
+    unmined tx per block, however many clients are waiting.
+    """
+
+    def __init__(self, chain: ChainClient, confirmations: int = 2, workers: int = 4,
+                 poll_interval: float = 2.0, timeout_sec: float = 900.0, history: int = 10000):
+        self.chain = chain
+        self.confirmations = max(1, confirmations)
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.timeout_sec = timeout_sec
+        self.history = history
+        self.payments: "OrderedDict[str, PendingPayment]" = OrderedDict()
+        # tx hash -> job id; kept after history is trimmed to block replays
+        self._used_tx: Dict[str, str] = {}
+        self._unmined: Dict[str, PendingPayment] = {}
+        self._confirming: Dict[str, PendingPayment] = {}
+        # Submitted and not yet completed or failed, wherever they are: queued,
+        # being looked up, confirming or running on_confirmed
+        self._open: Set[str] = set()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.head = 0
+
+    def submit(self, tx_hash: str, recipient: str, amount: str,
+               on_confirmed: Callable[[PendingPayment], Any], sender: Optional[str] = None,
+               on_failed: Optional[Callable[[PendingPayment], Any]] = None) -> PendingPayment:
+        """`sender`, when given, must be the tx's from address; on_failed is called on rejection."""
+        tx_key = tx_hash.lower()
+        if tx_key in self._used_tx:
+            raise PaymentError(f"Transaction {tx_hash} was already used for job {self._used_tx[tx_key]}")
+        payment = PendingPayment(tx_hash, recipient, amount, on_confirmed, sender=sender, on_failed=on_failed)
+        self._used_tx[tx_key] = payment.job_id
+        self.payments[payment.job_id] = payment
+        self._open.add(payment.job_id)
+        # Trim finished payments, oldest first; in-flight ones are never dropped
+        while len(self.payments) > self.history:
+            oldest = next(iter(self.payments.values()))
+            if oldest.status not in ("completed", "failed"):
+                break
+            self.payments.popitem(last=False)
+        self._queue.put_nowait(payment)
+        return payment
+
+    def get(self, job_id: str) -> Optional[PendingPayment]:
+        return self.payments.get(job_id)
+
+    def in_flight(self) -> int:
+        return len(self._open)
+
+    def _fail(self, payment: PendingPayment, error: str):
+        payment.status = "failed"
+        payment.error = error
+        self._open.discard(payment.job_id)
+        self._unmined.pop(payment.job_id, None)
+        self._confirming.pop(payment.job_id, None)
+        logger.warning(f"[PAYMENT] Job {payment.job_id} failed: {error}")
+        if payment.on_failed is not None:
+            payment.on_failed(payment)
+
+    async def _check(self, payment: PendingPayment):
+        info = await self.chain.get_payment(payment.tx_hash)
+        if info is None:
+            if time.time() - payment.created_at > self.timeout_sec:
+                self._fail(payment, "Transaction not mined before timeout")
+            else:
+                self._unmined[payment.job_id] = payment
+            return
+        self._unmined.pop(payment.job_id, None)
+        if info["status"] != 1:
+            return self._fail(payment, "Transaction reverted")
+        # No recipient means a contract creation, which never pays the vendor
+        if not info.get("to") or info["to"].lower() != payment.recipient.lower():
+            return self._fail(payment, "Transaction recipient does not match the vendor")
+        if payment.sender and info.get("from") and info["from"].lower() != payment.sender.lower():
+            return self._fail(payment, "Transaction sender does not match the payer")
+        if info["value_wei"] != payment.value_wei:
+            return self._fail(payment, "Transaction value does not match the quoted amount")
+        payment.block_number = info["block_number"]
+        payment.status = "confirming"
+        self._confirming[payment.job_id] = payment
+        await self._advance(payment)
+
+    async def _advance(self, payment: PendingPayment):
+        payment.confirmations = max(0, self.head - payment.block_number + 1)
+        if payment.confirmations < self.confirmations:
+            return
+        if self._confirming.pop(payment.job_id, None) is None:
+            return  # Already released while the watcher was awaiting another job
+        try:
+            # on_confirmed may be a coroutine (e.g. waiting for the device lock)
+            result = payment.on_confirmed(payment)
+            if inspect.isawaitable(result):
+                result = await result
+            payment.result = result
+            payment.status = "completed"
+            self._open.discard(payment.job_id)
+            logger.info(f"[PAYMENT] Job {payment.job_id} released at {payment.confirmations} confirmations")
+        except Exception as e:
+            self._fail(payment, getattr(e, "detail", None) or str(e))
+
+    async def _worker(self):
+        while True:
+            payment = await self._queue.get()
+            try:
+                await self._check(payment)
+            except Exception as e:
+                # RPC hiccup: try again on the next block
+                logger.error(f"[PAYMENT] Receipt lookup for {payment.tx_hash[:10]}... failed: {str(e)}")
+                self._unmined[payment.job_id] = payment
+
+    async def _watch_blocks(self):
+        while True:
+            try:
+                head = await self.chain.block_number()
+            except Exception as e:
+                logger.error(f"[PAYMENT] Block poll failed: {str(e)}")
+                head = self.head
+            if head > self.head:
+                self.head = head
+                for payment in list(self._confirming.values()):
+                    await self._advance(payment)
+                for payment in list(self._unmined.values()):
+                    del self._unmined[payment.job_id]
+                    self._queue.put_nowait(payment)
+            await asyncio.sleep(self.poll_interval)
+
+    async def run(self):
+        try:
+            self.head = await self.chain.block_number()
+        except Exception as e:
+            logger.error(f"[PAYMENT] Initial block poll failed: {str(e)}")
+        tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        tasks.append(asyncio.create_task(self._watch_blocks()))
+        await asyncio.gather(*tasks)
@@ -0,0 +1,177 @@
+"""
+Profiling Hooks
+On-demand sampling profiler, per-tick phase traces and slow-request breakdowns
+"""
+
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from fastapi.responses import JSONResponse
+
+
+class SamplingProfiler:
+    """
+    Samples one thread's Python stack from a background thread and aggregates
+    the samples as collapsed stacks ("a;b;c count"), the input format of
+    flamegraph.pl / speedscope. Nothing runs unless a session is started.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started_at: Optional[float] = None
+        self.duration_sec = 0.0
+        self.interval_sec = 0.0
+        self._labels: Dict[Any, str] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, target_thread_id: int, duration_sec: float, interval_sec: float = 0.005):
+        if self.running:
+            raise RuntimeError("A profiling session is already running")
+        self.samples = Counter()
+        self.sample_count = 0
+        self.started_at = time.time()
+        self.duration_sec = duration_sec
+        self.interval_sec = interval_sec
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(target_thread_id, duration_sec, interval_sec),
+            name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+            self._labels[code] = label
+        return label
+
+    def _run(self, target_thread_id: int, duration_sec: float, interval_sec: float):
+        deadline = time.monotonic() + duration_sec
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            frame = sys._current_frames().get(target_thread_id)
+            if frame is not None:
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+                self.sample_count += 1
+            self._stop.wait(interval_sec)
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "started_at": self.started_at,
+            "duration_sec": self.duration_sec,
+            "interval_ms": self.interval_sec * 1000,
+            "samples": self.sample_count,
+            "unique_stacks": len(self.samples)
+        }
+
+
+class TickTrace:
+    def __init__(self, tick: int):
+        self.tick = tick
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._last = self._start
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, phase: str):
+        """Close the current phase: time since the previous mark."""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "tick": self.tick,
+            "started_at": self.started_at,
+            "total_ms": round((self._last - self._start) * 1000, 3),
+            "phases_ms": {name: round(ms, 3) for name, ms in self.phases.items()}
+        }
+
+
+class TickTracer:
+    """
+    Ring buffer of per-tick phase timings. start_tick() returns None while
+    disabled, so the simulation loop pays one attribute check per tick.
+    """
+
+    def __init__(self, capacity: int = 240):
+        self.enabled = False
+        self.ticks = 0
+        self.traces: Deque[TickTrace] = deque(maxlen=capacity)
+
+    def start_tick(self) -> Optional[TickTrace]:
+        self.ticks += 1
+        if not self.enabled:
+            return None
+        trace = TickTrace(self.ticks)
+        self.traces.append(trace)
+        return trace
+
+    def recent(self, limit: int = 60) -> List[Dict[str, Any]]:
+        return [trace.to_dict() for trace in list(self.traces)[-limit:]]
+
+
+# Per-request phase timings; only set while slow-request logging is enabled
+request_phases: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_phases", default=None
+)
+
+
+class RequestPhase:
+    """
+    Times a block of a request handler into the request's breakdown:
+
+        with RequestPhase("manifest"):
+            ...
+
+    Outside a timed request it only reads the context variable.
+    """
+
+    __slots__ = ("name", "phases", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.phases = request_phases.get()
+        if self.phases is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.phases is not None:
+            elapsed = (time.perf_counter() - self.start) * 1000
+            self.phases[self.name] = self.phases.get(self.name, 0.0) + elapsed
+        return False
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that reports its serialization time as the "render" phase."""
+
+    def render(self, content: Any) -> bytes:
+        with RequestPhase("render"):
+            return super().render(content)
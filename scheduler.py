@@ -0,0 +1,135 @@
+"""
+Event Scheduler
+Wakes each device only at its next discrete state change instead of polling the fleet
+"""
+
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class EventScheduler:
+    """
+    Min-heap of (due, seq, device) keyed on time.monotonic().
+
+    Each device has at most one live entry: schedule() records the newest due
+    time per device and older heap entries are skipped when popped, so
+    rescheduling is O(log n) with no heap deletions. Devices whose
+    next_event_in() is None are not in the heap at all; reads bring them up
+    to date lazily via sync().
+
+    tick_interval runs the tick hooks (snapshots, alert rules...) on a
+    coarse timer that is independent of the fleet size.
+    """
+
+    def __init__(self, tick_interval: float = 5.0, tracer=None):
+        self.tick_interval = tick_interval
+        self.tracer = tracer
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._due: Dict[str, float] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._on_event: List[Callable[[Any], None]] = []
+        self._on_tick: List[Callable[[], Any]] = []
+        self.events_processed = 0
+
+    def on_event(self, callback: Callable[[Any], None]):
+        """Called with the device after each scheduled wake-up."""
+        self._on_event.append(callback)
+
+    def on_tick(self, callback: Callable[[], Any]):
+        """Called every tick_interval; may return an awaitable."""
+        self._on_tick.append(callback)
+
+    def schedule(self, device):
+        """(Re)compute the device's next event; call after any mutation."""
+        delay = device.next_event_in()
+        if device.deadline is not None:
+            # An external deadline (a prepaid balance running out) wakes it too
+            until = device.deadline - time.monotonic()
+            delay = until if delay is None else min(delay, until)
+        if delay is None:
+            self._due.pop(device.id, None)
+            return
+        due = time.monotonic() + max(0.0, delay)
+        if self._due.get(device.id) == due:
+            return
+        self._due[device.id] = due
+        heapq.heappush(self._heap, (due, next(self._seq), device))
+        if self._wakeup is not None and self._heap[0][2] is device:
+            self._wakeup.set()
+
+    def schedule_all(self, devices):
+        for device in devices:
+            self.schedule(device)
+
+    def pending(self) -> int:
+        return len(self._due)
+
+    def _pop_due(self, now: float) -> List[Any]:
+        ready = []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, device = heapq.heappop(self._heap)
+            if self._due.get(device.id) != due:
+                continue  # Superseded by a later schedule()
+            del self._due[device.id]
+            ready.append(device)
+        return ready
+
+    async def _run_tick_hooks(self):
+        for callback in self._on_tick:
+            try:
+                result = callback()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"[SCHEDULER] Tick hook failed: {str(e)}")
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        next_tick = time.monotonic() + self.tick_interval
+        while True:
+            now = time.monotonic()
+            trace = None
+            ready = self._pop_due(now)
+            if ready:
+                trace = self.tracer.start_tick() if self.tracer else None
+                for device in ready:
+                    try:
+                        device.update()
+                        for callback in self._on_event:
+                            callback(device)
+                    except Exception as e:
+                        logger.error(f"[SCHEDULER] Event on {device.id} failed: {str(e)}")
+                    self.schedule(device)
+                self.events_processed += len(ready)
+                if trace:
+                    trace.mark("events")
+
+            if now >= next_tick:
+                await self._run_tick_hooks()
+                next_tick = now + self.tick_interval
+                if trace:
+                    trace.mark("tick_hooks")
+
+            timeout = next_tick - time.monotonic()
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - time.monotonic())
+            self._wakeup.clear()
+            if timeout > 0:
+                # A timer instead of wait_for(): no inner task, so a
+                # cancellation racing a wake-up cannot be swallowed
+                timer = asyncio.get_running_loop().call_later(timeout, self._wakeup.set)
+                try:
+                    await self._wakeup.wait()
+                finally:
+                    timer.cancel()
+            else:
+                # Yield so request handlers are not starved by a burst of events
+                await asyncio.sleep(0)
@@ -0,0 +1,87 @@
+"""
+Production Server
+Tuned uvicorn entry point: uvloop/httptools when installed, keep-alive, backlog, cache pre-warming and graceful drain
+"""
+
+import os
+import sys
+
+import uvicorn
+
+from cluster import run_local_cluster
+
+HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# Public host clients and other nodes use to reach this machine; required
+# with several workers, since shard redirects send clients to it
+PUBLIC_HOST = os.getenv("SERVER_PUBLIC_HOST", "")
+# Proxies trusted to set X-Forwarded-For/Proto (comma-separated IPs, "*" for any)
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+KEEPALIVE_SEC = int(os.getenv("SERVER_KEEPALIVE_SEC", "75"))
+# Optional cap on concurrent connections/requests; beyond it uvicorn answers 503
+MAX_CONCURRENCY = int(os.getenv("SERVER_MAX_CONCURRENCY", "0")) or None
+# Must cover main.shutdown_event's paid-job drain
+DRAIN_SEC = float(os.getenv("SHUTDOWN_DRAIN_SEC", "30"))
+
+
+def _available(module: str) -> bool:
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def _workers() -> int:
+    value = os.getenv("SERVER_WORKERS", "1")
+    if value == "auto":
+        return os.cpu_count() or 1
+    return max(1, int(value))
+
+
+def serve():
+    os.environ.setdefault("PREWARM_CACHES", "1")
+    config = uvicorn.Config(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        loop="uvloop" if _available("uvloop") else "asyncio",
+        http="httptools" if _available("httptools") else "h11",
+        backlog=BACKLOG,
+        timeout_keep_alive=KEEPALIVE_SEC,
+        limit_concurrency=MAX_CONCURRENCY,
+        timeout_graceful_shutdown=DRAIN_SEC + 5,
+        # main.py logs every request itself
+        access_log=False,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS
+    )
+    print(f"[SERVER] {HOST}:{PORT} loop={config.loop} http={config.http} backlog={BACKLOG}")
+    uvicorn.Server(config).run()
+
+
+def main():
+    workers = _workers()
+    if workers == 1:
+        serve()
+        return
+    # Device state lives in process memory, so uvicorn's forked workers would
+    # each simulate a different fleet. Run the workers as cluster nodes on
+    # consecutive ports instead: each owns a shard and redirects the rest.
+    # Clients follow those redirects, so every port must be reachable at a
+    # known public host (a container must publish all of them).
+    if not PUBLIC_HOST:
+        sys.exit(
+            f"[SERVER] SERVER_WORKERS={workers} needs SERVER_PUBLIC_HOST: clients are redirected to "
+            f"<SERVER_PUBLIC_HOST>:{PORT}-{PORT + workers - 1}, which must all be reachable"
+        )
+    os.environ["SERVER_WORKERS"] = "1"
+    run_local_cluster(
+        workers, base_port=PORT, host=HOST, public_host=PUBLIC_HOST,
+        command=[sys.executable, os.path.abspath(__file__)]
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Site Partitions
+Per-building device registries, vendor addresses, pricing and ENS namespaces
+"""
+
+import contextvars
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from aggregates import FleetAggregates
+from alerts import AlertEngine, AlertHub, Rule
+from capability_index import CapabilityIndex
+from charging import SiteLoadBalancer
+from device_mutations import DeviceMutator
+from fleet_index import FleetIndex
+from inventory import StockLedger
+from metering import Meter
+from models import DeviceSimulator, EVStation, Printer3D, SecurityCamera, SmartLock, VendingMachine
+from scheduler import EventScheduler
+from telemetry_encoding import EncodedPayloadCache
+
+DEFAULT_SITE_ID = "default"
+
+# Action prices in ETH by device type; a site's "pricing" overrides entries
+DEFAULT_PRICING: Dict[str, Dict[str, str]] = {
+    "smart_lock": {
+        "unlock": "0.001",
+        "lock": "0",  # Free
+        "default": "0.001"
+    },
+    "3d_printer": {
+        "print": "0.002",
+        "buy_filament": "0.003",
+        "pause": "0",  # Free
+        "cancel": "0",  # Free
+        "default": "0.002"
+    },
+    "ev_charger": {
+        "charge": "0.005",
+        "stop": "0",  # Free
+        "default": "0.005"
+    },
+    "vending_machine": {
+        "dispense": "0.003",
+        "restock": "0.004",
+        "default": "0.003"
+    },
+    "security_camera": {
+        "view": "0.001",
+        "default": "0.001"
+    }
+}
+
+DEVICE_CLASSES = {
+    "ev_charger": EVStation,
+    "3d_printer": Printer3D,
+    "smart_lock": SmartLock,
+    "vending_machine": VendingMachine,
+    "security_camera": SecurityCamera
+}
+
+# Site serving the current request (set by SiteRoutingMiddleware)
+current_site: contextvars.ContextVar[Optional["Site"]] = contextvars.ContextVar("current_site", default=None)
+
+
+class Site:
+    """
+    One building: its devices and everything derived from them. Indexes,
+    the charger power budget, the event scheduler and the encoded-payload
+    cache are per site, so one site's churn never invalidates or queues
+    behind another's.
+    """
+
+    def __init__(self, id: str, name: str, devices: List[DeviceSimulator], vendor_address: str,
+                 ens_namespace: Optional[str] = None, pricing: Optional[Dict[str, Dict[str, str]]] = None,
+                 hosts: Iterable[str] = (), base_url: Optional[str] = None, power_cap_kw: float = 150.0,
+                 tick_interval: float = 5.0, tracer=None, min_compress_bytes: int = 1024,
+                 alert_rules: Optional[List[Rule]] = None, alert_hub: Optional[AlertHub] = None):
+        self.id = id
+        self.name = name
+        self.vendor_address = vendor_address
+        self.ens_namespace = ens_namespace
+        self.hosts = [h.lower() for h in hosts]
+        self.base_url = base_url
+        self.pricing = {t: dict(actions) for t, actions in DEFAULT_PRICING.items()}
+        for device_type, actions in (pricing or {}).items():
+            self.pricing.setdefault(device_type, {}).update({a: str(p) for a, p in actions.items()})
+
+        self.devices = devices
+        self.device_map = {d.id: d for d in devices}
+        # Position in self.devices, for /status page cursors
+        self.device_rows = {d.id: i for i, d in enumerate(devices)}
+        self.ens_map = {d.ens_domain: d for d in devices}
+
+        # Secondary indexes (type, status, ENS suffix, in-stock product) kept
+        # current from each device's change notifications
+        self.fleet_index = FleetIndex()
+        for d in devices:
+            self.fleet_index.add(d)
+
+        # Site-wide vending stock, fed by per-machine inventory deltas
+        self.stock_ledger = StockLedger()
+        for d in devices:
+            if isinstance(d, VendingMachine):
+                d.inventory.attach_ledger(self.stock_ledger)
+
+        # All chargers share the building's grid connection
+        self.load_balancer = SiteLoadBalancer(power_cap_kw)
+        for d in devices:
+            if isinstance(d, EVStation):
+                self.load_balancer.add(d)
+
+        # Per-type telemetry rollups for /fleet/aggregates
+        self.aggregates = FleetAggregates(self.stock_ledger)
+        for d in devices:
+            self.aggregates.add(d)
+
+        # Capability search; filled from the manifests at startup
+        self.capability_index = CapabilityIndex()
+
+        self.scheduler = EventScheduler(tick_interval, tracer=tracer)
+        self.scheduler.on_event(self._on_device_event)
+        # Charger events only mark the split stale; it is redone once per tick
+        self._chargers_dirty = False
+        self.scheduler.on_tick(self._rebalance_if_dirty)
+
+        # Time-based sessions accrue per tick; a charger stopped for an empty
+        # balance frees power like any other charger event
+        self.meter = Meter(self.scheduler, on_stop=self._on_device_event)
+
+        # Alert rules are stepped over the devices that changed, once per tick
+        self.alerts = None
+        if alert_hub is not None and alert_rules:
+            self.alerts = AlertEngine(id, alert_rules, alert_hub)
+            for d in devices:
+                self.alerts.add(d)
+            self.scheduler.on_tick(self.alerts.evaluate)
+
+        # Jobs mutate devices through per-device locked transactions
+        self.mutator = DeviceMutator(self.scheduler)
+
+        # Encoded /status payloads are reused until the site changes
+        # (summaries) or the next tick (device telemetry)
+        self.payload_cache = EncodedPayloadCache(min_compress_bytes=min_compress_bytes)
+        self.version = 0
+        self.device_versions: Dict[str, int] = {}
+        for d in devices:
+            d.add_observer(self._bump_version)
+
+    def _bump_version(self, device: DeviceSimulator):
+        self.version += 1
+        self.device_versions[device.id] = self.device_versions.get(device.id, 0) + 1
+
+    def _on_device_event(self, device: DeviceSimulator):
+        # A charger crossing a taper step or finishing frees power for the
+        # others; a station never draws more than its grant, so the split
+        # can wait for the tick
+        if isinstance(device, EVStation):
+            self._chargers_dirty = True
+
+    def _rebalance_if_dirty(self):
+        if self._chargers_dirty:
+            self.rebalance_chargers()
+
+    def rebalance_chargers(self):
+        """Re-split site power; reschedule and refresh the chargers whose grant changed."""
+        self._chargers_dirty = False
+        for station in self.load_balancer.rebalance():
+            self.scheduler.schedule(station)
+            # Allocations change without a device notification
+            self.aggregates.refresh(station)
+
+    def price(self, device_type: str, action: str) -> str:
+        actions = self.pricing.get(device_type, {})
+        return actions.get(action, actions.get("default", "0.001"))
+
+    @property
+    def path_prefix(self) -> str:
+        """URL prefix that routes to this site ("" for the default site)."""
+        return "" if self.id == DEFAULT_SITE_ID else f"/sites/{self.id}"
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "hosts": self.hosts,
+            "path_prefix": self.path_prefix,
+            "ens_namespace": self.ens_namespace,
+            "vendor_address": self.vendor_address,
+            "devices": len(self.devices)
+        }
+
+
+class SiteRegistry:
+    """Sites by id, host and ENS name; every lookup is a dict probe."""
+
+    def __init__(self, default_site_id: str = DEFAULT_SITE_ID):
+        self.default_site_id = default_site_id
+        self.sites: Dict[str, Site] = {}
+        self.by_host: Dict[str, Site] = {}
+        self.ens_index: Dict[str, Tuple[Site, DeviceSimulator]] = {}
+        self._device_ids: Dict[str, Site] = {}
+
+    @property
+    def default(self) -> Site:
+        return self.sites[self.default_site_id]
+
+    def add(self, site: Site):
+        if site.id in self.sites:
+            raise ValueError(f"Duplicate site id '{site.id}'")
+        for device in site.devices:
+            # Snapshots, receipts and access logs are keyed by device id node-wide
+            if device.id in self._device_ids:
+                raise ValueError(f"Device id '{device.id}' is used by sites '{self._device_ids[device.id].id}' and '{site.id}'")
+            if device.ens_domain in self.ens_index:
+                raise ValueError(f"ENS name '{device.ens_domain}' is used twice")
+        for host in site.hosts:
+            if host in self.by_host:
+                raise ValueError(f"Host '{host}' is mapped to sites '{self.by_host[host].id}' and '{site.id}'")
+        self.sites[site.id] = site
+        for host in site.hosts:
+            self.by_host[host] = site
+        for device in site.devices:
+            self._device_ids[device.id] = site
+            self.ens_index[device.ens_domain] = (site, device)
+
+    def resolve(self, host: Optional[str]) -> Site:
+        if host:
+            site = self.by_host.get(host.split(":", 1)[0].lower())
+            if site is not None:
+                return site
+        return self.default
+
+    def site_of(self, device_id: str) -> Optional[Site]:
+        return self._device_ids.get(device_id)
+
+    def all_devices(self) -> Iterator[DeviceSimulator]:
+        for site in self.sites.values():
+            yield from site.devices
+
+    def device_map(self) -> Dict[str, DeviceSimulator]:
+        return {d.id: d for d in self.all_devices()}
+
+
+def build_devices(specs: List[Dict[str, Any]], ens_namespace: Optional[str]) -> List[DeviceSimulator]:
+    """
+    Devices from config entries {"type", "id", "name", "ens_label"}. ENS names
+    are "<ens_label or id>.<ens_namespace>".
+    """
+    devices = []
+    for spec in specs:
+        cls = DEVICE_CLASSES.get(spec.get("type"))
+        if cls is None:
+            raise ValueError(f"Unknown device type '{spec.get('type')}'")
+        kwargs = {k: spec[k] for k in ("id", "name") if spec.get(k)}
+        label = spec.get("ens_label") or spec.get("id")
+        if ens_namespace and label:
+            kwargs["ens_domain"] = f"{label}.{ens_namespace}"
+        devices.append(cls(**kwargs))
+    return devices
+
+
+def load_site_config(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    if not isinstance(config.get("sites"), list):
+        raise ValueError(f"{path}: expected a top-level 'sites' list")
+    return config
+
+
+class SiteRoutingMiddleware:
+    """
+    Picks the site for each request: a "/sites/<id>" path prefix (stripped
+    before routing) wins, then the Host header, then the default site.
+    Unknown site prefixes get a 404 without reaching the app.
+    """
+
+    def __init__(self, app, registry: SiteRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        site = None
+        if path.startswith("/sites/"):
+            site_id, _, rest = path[len("/sites/"):].partition("/")
+            site = self.registry.sites.get(site_id)
+            if site is None:
+                if scope["type"] == "http":
+                    return await self._not_found(send, site_id)
+                return
+            prefix_len = len("/sites/") + len(site_id)
+            scope = dict(scope, path="/" + rest)
+            raw_path = scope.get("raw_path")
+            if raw_path:
+                scope["raw_path"] = raw_path[prefix_len:] or b"/"
+        if site is None:
+            host = None
+            for name, value in scope.get("headers", ()):
+                if name == b"host":
+                    host = value.decode("latin-1")
+                    break
+            site = self.registry.resolve(host)
+
+        token = current_site.set(site)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_site.reset(token)
+
+    @staticmethod
+    async def _not_found(send, site_id: str):
+        body = json.dumps({"detail": f"Site '{site_id}' not found"}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 404,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
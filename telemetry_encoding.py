@@ -0,0 +1,181 @@
+"""
+Telemetry Encodings
+Content negotiation, compression and an encoded-payload cache for status endpoints
+"""
+
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# Optional encoders: brotli compresses telemetry ~20% better than gzip,
+# msgpack drops JSON's quoting and number formatting
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+JSON_MEDIA = "application/json"
+MSGPACK_MEDIA = "application/msgpack"
+# Fleet lists as {"count", "columns": {field: values}}; low-cardinality
+# string columns are dictionary-encoded as {"values": [...], "codes": [...]}
+COLUMNAR_MEDIA = "application/vnd.fleet.columnar+json"
+# Streamed fleet lists: one JSON object per line, written in chunks
+NDJSON_MEDIA = "application/x-ndjson"
+
+# Below this size compression costs more than it saves on the wire
+DEFAULT_MIN_COMPRESS_BYTES = 1024
+
+# Keys that only duplicate another key (kept in plain JSON for compatibility)
+REDUNDANT_KEYS = ("ens",)
+
+
+def _parse_accept(header: Optional[str]) -> List[Tuple[str, float]]:
+    """Media ranges / codings with their q-values, best first."""
+    if not header:
+        return []
+    items = []
+    for position, part in enumerate(header.split(",")):
+        fields = part.strip().split(";")
+        name = fields[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            items.append((name, q, -position))
+    items.sort(key=lambda item: (item[1], item[2]), reverse=True)
+    return [(name, q) for name, q, _ in items]
+
+
+def choose_media(accept: Optional[str], columnar: bool = False, streaming: bool = False) -> str:
+    """Best supported media type for an Accept header (JSON by default)."""
+    for name, _ in _parse_accept(accept):
+        if name in (MSGPACK_MEDIA, "application/x-msgpack") and MSGPACK_AVAILABLE:
+            return MSGPACK_MEDIA
+        if name == COLUMNAR_MEDIA and columnar:
+            return COLUMNAR_MEDIA
+        if name in (NDJSON_MEDIA, "application/jsonl") and streaming:
+            return NDJSON_MEDIA
+        if name in (JSON_MEDIA, "application/*", "*/*"):
+            return JSON_MEDIA
+    return JSON_MEDIA
+
+
+def choose_coding(accept_encoding: Optional[str]) -> str:
+    for name, _ in _parse_accept(accept_encoding):
+        if name == "br" and BROTLI_AVAILABLE:
+            return "br"
+        if name in ("gzip", "*"):
+            return "gzip"
+        if name == "identity":
+            return "identity"
+    return "identity"
+
+
+def representations() -> List[Tuple[str, str]]:
+    """Every (media type, content coding) this build can produce."""
+    media = [JSON_MEDIA, COLUMNAR_MEDIA] + ([MSGPACK_MEDIA] if MSGPACK_AVAILABLE else [])
+    codings = ["identity", "gzip"] + (["br"] if BROTLI_AVAILABLE else [])
+    return [(m, c) for m in media for c in codings]
+
+
+def _strip_redundant(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: v for k, v in value.items() if k not in REDUNDANT_KEYS}
+    if isinstance(value, list):
+        return [_strip_redundant(item) for item in value]
+    return value
+
+
+def to_columnar(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    fields: List[str] = []
+    for row in rows:
+        for key in row:
+            if key not in fields and key not in REDUNDANT_KEYS:
+                fields.append(key)
+    columns: Dict[str, Any] = {}
+    for field in fields:
+        values = [row.get(field) for row in rows]
+        distinct = set(values) if all(isinstance(v, str) for v in values) else None
+        if distinct is not None and len(distinct) * 2 <= len(values):
+            dictionary = sorted(distinct)
+            code_of = {value: code for code, value in enumerate(dictionary)}
+            columns[field] = {"values": dictionary, "codes": [code_of[v] for v in values]}
+        else:
+            columns[field] = values
+    return {"count": len(rows), "columns": columns}
+
+
+def ndjson_lines(rows: List[Any]) -> bytes:
+    """One compact JSON document per row, newline-terminated."""
+    return "".join(json.dumps(row, separators=(",", ":"), default=str) + "\n" for row in rows).encode("utf-8")
+
+
+def encode(payload: Any, media: str, coding: str,
+           min_compress_bytes: int = DEFAULT_MIN_COMPRESS_BYTES) -> Tuple[bytes, str]:
+    """Serialize and compress; returns (body, content coding actually used)."""
+    if media == MSGPACK_MEDIA:
+        body = msgpack.packb(_strip_redundant(payload), default=str)
+    elif media == COLUMNAR_MEDIA:
+        body = json.dumps(to_columnar(payload), separators=(",", ":"), default=str).encode("utf-8")
+    else:
+        body = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+
+    if len(body) < min_compress_bytes or coding == "identity":
+        return body, "identity"
+    if coding == "br":
+        return brotli.compress(body, quality=5), "br"
+    return gzip.compress(body, compresslevel=6), "gzip"
+
+
+class EncodedPayloadCache:
+    """
+    Encoded bodies keyed by (resource, version, media, coding), LRU-bounded.
+
+    Callers pass a version that changes when the resource does (fleet change
+    counter, simulation tick), so each representation is serialized and
+    compressed once per version however many dashboards poll it.
+    """
+
+    def __init__(self, max_entries: int = 512, min_compress_bytes: int = DEFAULT_MIN_COMPRESS_BYTES):
+        self.max_entries = max_entries
+        self.min_compress_bytes = min_compress_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[bytes, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, resource: Hashable, version: Hashable, media: str, coding: str,
+            build: Callable[[], Any]) -> Tuple[bytes, str]:
+        key = (resource, version, media, coding)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+        encoded = encode(build(), media, coding, self.min_compress_bytes)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = encoded
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return encoded
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
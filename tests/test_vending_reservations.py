@@ -0,0 +1,92 @@
+"""
+Vending Reservation Tests
+A quote hold only pays out the order it was quoted for, to the caller it was quoted to
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# In-memory node: no state files, payments applied inline
+for name in ("SNAPSHOT_PATH", "ACCESS_LOG_DIR", "JOB_STORE_PATH", "CHANNEL_STORE_PATH"):
+    os.environ[name] = ""
+os.environ["CHAIN_VERIFICATION"] = "off"
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from inventory import ReservationMismatchError, SlotInventory  # noqa: E402
+
+TX_HASH = "0x" + "ab" * 32
+PAYER_A = "0x" + "aa" * 20
+PAYER_B = "0x" + "bb" * 20
+
+
+def make_inventory() -> SlotInventory:
+    return SlotInventory("vm-test", {"C1": 10, "C2": 4}, {"C1": "Snack", "C2": "Snack"})
+
+
+def test_commit_rejects_a_different_order():
+    inventory = make_inventory()
+    reservation = inventory.reserve([{"slot": "C1", "quantity": 10}], owner=PAYER_A)
+
+    with pytest.raises(ReservationMismatchError):
+        inventory.commit(reservation.id, [{"slot": "C1", "quantity": 1}])
+
+    # The hold is untouched and still sells the order it was quoted for
+    assert inventory.has_reservation(reservation.id)
+    assert inventory.commit(reservation.id, [{"slot": "C1", "quantity": 10}]).units == 10
+    assert inventory.counts[0] == 0
+
+
+def test_check_reservation_rejects_another_owner():
+    inventory = make_inventory()
+    items = [{"product_id": "Snack", "quantity": 2}]
+    reservation = inventory.reserve(items, owner=PAYER_A)
+
+    assert inventory.check_reservation(reservation.id, items, {PAYER_A})
+    with pytest.raises(ReservationMismatchError):
+        inventory.check_reservation(reservation.id, items, {PAYER_B})
+    assert not inventory.check_reservation("missing", items, {PAYER_A})
+
+
+def test_paid_retry_with_someone_elses_reservation_is_refused():
+    async def scenario():
+        await main.startup_event()
+        device = main._site().device_map["vending-machine-01"]
+        before = device.inventory.as_dict()["C1"]
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            quote = await client.post(
+                "/devices/vending_machine_01/job",
+                json={"action": "dispense", "params": {"slot": "C1", "quantity": before}},
+                headers={"X-Payer-Address": PAYER_A}
+            )
+            assert quote.status_code == 402
+            reservation_id = quote.json()["detail"]["paymentDetails"]["reservation_id"]
+
+            # Another payer pays the one-unit price with A's reservation id
+            stolen = await client.post(
+                "/devices/vending_machine_01/job",
+                json={"action": "dispense", "params": {"slot": "C1", "quantity": 1, "reservation_id": reservation_id}},
+                headers={"X-Payer-Address": PAYER_B, "Authorization": f"Bearer {TX_HASH}"}
+            )
+            assert stolen.status_code == 409
+
+            # Same payer, smaller order than quoted: also refused
+            shrunk = await client.post(
+                "/devices/vending_machine_01/job",
+                json={"action": "dispense", "params": {"slot": "C1", "quantity": 1, "reservation_id": reservation_id}},
+                headers={"X-Payer-Address": PAYER_A, "Authorization": f"Bearer {TX_HASH}"}
+            )
+            assert shrunk.status_code == 409
+
+        assert device.inventory.as_dict()["C1"] == before
+        assert device.inventory.has_reservation(reservation_id)
+        device.inventory.release(reservation_id)
+
+    asyncio.run(scenario())
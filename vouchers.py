@@ -0,0 +1,755 @@
+"""
+Payment Channel Vouchers
+Off-chain signed cumulative vouchers against an on-chain deposit, verified in batches and settled periodically
+"""
+
+import asyncio
+import hashlib
+import hmac
+import inspect
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from payment_pipeline import PaymentError
+
+logger = logging.getLogger(__name__)
+
+# Optional: native secp256k1 and keccak; the pure-Python versions below give
+# the same results (and keep verification testable without them), only slower
+try:
+    from coincurve import PrivateKey, PublicKey
+    COINCURVE_AVAILABLE = True
+except ImportError:
+    COINCURVE_AVAILABLE = False
+
+try:
+    from Crypto.Hash import keccak as _keccak
+    PYCRYPTODOME_AVAILABLE = True
+except ImportError:
+    PYCRYPTODOME_AVAILABLE = False
+
+# ============================================================================
+# keccak256
+# ============================================================================
+
+_KECCAK_RC = [
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+]
+_KECCAK_ROTATIONS = [
+    [0, 36, 3, 41, 18], [1, 44, 10, 45, 2], [62, 6, 43, 15, 61], [28, 55, 25, 21, 56], [27, 20, 39, 8, 14]
+]
+_LANE_MASK = (1 << 64) - 1
+_KECCAK_RATE = 136
+
+
+def _rotl(lane: int, n: int) -> int:
+    return ((lane << n) | (lane >> (64 - n))) & _LANE_MASK if n else lane
+
+
+def _keccak_f(lanes: List[int]) -> List[int]:
+    for rc in _KECCAK_RC:
+        c = [lanes[x] ^ lanes[x + 5] ^ lanes[x + 10] ^ lanes[x + 15] ^ lanes[x + 20] for x in range(5)]
+        d = [c[(x - 1) % 5] ^ _rotl(c[(x + 1) % 5], 1) for x in range(5)]
+        lanes = [lanes[i] ^ d[i % 5] for i in range(25)]
+        b = [0] * 25
+        for x in range(5):
+            for y in range(5):
+                b[y + 5 * ((2 * x + 3 * y) % 5)] = _rotl(lanes[x + 5 * y], _KECCAK_ROTATIONS[x][y])
+        lanes = [b[i] ^ (~b[(i + 1) % 5 + i - i % 5] & b[(i + 2) % 5 + i - i % 5]) for i in range(25)]
+        lanes[0] ^= rc
+    return lanes
+
+
+def keccak256(data: bytes) -> bytes:
+    """Ethereum's keccak256 (not FIPS SHA3-256, which pads differently)."""
+    if PYCRYPTODOME_AVAILABLE:
+        return _keccak.new(digest_bits=256, data=data).digest()
+    padded = bytearray(data)
+    padded.append(0x01)
+    padded.extend(b"\x00" * (-len(padded) % _KECCAK_RATE))
+    padded[-1] |= 0x80
+    lanes = [0] * 25
+    for offset in range(0, len(padded), _KECCAK_RATE):
+        for i in range(_KECCAK_RATE // 8):
+            lanes[i] ^= int.from_bytes(padded[offset + 8 * i:offset + 8 * i + 8], "little")
+        lanes = _keccak_f(lanes)
+    return b"".join(lane.to_bytes(8, "little") for lane in lanes[:4])
+
+# ============================================================================
+# secp256k1 (pure Python fallback)
+# ============================================================================
+
+_P = 2 ** 256 - 2 ** 32 - 977
+_N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+_G = (0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+      0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8)
+
+Point = Optional[Tuple[int, int]]  # None is the point at infinity
+
+
+def _add(a: Point, b: Point) -> Point:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a[0] == b[0]:
+        if (a[1] + b[1]) % _P == 0:
+            return None
+        slope = 3 * a[0] * a[0] * pow(2 * a[1], -1, _P) % _P
+    else:
+        slope = (b[1] - a[1]) * pow(b[0] - a[0], -1, _P) % _P
+    x = (slope * slope - a[0] - b[0]) % _P
+    return x, (slope * (a[0] - x) - a[1]) % _P
+
+
+# Accumulators use Jacobian coordinates (X, Y, Z) to avoid an inversion per
+# addition; Z == 0 is infinity. Tables stay affine for mixed additions.
+_INFINITY = (0, 1, 0)
+
+
+def _jacobian_double(p: Tuple[int, int, int]) -> Tuple[int, int, int]:
+    x, y, z = p
+    if z == 0 or y == 0:
+        return _INFINITY
+    yy = y * y % _P
+    s = 4 * x * yy % _P
+    m = 3 * x * x % _P
+    x3 = (m * m - 2 * s) % _P
+    return x3, (m * (s - x3) - 8 * yy * yy) % _P, 2 * y * z % _P
+
+
+def _jacobian_add(p: Tuple[int, int, int], q: Point) -> Tuple[int, int, int]:
+    if q is None:
+        return p
+    x1, y1, z1 = p
+    if z1 == 0:
+        return q[0], q[1], 1
+    z1z1 = z1 * z1 % _P
+    h = (q[0] * z1z1 - x1) % _P
+    r = (q[1] * z1 * z1z1 - y1) % _P
+    if h == 0:
+        return _jacobian_double(p) if r == 0 else _INFINITY
+    hh = h * h % _P
+    hhh = h * hh % _P
+    v = x1 * hh % _P
+    x3 = (r * r - hhh - 2 * v) % _P
+    return x3, (r * (v - x3) - y1 * hhh) % _P, z1 * h % _P
+
+
+def _affine(p: Tuple[int, int, int]) -> Point:
+    x, y, z = p
+    if z == 0:
+        return None
+    z_inv = pow(z, -1, _P)
+    z_inv2 = z_inv * z_inv % _P
+    return x * z_inv2 % _P, y * z_inv2 * z_inv % _P
+
+
+def _multiply(point: Point, k: int) -> Point:
+    result = _INFINITY
+    for bit in bin(k)[2:]:
+        result = _jacobian_double(result)
+        if bit == "1":
+            result = _jacobian_add(result, point)
+    return _affine(result)
+
+
+def _batch_affine(points: List[Tuple[int, int, int]]) -> List[Point]:
+    """Normalize many Jacobian points with a single inversion (Montgomery's trick)."""
+    prefix, running = [], 1
+    for _, _, z in points:
+        prefix.append(running)
+        running = running * z % _P
+    inverse = pow(running, -1, _P)
+    result: List[Point] = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        x, y, z = points[i]
+        z_inv = inverse * prefix[i] % _P
+        inverse = inverse * z % _P
+        z_inv2 = z_inv * z_inv % _P
+        result[i] = (x * z_inv2 % _P, y * z_inv2 * z_inv % _P)
+    return result
+
+
+def _window_table(point: Point) -> List[List[Point]]:
+    """table[i][d] = d * 16^i * point: a scalar multiple is then ~64 additions."""
+    multiples = []
+    for _ in range(64):
+        entry = (point[0], point[1], 1)
+        for _ in range(15):
+            multiples.append(entry)
+            entry = _jacobian_add(entry, point)
+        point = _affine(entry)
+    points = _batch_affine(multiples)
+    return [[None] + points[i:i + 15] for i in range(0, len(points), 15)]
+
+
+def _multiply_tables(*terms: Tuple[List[List[Point]], int]) -> Point:
+    """Sum of k * P over (table of P, k) terms, in one accumulator."""
+    result = _INFINITY
+    for table, k in terms:
+        for row in table:
+            if k & 15:
+                result = _jacobian_add(result, row[k & 15])
+            k >>= 4
+    return _affine(result)
+
+
+_G_TABLE: Optional[List[List[Point]]] = None
+
+
+def _g_table() -> List[List[Point]]:
+    global _G_TABLE
+    if _G_TABLE is None:
+        _G_TABLE = _window_table(_G)
+    return _G_TABLE
+
+
+def _deterministic_k(private_key: int, z: int) -> int:
+    """RFC 6979 nonce (HMAC-SHA256), so signing needs no randomness source."""
+    x, h = private_key.to_bytes(32, "big"), (z % _N).to_bytes(32, "big")
+    k, v = b"\x00" * 32, b"\x01" * 32
+    k = hmac.new(k, v + b"\x00" + x + h, hashlib.sha256).digest()
+    v = hmac.new(k, v, hashlib.sha256).digest()
+    k = hmac.new(k, v + b"\x01" + x + h, hashlib.sha256).digest()
+    v = hmac.new(k, v, hashlib.sha256).digest()
+    while True:
+        v = hmac.new(k, v, hashlib.sha256).digest()
+        candidate = int.from_bytes(v, "big")
+        if 1 <= candidate < _N:
+            return candidate
+        k = hmac.new(k, v + b"\x00", hashlib.sha256).digest()
+        v = hmac.new(k, v, hashlib.sha256).digest()
+
+
+def _split_signature(signature: bytes) -> Optional[Tuple[int, int, int]]:
+    """(r, s, recovery id) of a 65-byte r || s || v signature, low-s only."""
+    if len(signature) != 65:
+        return None
+    r, s, v = int.from_bytes(signature[:32], "big"), int.from_bytes(signature[32:64], "big"), signature[64]
+    recovery_id = v - 27 if v >= 27 else v
+    if not (0 < r < _N and 0 < s <= _N // 2 and recovery_id in (0, 1)):
+        return None
+    return r, s, recovery_id
+
+
+def _recover_point(digest: bytes, signature: bytes) -> Point:
+    parts = _split_signature(signature)
+    if parts is None:
+        return None
+    r, s, recovery_id = parts
+    alpha = (pow(r, 3, _P) + 7) % _P
+    beta = pow(alpha, (_P + 1) // 4, _P)
+    if beta * beta % _P != alpha:
+        return None
+    y = beta if beta % 2 == recovery_id else _P - beta
+    r_inv = pow(r, -1, _N)
+    z = int.from_bytes(digest, "big")
+    return _add(_multiply_tables((_g_table(), -z * r_inv % _N)), _multiply((r, y), s * r_inv % _N))
+
+
+def _verify_table(table: List[List[Point]], digest: bytes, signature: bytes) -> bool:
+    parts = _split_signature(signature)
+    if parts is None:
+        return False
+    r, s, _ = parts
+    s_inv = pow(s, -1, _N)
+    z = int.from_bytes(digest, "big")
+    point = _multiply_tables((_g_table(), z * s_inv % _N), (table, r * s_inv % _N))
+    return point is not None and point[0] % _N == r
+
+
+def _address(public_key: bytes) -> str:
+    """0x address of a 64-byte uncompressed public key (x || y)."""
+    return "0x" + keccak256(public_key)[12:].hex()
+
+
+def _point_bytes(point: Tuple[int, int]) -> bytes:
+    return point[0].to_bytes(32, "big") + point[1].to_bytes(32, "big")
+
+
+def address_of(private_key: bytes) -> str:
+    if COINCURVE_AVAILABLE:
+        return _address(PrivateKey(private_key).public_key.format(compressed=False)[1:])
+    return _address(_point_bytes(_multiply_tables((_g_table(), int.from_bytes(private_key, "big")))))
+
+
+def sign_digest(private_key: bytes, digest: bytes) -> bytes:
+    """65-byte Ethereum signature (r || s || v, v = 27/28, low s)."""
+    if COINCURVE_AVAILABLE:
+        signature = PrivateKey(private_key).sign_recoverable(digest, hasher=None)
+        return signature[:64] + bytes([27 + signature[64]])
+    d, z = int.from_bytes(private_key, "big"), int.from_bytes(digest, "big")
+    k = _deterministic_k(d, z)
+    point = _multiply_tables((_g_table(), k))
+    r = point[0] % _N
+    s = pow(k, -1, _N) * (z + r * d) % _N
+    recovery_id = point[1] & 1
+    if s > _N // 2:
+        s, recovery_id = _N - s, recovery_id ^ 1
+    return r.to_bytes(32, "big") + s.to_bytes(32, "big") + bytes([27 + recovery_id])
+
+
+def recover_public_key(digest: bytes, signature: bytes) -> Optional[bytes]:
+    """64-byte public key that produced the signature, or None if it is malformed."""
+    if COINCURVE_AVAILABLE:
+        if _split_signature(signature) is None:
+            return None
+        try:
+            compact = signature[:64] + bytes([signature[64] - 27 if signature[64] >= 27 else signature[64]])
+            return PublicKey.from_signature_and_message(compact, digest, hasher=None).format(compressed=False)[1:]
+        except Exception:
+            return None
+    point = _recover_point(digest, signature)
+    return _point_bytes(point) if point is not None else None
+
+# ============================================================================
+# Vouchers
+# ============================================================================
+
+_PERSONAL_PREFIX = b"\x19Ethereum Signed Message:\n32"
+
+
+def _hex_bytes(value: str, length: int, what: str) -> bytes:
+    if not value.startswith("0x") or len(value) != 2 + 2 * length:
+        raise ValueError(f"{what} must be 0x followed by {2 * length} hex digits")
+    try:
+        return bytes.fromhex(value[2:])
+    except ValueError:
+        raise ValueError(f"{what} must be 0x followed by {2 * length} hex digits")
+
+
+def channel_id_for(payer: str, vendor: str, deposit_tx: str) -> str:
+    return "0x" + keccak256(
+        _hex_bytes(payer.lower(), 20, "payer") + _hex_bytes(vendor.lower(), 20, "vendor")
+        + _hex_bytes(deposit_tx.lower(), 32, "deposit_tx")
+    ).hex()
+
+
+class Voucher:
+    """
+    "The payer owes `cumulative_wei` in total on this channel", signed by
+    the payer with personal_sign over keccak256(channel_id || vendor ||
+    uint256 cumulative_wei). Each voucher supersedes the previous one, so a
+    replayed voucher is worth nothing.
+
+    Sent as:  Authorization: Voucher <channel_id>:<cumulative_wei>:<signature>
+    """
+
+    SCHEME = "Voucher "
+
+    def __init__(self, channel_id: str, cumulative_wei: int, signature: bytes):
+        self.channel_id = channel_id.lower()
+        self.cumulative_wei = cumulative_wei
+        self.signature = signature
+
+    @classmethod
+    def is_voucher(cls, authorization: Optional[str]) -> bool:
+        return bool(authorization) and authorization.startswith(cls.SCHEME)
+
+    @classmethod
+    def parse(cls, authorization: str) -> "Voucher":
+        parts = authorization[len(cls.SCHEME):].strip().split(":")
+        if len(parts) != 3:
+            raise ValueError("Malformed voucher (expected <channel_id>:<cumulative_wei>:<signature>)")
+        channel_id, cumulative, signature = parts
+        try:
+            _hex_bytes(channel_id, 32, "channel id")
+            cumulative_wei = int(cumulative)
+        except ValueError as e:
+            raise ValueError(f"Malformed voucher ({str(e)})")
+        if cumulative_wei < 0:
+            raise ValueError("Malformed voucher (cumulative amount must not be negative)")
+        return cls(channel_id, cumulative_wei, _hex_bytes(signature, 65, "signature"))
+
+    def digest(self, vendor: str) -> bytes:
+        message = keccak256(
+            bytes.fromhex(self.channel_id[2:]) + _hex_bytes(vendor.lower(), 20, "vendor")
+            + self.cumulative_wei.to_bytes(32, "big")
+        )
+        return keccak256(_PERSONAL_PREFIX + message)
+
+    def header(self) -> str:
+        return f"{self.SCHEME}{self.channel_id}:{self.cumulative_wei}:0x{self.signature.hex()}"
+
+
+def sign_voucher(private_key: bytes, channel_id: str, vendor: str, cumulative_wei: int) -> Voucher:
+    """What an agent does client-side; used by tests and benchmarks with local keys."""
+    voucher = Voucher(channel_id, cumulative_wei, b"")
+    voucher.signature = sign_digest(private_key, voucher.digest(vendor))
+    return voucher
+
+
+class VoucherVerifier:
+    """
+    Checks voucher signatures in batches on a worker thread.
+
+    A channel always has the same signer, so the first voucher recovers the
+    payer's public key and later ones are verified against the cached key.
+    Without coincurve the cache holds a precomputed window table per key,
+    which makes a verification ~2 x 64 point additions instead of a full
+    recovery. Requests queue their voucher and await the batch's result, so
+    the event loop never runs the curve math.
+    """
+
+    def __init__(self, batch_size: int = 64, max_keys: int = 128):
+        self.batch_size = batch_size
+        self.max_keys = max_keys
+        # signer address -> public key (coincurve) or window table (pure Python)
+        self._keys: "OrderedDict[str, Any]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self.verified = 0
+        self.rejected = 0
+        self.batches = 0
+        self.key_hits = 0
+
+    def check(self, digest: bytes, signature: bytes, signer: str) -> bool:
+        signer = signer.lower()
+        key = self._keys.get(signer)
+        if key is not None:
+            self._keys.move_to_end(signer)
+            self.key_hits += 1
+            if COINCURVE_AVAILABLE:
+                valid = recover_public_key(digest, signature) == key
+            else:
+                valid = _verify_table(key, digest, signature)
+        else:
+            public_key = recover_public_key(digest, signature)
+            valid = public_key is not None and _address(public_key) == signer
+            if valid:
+                if COINCURVE_AVAILABLE:
+                    self._keys[signer] = public_key
+                else:
+                    self._keys[signer] = _window_table((int.from_bytes(public_key[:32], "big"),
+                                                        int.from_bytes(public_key[32:], "big")))
+                while len(self._keys) > self.max_keys:
+                    self._keys.popitem(last=False)
+        if valid:
+            self.verified += 1
+        else:
+            self.rejected += 1
+        return valid
+
+    def _check_batch(self, batch: List[Tuple[bytes, bytes, str, asyncio.Future]]) -> List[bool]:
+        return [self.check(digest, signature, signer) for digest, signature, signer, _ in batch]
+
+    async def verify(self, digest: bytes, signature: bytes, signer: str) -> bool:
+        if self._queue is None:
+            # Verifier not running (e.g. scripts): check inline
+            return self.check(digest, signature, signer)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((digest, signature, signer, future))
+        return await future
+
+    async def run(self):
+        self._queue = asyncio.Queue()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                results = await asyncio.to_thread(self._check_batch, batch)
+            except Exception as e:
+                logger.error(f"[CHANNELS] Verification batch of {len(batch)} failed: {str(e)}")
+                results = [False] * len(batch)
+            self.batches += 1
+            for (_, _, _, future), valid in zip(batch, results):
+                if not future.done():
+                    future.set_result(valid)
+
+# ============================================================================
+# Channels
+# ============================================================================
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS channels (
+    id           TEXT PRIMARY KEY,
+    payer        TEXT NOT NULL,
+    vendor       TEXT NOT NULL,
+    deposit_wei  TEXT NOT NULL,
+    deposit_tx   TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    accepted_wei TEXT NOT NULL,
+    voucher_sig  TEXT,
+    settled_wei  TEXT NOT NULL,
+    opened_at    REAL NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settlements (
+    seq            INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel_id     TEXT NOT NULL,
+    amount_wei     TEXT NOT NULL,
+    cumulative_wei TEXT NOT NULL,
+    voucher_sig    TEXT,
+    reference      TEXT,
+    settled_at     REAL NOT NULL
+);
+"""
+
+
+class Channel:
+    def __init__(self, channel_id: str, payer: str, vendor: str, deposit_wei: int, deposit_tx: str):
+        self.id = channel_id
+        self.payer = payer.lower()
+        self.vendor = vendor.lower()
+        self.deposit_wei = deposit_wei
+        self.deposit_tx = deposit_tx
+        # pending_deposit -> open -> closed (or failed)
+        self.status = "pending_deposit"
+        self.accepted_wei = 0
+        self.voucher_sig: Optional[str] = None
+        self.settled_wei = 0
+        self.opened_at = time.time()
+        self.updated_at = self.opened_at
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "channel_id": self.id,
+            "status": self.status,
+            "payer": self.payer,
+            "vendor": self.vendor,
+            "deposit_wei": str(self.deposit_wei),
+            "deposit_tx": self.deposit_tx,
+            "accepted_wei": str(self.accepted_wei),
+            "remaining_wei": str(self.deposit_wei - self.accepted_wei),
+            "settled_wei": str(self.settled_wei),
+            "error": self.error
+        }
+
+    def _row(self) -> Tuple:
+        return (self.id, self.payer, self.vendor, str(self.deposit_wei), self.deposit_tx, self.status,
+                str(self.accepted_wei), self.voucher_sig, str(self.settled_wei), self.opened_at, self.updated_at)
+
+    @classmethod
+    def _from_row(cls, row) -> "Channel":
+        (channel_id, payer, vendor, deposit_wei, deposit_tx, status,
+         accepted_wei, voucher_sig, settled_wei, opened_at, updated_at) = row
+        channel = cls(channel_id, payer, vendor, int(deposit_wei), deposit_tx)
+        channel.status = status
+        channel.accepted_wei = int(accepted_wei)
+        channel.voucher_sig = voucher_sig
+        channel.settled_wei = int(settled_wei)
+        channel.opened_at = opened_at
+        channel.updated_at = updated_at
+        return channel
+
+
+class ChannelLedger:
+    """
+    Channel balances in memory, checkpointed to SQLite.
+
+    A paid job charges the voucher's increment over the last accepted
+    cumulative amount, synchronously and without an await, inside the
+    device transition; if the job then fails the charge is rolled back.
+    The charged channel's row is written before the job's result is
+    returned (persist), so a crash cannot let the payer replay a voucher
+    that already bought something. Other changes (deposits, status,
+    settlements) are checkpointed every checkpoint_interval and on
+    shutdown; a failed checkpoint keeps them queued for the next one. Every
+    settle_interval the best voucher of each channel with unsettled value is
+    handed to `settler` (e.g. submitted to the channel contract) and
+    recorded as a settlement.
+    """
+
+    def __init__(self, path: Optional[str], verifier: VoucherVerifier, checkpoint_interval: float = 5.0,
+                 settle_interval: float = 300.0,
+                 settler: Optional[Callable[[Channel, int], Any]] = None):
+        self.path = path
+        self.verifier = verifier
+        self.checkpoint_interval = checkpoint_interval
+        self.settle_interval = settle_interval
+        self.settler = settler
+        self.channels: Dict[str, Channel] = {}
+        self._dirty: set = set()
+        self._settlements: List[Tuple] = []
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+            for row in self._db.execute("SELECT * FROM channels"):
+                channel = Channel._from_row(row)
+                self.channels[channel.id] = channel
+
+    def _touch(self, channel: Channel):
+        channel.updated_at = time.time()
+        self._dirty.add(channel.id)
+
+    def get(self, channel_id: str) -> Optional[Channel]:
+        return self.channels.get(channel_id.lower())
+
+    def open(self, payer: str, vendor: str, deposit_wei: int, deposit_tx: str) -> Channel:
+        if deposit_wei <= 0:
+            raise PaymentError("Channel deposit must be positive")
+        channel_id = channel_id_for(payer, vendor, deposit_tx)
+        if channel_id in self.channels:
+            raise PaymentError(f"Deposit {deposit_tx} already opened channel {channel_id}")
+        channel = Channel(channel_id, payer, vendor, deposit_wei, deposit_tx)
+        self.channels[channel_id] = channel
+        self._touch(channel)
+        return channel
+
+    def activate(self, channel: Channel) -> Dict[str, Any]:
+        """Deposit confirmed (payment pipeline callback, or at once without verification)."""
+        channel.status = "open"
+        self._touch(channel)
+        logger.info(f"[CHANNELS] Channel {channel.id[:10]}... open with {channel.deposit_wei} wei")
+        return channel.to_dict()
+
+    def fail(self, channel: Channel, error: str):
+        channel.status = "failed"
+        channel.error = error
+        self._touch(channel)
+
+    async def authorize(self, voucher: Voucher, vendor: str) -> Channel:
+        """The channel the voucher draws on, once its signature checks out (no balance change)."""
+        channel = self.channels.get(voucher.channel_id)
+        if channel is None:
+            raise PaymentError(f"Unknown payment channel {voucher.channel_id}")
+        if channel.vendor != vendor.lower():
+            raise PaymentError("Payment channel belongs to another vendor")
+        if channel.status != "open":
+            raise PaymentError(f"Payment channel is {channel.status}")
+        if not await self.verifier.verify(voucher.digest(vendor), voucher.signature, channel.payer):
+            raise PaymentError("Voucher signature does not match the channel payer")
+        return channel
+
+    def charge(self, channel: Channel, voucher: Voucher, price_wei: int) -> Tuple[int, Optional[str]]:
+        """Accept the voucher for `price_wei`; returns what refund() needs to undo it."""
+        if channel.status != "open":
+            raise PaymentError(f"Payment channel is {channel.status}")
+        if voucher.cumulative_wei > channel.deposit_wei:
+            raise PaymentError(f"Voucher exceeds the channel deposit ({channel.deposit_wei} wei)")
+        increment = voucher.cumulative_wei - channel.accepted_wei
+        if increment < price_wei:
+            raise PaymentError(
+                f"Voucher adds {max(increment, 0)} wei over the accepted {channel.accepted_wei} wei; "
+                f"this action costs {price_wei} wei"
+            )
+        previous = (channel.accepted_wei, channel.voucher_sig)
+        channel.accepted_wei = voucher.cumulative_wei
+        channel.voucher_sig = "0x" + voucher.signature.hex()
+        self._touch(channel)
+        return previous
+
+    def refund(self, channel: Channel, previous: Tuple[int, Optional[str]]):
+        channel.accepted_wei, channel.voucher_sig = previous
+        self._touch(channel)
+
+    async def settle(self, channel: Channel) -> int:
+        amount = channel.accepted_wei - channel.settled_wei
+        if amount <= 0:
+            return 0
+        reference = None
+        if self.settler is not None:
+            reference = self.settler(channel, amount)
+            if inspect.isawaitable(reference):
+                reference = await reference
+        channel.settled_wei = channel.accepted_wei
+        self._settlements.append((channel.id, str(amount), str(channel.accepted_wei), channel.voucher_sig,
+                                  reference, time.time()))
+        self._touch(channel)
+        logger.info(f"[CHANNELS] Settled {amount} wei on {channel.id[:10]}... ({reference or 'recorded'})")
+        return amount
+
+    async def close(self, voucher: Voucher, vendor: str) -> Channel:
+        """
+        Payer-initiated close: the payer re-signs the accepted total, which
+        proves who is asking without letting the close move any value.
+        """
+        channel = await self.authorize(voucher, vendor)
+        if voucher.cumulative_wei != channel.accepted_wei:
+            raise PaymentError(f"Closing voucher must be for the accepted {channel.accepted_wei} wei")
+        await self.settle(channel)
+        channel.status = "closed"
+        self._touch(channel)
+        logger.info(f"[CHANNELS] Channel {channel.id[:10]}... closed, {channel.deposit_wei - channel.accepted_wei} wei unspent")
+        return channel
+
+    async def settle_all(self) -> int:
+        settled = 0
+        for channel in list(self.channels.values()):
+            if channel.status == "open" and channel.accepted_wei > channel.settled_wei:
+                try:
+                    settled += await self.settle(channel)
+                except Exception as e:
+                    logger.error(f"[CHANNELS] Settlement of {channel.id[:10]}... failed: {str(e)}")
+        return settled
+
+    def _take_checkpoint(self) -> Tuple[set, List[Tuple], List[Tuple]]:
+        """Rows are copied here, on the loop, so the writer thread never reads live channels."""
+        dirty, self._dirty = self._dirty, set()
+        settlements, self._settlements = self._settlements, []
+        rows = [self.channels[channel_id]._row() for channel_id in dirty]
+        return dirty, rows, settlements
+
+    def _restore_checkpoint(self, dirty: set, settlements: List[Tuple]):
+        """Requeue a checkpoint whose write failed."""
+        self._dirty |= dirty
+        self._settlements[:0] = settlements
+
+    def _write(self, rows: List[Tuple], settlements: List[Tuple]):
+        if self._db is None or not (rows or settlements):
+            return
+        with self._db_lock, self._db:
+            self._db.executemany(f"INSERT OR REPLACE INTO channels VALUES ({', '.join('?' * 11)})", rows)
+            self._db.executemany(
+                "INSERT INTO settlements (channel_id, amount_wei, cumulative_wei, voucher_sig, reference, settled_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                settlements
+            )
+
+    async def run(self):
+        next_settle = time.monotonic() + self.settle_interval
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            if time.monotonic() >= next_settle:
+                await self.settle_all()
+                next_settle = time.monotonic() + self.settle_interval
+            dirty, rows, settlements = self._take_checkpoint()
+            try:
+                await asyncio.to_thread(self._write, rows, settlements)
+            except Exception as e:
+                self._restore_checkpoint(dirty, settlements)
+                logger.error(f"[CHANNELS] Checkpoint failed, {len(dirty)} channels kept for the next one: {str(e)}")
+
+    async def persist(self, channel: Channel):
+        """Write one channel's row now (after a voucher charge, before the job result goes out)."""
+        if self._db is None:
+            return
+        row = channel._row()
+        try:
+            await asyncio.to_thread(self._write, [row], [])
+        except Exception as e:
+            # Still dirty, so the next checkpoint retries it
+            logger.error(f"[CHANNELS] Could not persist {channel.id[:10]}...: {str(e)}")
+
+    def flush(self):
+        """Write every unsaved change (shutdown)."""
+        dirty, rows, settlements = self._take_checkpoint()
+        try:
+            self._write(rows, settlements)
+        except Exception:
+            self._restore_checkpoint(dirty, settlements)
+            raise
+
+    def close_store(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None